@@ -1,12 +1,25 @@
 from datetime import datetime, timedelta
 from airflow import DAG
+from airflow.models import Variable
 from docker.types import Mount
 
 from airflow.operators.python_operator import PythonOperator
+from airflow.operators.python import ShortCircuitOperator
 from airflow.operators.bash import BashOperator
 
 from airflow.providers.docker.operators.docker import DockerOperator
-import subprocess, os
+from contextlib import closing
+import subprocess, os, sys
+
+# Add elt directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../elt'))
+
+from db import connect, table_write_counts
+
+# Source tables the dbt models read, and the Variable holding their write
+# counts as of the last successful dbt run
+DBT_SOURCES = ('facilities', 'patients', 'medical_records', 'triage_visits')
+SOURCE_WRITES_VARIABLE = 'elt_and_dbt_source_writes'
  
 default_args = {
     'owner': 'airflow',
@@ -26,6 +39,30 @@ def run_elt_script():
         print(result.stdout)
 
 
+def select_changed_models(**context):
+    """Select the models downstream of sources written since the last dbt run; skip dbt when there are none"""
+    with closing(connect()) as connection:
+        writes = table_write_counts(connection, DBT_SOURCES)
+    previous = Variable.get(SOURCE_WRITES_VARIABLE, default_var={}, deserialize_json=True)
+    changed = [table for table in DBT_SOURCES if writes.get(table) != previous.get(table)]
+
+    context['ti'].xcom_push(key='source_writes', value=writes)
+    if not changed:
+        print("No source table was written since the last dbt run; skipping dbt")
+        return False
+
+    selection = ' '.join(f'source:public.{table}+' for table in changed)
+    print(f"Changed sources: {', '.join(changed)}; selecting {selection}")
+    context['ti'].xcom_push(key='selection', value=selection)
+    return True
+
+
+def record_source_writes(**context):
+    """Remember the write counts dbt has now caught up with"""
+    writes = context['ti'].xcom_pull(key='source_writes', task_ids='select_changed_models')
+    Variable.set(SOURCE_WRITES_VARIABLE, writes, serialize_json=True)
+
+
 dag = DAG(
     'elt_and_dbt',
     default_args=default_args,
@@ -33,6 +70,8 @@ dag = DAG(
     schedule_interval='*/5 * * * *', 
     start_date=datetime(2024, 10, 5),
     catchup=False,
+    # The source write counts and the rollups' watermarks assume one run at a time
+    max_active_runs=1,
 )
 
 t1 = PythonOperator(
@@ -41,16 +80,24 @@ t1 = PythonOperator(
     dag=dag,
 )
 
+t_select = ShortCircuitOperator(
+    task_id='select_changed_models',
+    python_callable=select_changed_models,
+    dag=dag,
+)
+
+# Incremental models merge only new rows; run with --full-refresh by hand to rebuild
 t2 = DockerOperator(
     task_id='dbt_run',
-    image='ghcr.io/dbt-labs/dbt-postgres:1.4.7',
+    image='ghcr.io/dbt-labs/dbt-postgres:1.7.4',
     command=[
         "run",
         "--profiles-dir",
         "/root",
         "--project-dir",
         "/opt/dbt",
-        "--full-refresh"
+        "--select",
+        "{{ ti.xcom_pull(task_ids='select_changed_models', key='selection') }}",
     ],
     auto_remove=True,
     docker_url="unix://var/run/docker.sock",
@@ -68,4 +115,10 @@ t2 = DockerOperator(
     dag=dag
 )
 
-t1 >> t2
\ No newline at end of file
+t_record = PythonOperator(
+    task_id='record_source_writes',
+    python_callable=record_source_writes,
+    dag=dag,
+)
+
+t1 >> t_select >> t2 >> t_record
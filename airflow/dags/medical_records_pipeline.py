@@ -1,6 +1,6 @@
 """
 Airflow DAG for Medical Records ETL Pipeline
-Extracts CSV files from S3, loads to PostgreSQL, transforms with ID generation, 
+Extracts CSV files from S3, validates them, loads to PostgreSQL, transforms with ID generation, 
 and runs dbt models
 """
 from airflow import DAG
@@ -14,8 +14,12 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../elt'))
 
 from extract_from_s3 import S3Extractor
-from load_to_postgres import PostgresLoader
+from load_to_postgres import PostgresLoader, plan_loads
 from generate_ids import IDGenerator
+from validate import Validator
+
+# Airflow pool bounding how many load parts run at once (created by init-airflow)
+LOAD_POOL = os.getenv('LOAD_POOL', 'medilink_loads')
 
 default_args = {
     'owner': 'data-team',
@@ -41,6 +45,7 @@ def extract_from_s3(**context):
     """Extract CSV files from S3"""
     extractor = S3Extractor()
     files = extractor.extract_all()
+    print(f"Extract stats: {extractor.last_stats}")
     
     # Push file info to XCom for next tasks
     context['ti'].xcom_push(key='downloaded_files', value=files)
@@ -48,61 +53,47 @@ def extract_from_s3(**context):
     return len(files)
 
 
-def load_facilities(**context):
-    """Load facilities data"""
+def validate_files(**context):
+    """Validate the extracted files, quarantining rows that fail"""
     files = context['ti'].xcom_pull(key='downloaded_files', task_ids='extract_from_s3')
-    loader = PostgresLoader()
-    
-    for file_info in files:
-        if 'facilities' in file_info['filename'].lower():
-            count = loader.load_facilities(file_info['local_path'])
-            return count
+    validator = Validator(batch_id=context['run_id'])
+    results = validator.validate_all(files)
+    print(f"Validation results: {results}")
     
-    return 0
+    return results
 
 
-def load_patients(**context):
-    """Load patients data"""
+def plan_load_parts(**context):
+    """Split the validated files into load parts, one mapped load task each"""
     files = context['ti'].xcom_pull(key='downloaded_files', task_ids='extract_from_s3')
-    loader = PostgresLoader()
+    parts = plan_loads(files or [])
+    print(f"Planned {len(parts)} load parts for {len(files or [])} files")
     
-    for file_info in files:
-        if 'patients' in file_info['filename'].lower():
-            count = loader.load_patients(file_info['local_path'])
-            return count
-    
-    return 0
+    return parts
 
 
-def load_medical_records(**context):
-    """Load medical records data"""
-    files = context['ti'].xcom_pull(key='downloaded_files', task_ids='extract_from_s3')
-    loader = PostgresLoader()
+def load_file(name, path, row_groups, sequence, **context):
+    """Load one file, or a range of its row groups, into its staging table"""
+    loader = PostgresLoader(batch_id=context['run_id'])
+    loader.load(name, path, row_groups=row_groups, sequence=sequence)
     
-    for file_info in files:
-        if 'medical_records' in file_info['filename'].lower() or 'records' in file_info['filename'].lower():
-            count = loader.load_medical_records(file_info['local_path'])
-            return count
-    
-    return 0
+    return loader.last_stats
 
 
-def load_triage_visits(**context):
-    """Load triage visits data"""
-    files = context['ti'].xcom_pull(key='downloaded_files', task_ids='extract_from_s3')
-    loader = PostgresLoader()
+def commit_loads(**context):
+    """Total the load parts per entity once they have all finished"""
+    results = context['ti'].xcom_pull(task_ids='load_file') or []
+    loader = PostgresLoader(batch_id=context['run_id'])
+    totals = loader.commit_results(list(results))
     
-    for file_info in files:
-        if 'triage' in file_info['filename'].lower():
-            count = loader.load_triage_visits(file_info['local_path'])
-            return count
+    context['ti'].xcom_push(key='load_results', value=totals)
     
-    return 0
+    return totals
 
 
 def generate_ids_transform(**context):
     """Transform staging data to production with ID generation"""
-    generator = IDGenerator()
+    generator = IDGenerator(batch_id=context['run_id'])
     results = generator.transform_all()
     
     context['ti'].xcom_push(key='transform_results', value=results)
@@ -111,19 +102,11 @@ def generate_ids_transform(**context):
 
 
 def archive_processed_files(**context):
-    """Archive processed files in S3"""
+    """Record processed files in the manifest and archive them in S3"""
     files = context['ti'].xcom_pull(key='downloaded_files', task_ids='extract_from_s3')
     extractor = S3Extractor()
     
-    archived_count = 0
-    for file_info in files:
-        try:
-            extractor.archive_file(file_info['s3_key'])
-            archived_count += 1
-        except Exception as e:
-            print(f"Failed to archive {file_info['filename']}: {str(e)}")
-    
-    return archived_count
+    return extractor.archive_files(files)
 
 
 # Define tasks
@@ -133,27 +116,30 @@ task_extract = PythonOperator(
     dag=dag,
 )
 
-task_load_facilities = PythonOperator(
-    task_id='load_facilities',
-    python_callable=load_facilities,
+task_validate = PythonOperator(
+    task_id='validate_files',
+    python_callable=validate_files,
     dag=dag,
 )
 
-task_load_patients = PythonOperator(
-    task_id='load_patients',
-    python_callable=load_patients,
+task_plan_loads = PythonOperator(
+    task_id='plan_loads',
+    python_callable=plan_load_parts,
     dag=dag,
 )
 
-task_load_medical_records = PythonOperator(
-    task_id='load_medical_records',
-    python_callable=load_medical_records,
+# One task instance per file (or part of a large file), run in parallel within LOAD_POOL
+task_load_files = PythonOperator.partial(
+    task_id='load_file',
+    python_callable=load_file,
+    pool=LOAD_POOL,
     dag=dag,
-)
+).expand(op_kwargs=task_plan_loads.output)
 
-task_load_triage_visits = PythonOperator(
-    task_id='load_triage_visits',
-    python_callable=load_triage_visits,
+task_commit_loads = PythonOperator(
+    task_id='commit_loads',
+    python_callable=commit_loads,
+    trigger_rule='none_failed',  # still runs when there was nothing to load
     dag=dag,
 )
 
@@ -182,8 +168,5 @@ task_archive = PythonOperator(
 )
 
 # Define task dependencies
-task_extract >> [task_load_facilities, task_load_patients, task_load_medical_records, task_load_triage_visits]
-[task_load_facilities, task_load_patients] >> task_load_medical_records
-[task_load_facilities, task_load_patients] >> task_load_triage_visits
-[task_load_medical_records, task_load_triage_visits] >> task_transform
-task_transform >> task_dbt_run >> task_dbt_test >> task_archive
\ No newline at end of file
+task_extract >> task_validate >> task_plan_loads >> task_load_files >> task_commit_loads
+task_commit_loads >> task_transform >> task_dbt_run >> task_dbt_test >> task_archive
@@ -1,11 +1,13 @@
 """
 Flask API for Medical Records System
 """
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 from flask_cors import CORS
+from flask_migrate import Migrate
 from datetime import datetime
-import os
+import sys
 import logging
+import click
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,29 +17,32 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# Database configuration - Clean the host value
-DB_HOST = os.getenv('POSTGRES_HOST', 'localhost').replace('http://', '').replace('https://', '').strip('/')
-DB_PORT = os.getenv('POSTGRES_PORT', '5432')
-DB_USER = os.getenv('POSTGRES_USER', 'postgres')
-DB_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'secret')
-DB_NAME = os.getenv('POSTGRES_DB', 'postgres')
+# Database configuration (see config.py for the POSTGRES_* / POSTGRES_READ_* variables)
+from config import PRIMARY, PRIMARY_ENGINE_OPTIONS, READ_REPLICA, READ_REPLICA_ENGINE_OPTIONS
+from config import database_uri, redacted_uri
 
-# Construct database URI
-DATABASE_URI = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+DB_HOST = PRIMARY['host']
+DB_PORT = PRIMARY['port']
+DB_NAME = PRIMARY['db']
 
-logger.info(f"Connecting to database: postgresql://{DB_USER}:***@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+logger.info(f"Connecting to database: {redacted_uri(PRIMARY)}")
 
-app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(PRIMARY)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_pre_ping': True,
-    'pool_recycle': 300,
-}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = PRIMARY_ENGINE_OPTIONS
+
+# Optional read replica; GET requests are routed to it (see database.RoutingSession)
+if READ_REPLICA:
+    logger.info(f"Routing reads to replica: {redacted_uri(READ_REPLICA)}")
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': {'url': database_uri(READ_REPLICA), **READ_REPLICA_ENGINE_OPTIONS},
+    }
 
 # Import and initialize database
-from database import db
+from database import db, init_read_routing
 db.init_app(app)
+init_read_routing(app)
 
 # Import models and schemas AFTER db initialization
 from models import Facility, Patient, MedicalRecord, TriageVisit, RecordRequest
@@ -45,10 +50,33 @@ from schemas import (
     FacilityCreate, FacilityOut,
     PatientCreate, PatientOut,
     MedicalRecordCreate, MedicalRecordOut,
-    TriageVisitOut,
     RecordRequestCreate, RecordRequestOut
 )
 
+# Schema migrations (Alembic, via Flask-Migrate): `flask db upgrade`
+migrate = Migrate(app, db)
+from pagination import InvalidCursorError, keyset_paginate
+from filters import InvalidFilterError, apply_record_filters
+from export import EXPORT_ENTITIES, EXPORT_FORMATS, stream_export
+from serializers import (
+    FACILITY_COLUMNS, PATIENT_COLUMNS, MEDICAL_RECORD_COLUMNS, TRIAGE_VISIT_COLUMNS, RECORD_REQUEST_COLUMNS,
+    columns_for, json_response, rows_to_dicts
+)
+from stats import stats_cache
+from cache import entity_caches, entity_response
+from geo import MAX_NEARBY_LIMIT, geo_index
+from explain import check_index_usage
+from search import MAX_SEARCH_LIMIT, MIN_QUERY_LENGTH, normalize_query, search_patients
+from bulk import BULK_ENTITIES, BulkRequestError, bulk_ingest, parse_bulk_body
+from timeline import patient_timeline
+from batch import BatchRequestError, batch_lookup
+from marts import MARTS, MartNotBuiltError, mart_cache, mart_page
+from transfers import (
+    COMPLETED, TRANSFER_BATCH_SIZE, TransferError, create_request, decide_request, package_path, run_worker
+)
+import metrics
+metrics.init_app(app, db)
+
 
 # Health check endpoint
 @app.route('/health', methods=['GET'])
@@ -57,12 +85,20 @@ def health_check():
     try:
         with db.engine.connect() as conn:
             conn.execute(db.text('SELECT 1'))
-        return jsonify({
+        health = {
             'status': 'healthy',
             'timestamp': datetime.utcnow().isoformat(),
             'database': 'connected',
             'host': DB_HOST
-        }), 200
+        }
+        if READ_REPLICA:
+            with db.engines['replica'].connect() as conn:
+                lag = conn.execute(db.text(
+                    'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())'
+                )).scalar()
+            health['replica_host'] = READ_REPLICA['host']
+            health['replica_lag_seconds'] = float(lag) if lag is not None else None
+        return jsonify(health), 200
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
         return jsonify({
@@ -81,11 +117,19 @@ def index():
         'version': '1.0.0',
         'endpoints': {
             'health': '/health',
+            'metrics': '/metrics',
             'facilities': '/api/facilities',
+            'nearby_facilities': '/api/facilities/nearby',
             'patients': '/api/patients',
+            'patient_search': '/api/patients/search',
+            'patient_timeline': '/api/patients/<id>/timeline',
+            'record_requests': '/api/record-requests',
             'medical_records': '/api/medical-records',
             'triage_visits': '/api/triage-visits',
-            'analytics': '/api/analytics/facility-stats'
+            'bulk': '/api/<facilities|patients|medical-records>/bulk',
+            'export': '/api/export/<medical-records|triage-visits>',
+            'analytics': '/api/analytics/facility-stats',
+            'marts': '/api/analytics/<facility-performance|patient-summary|triage-trends|condition-analysis>'
         }
     }), 200
 
@@ -95,7 +139,11 @@ def index():
 def get_facilities():
     """Get all facilities with optional filtering"""
     try:
-        query = db.session.query(Facility)
+        # Batch lookup: ?ids=1,2,3[&fields=...]
+        if 'ids' in request.args:
+            return json_response(batch_lookup(Facility, FACILITY_COLUMNS, request.args))
+        
+        query = db.session.query(*FACILITY_COLUMNS)
         
         state = request.args.get('state')
         lga = request.args.get('lga')
@@ -113,27 +161,60 @@ def get_facilities():
         
         facilities = query.paginate(page=page, per_page=per_page, error_out=False)
         
-        return jsonify({
-            'data': [FacilityOut.model_validate(f).model_dump() for f in facilities.items],
+        return json_response({
+            'data': rows_to_dicts(facilities.items),
             'total': facilities.total,
             'page': page,
             'per_page': per_page,
             'pages': facilities.pages
-        }), 200
+        })
         
+    except BatchRequestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting facilities: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/facilities/nearby', methods=['GET'])
+def get_nearby_facilities():
+    """Get the facilities nearest to a point, optionally within a radius"""
+    try:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        limit = min(request.args.get('limit', 10, type=int), MAX_NEARBY_LIMIT)
+        radius_km = request.args.get('radius_km', type=float)
+        
+        if lat is None or lon is None or not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            return jsonify({'error': 'lat and lon are required and must be valid coordinates'}), 400
+        if limit < 1 or (radius_km is not None and radius_km <= 0):
+            return jsonify({'error': 'limit and radius_km must be positive'}), 400
+        
+        results = geo_index.nearby(lat, lon, limit=limit, radius_km=radius_km)
+        
+        return json_response({
+            'data': [dict(facility, distance_km=round(distance, 3)) for distance, facility in results],
+            'lat': lat,
+            'lon': lon,
+            'limit': limit,
+            'radius_km': radius_km
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting nearby facilities: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/facilities/<int:facility_id>', methods=['GET'])
 def get_facility(facility_id):
     """Get a specific facility by ID"""
     try:
-        facility = db.session.get(Facility, facility_id)
-        if not facility:
+        response = entity_response(
+            'facilities', facility_id, lambda i: db.session.get(Facility, i), FacilityOut
+        )
+        if response is None:
             return jsonify({'error': 'Facility not found'}), 404
-        return jsonify(FacilityOut.model_validate(facility).model_dump()), 200
+        return response
     except Exception as e:
         logger.error(f"Error getting facility {facility_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -157,8 +238,13 @@ def create_facility():
         
         db.session.add(facility)
         db.session.commit()
+        entity_caches['facilities'].invalidate(facility.id)
+        stats_cache.record_inserts('facilities', [{'id': facility.id, 'state': facility.state}])
         
-        return jsonify(FacilityOut.model_validate(facility).model_dump()), 201
+        facility_out = FacilityOut.model_validate(facility).model_dump()
+        geo_index.add(facility_out)
+        
+        return jsonify(facility_out), 201
         
     except Exception as e:
         db.session.rollback()
@@ -171,7 +257,11 @@ def create_facility():
 def get_patients():
     """Get all patients"""
     try:
-        query = db.session.query(Patient)
+        # Batch lookup: ?ids=1,2,3[&fields=...][&expand=facility]
+        if 'ids' in request.args:
+            return json_response(batch_lookup(Patient, PATIENT_COLUMNS, request.args))
+        
+        query = db.session.query(*PATIENT_COLUMNS)
         
         facility_id = request.args.get('facility_id', type=int)
         if facility_id:
@@ -182,32 +272,83 @@ def get_patients():
         
         patients = query.paginate(page=page, per_page=per_page, error_out=False)
         
-        return jsonify({
-            'data': [PatientOut.model_validate(p).model_dump() for p in patients.items],
+        return json_response({
+            'data': rows_to_dicts(patients.items),
             'total': patients.total,
             'page': page,
             'per_page': per_page,
             'pages': patients.pages
-        }), 200
+        })
         
+    except BatchRequestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting patients: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/patients/search', methods=['GET'])
+def search_patients_endpoint():
+    """Typo-tolerant search for patients by name or phone"""
+    try:
+        q = normalize_query(request.args.get('q'))
+        facility_id = request.args.get('facility_id', type=int)
+        limit = min(request.args.get('limit', 20, type=int), MAX_SEARCH_LIMIT)
+        
+        if len(q) < MIN_QUERY_LENGTH:
+            return jsonify({'error': f"q must be at least {MIN_QUERY_LENGTH} characters"}), 400
+        
+        patients = search_patients(q, facility_id=facility_id, limit=limit)
+        data = rows_to_dicts(patients)
+        for patient in data:
+            patient['score'] = round(patient['score'], 4)
+        
+        return json_response({'data': data, 'q': q, 'limit': limit})
+        
+    except Exception as e:
+        logger.error(f"Error searching patients: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/patients/<int:patient_id>', methods=['GET'])
 def get_patient(patient_id):
     """Get a specific patient by ID"""
     try:
-        patient = db.session.get(Patient, patient_id)
-        if not patient:
+        response = entity_response(
+            'patients', patient_id, lambda i: db.session.get(Patient, i), PatientOut
+        )
+        if response is None:
             return jsonify({'error': 'Patient not found'}), 404
-        return jsonify(PatientOut.model_validate(patient).model_dump()), 200
+        return response
     except Exception as e:
         logger.error(f"Error getting patient {patient_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/patients/<int:patient_id>/timeline', methods=['GET'])
+def get_patient_timeline(patient_id):
+    """Get a patient's medical records and triage visits as one time-ordered stream"""
+    try:
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+        result = patient_timeline(patient_id, cursor=request.args.get('cursor'), per_page=per_page)
+        if result is None:
+            return jsonify({'error': 'Patient not found'}), 404
+        
+        patient, entries, next_cursor = result
+        return json_response({
+            'patient': patient,
+            'data': entries,
+            'per_page': per_page,
+            'next_cursor': next_cursor
+        })
+        
+    except InvalidCursorError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting timeline for patient {patient_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/patients', methods=['POST'])
 def create_patient():
     """Create a new patient"""
@@ -226,6 +367,10 @@ def create_patient():
         
         db.session.add(patient)
         db.session.commit()
+        entity_caches['patients'].invalidate(patient.id)
+        stats_cache.record_inserts(
+            'patients', [{'id': patient.id, 'facility_id': patient.facility_id}]
+        )
         
         return jsonify(PatientOut.model_validate(patient).model_dump()), 201
         
@@ -240,31 +385,46 @@ def create_patient():
 def get_medical_records():
     """Get medical records"""
     try:
-        query = db.session.query(MedicalRecord)
+        # Batch lookup: ?ids=1,2,3[&fields=...][&expand=facility]
+        if 'ids' in request.args:
+            return json_response(batch_lookup(MedicalRecord, MEDICAL_RECORD_COLUMNS, request.args))
         
-        patient_id = request.args.get('patient_id', type=int)
-        facility_id = request.args.get('facility_id', type=int)
+        query = apply_record_filters(
+            db.session.query(*MEDICAL_RECORD_COLUMNS), MedicalRecord, request.args
+        )
         
-        if patient_id:
-            query = query.filter(MedicalRecord.patient_id == patient_id)
-        if facility_id:
-            query = query.filter(MedicalRecord.facility_id == facility_id)
+        per_page = request.args.get('per_page', 50, type=int)
+        
+        # Opt-in keyset pagination: pass `cursor` (empty for the first page)
+        if 'cursor' in request.args:
+            per_page = min(max(per_page, 1), 500)
+            response = {'per_page': per_page}
+            if request.args.get('include_total', 'false').lower() == 'true':
+                response['total'] = query.order_by(None).count()
+            
+            records, next_cursor = keyset_paginate(
+                query, MedicalRecord, cursor=request.args.get('cursor'), per_page=per_page
+            )
+            response['data'] = rows_to_dicts(records)
+            response['next_cursor'] = next_cursor
+            return json_response(response)
         
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
         
         records = query.order_by(MedicalRecord.created_at.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
         
-        return jsonify({
-            'data': [MedicalRecordOut.model_validate(r).model_dump() for r in records.items],
+        return json_response({
+            'data': rows_to_dicts(records.items),
             'total': records.total,
             'page': page,
             'per_page': per_page,
             'pages': records.pages
-        }), 200
+        })
         
+    except (InvalidCursorError, InvalidFilterError, BatchRequestError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting medical records: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -274,10 +434,13 @@ def get_medical_records():
 def get_medical_record(record_id):
     """Get a specific medical record"""
     try:
-        record = db.session.get(MedicalRecord, record_id)
-        if not record:
+        response = entity_response(
+            'medical_records', record_id,
+            lambda i: db.session.get(MedicalRecord, i), MedicalRecordOut
+        )
+        if response is None:
             return jsonify({'error': 'Medical record not found'}), 404
-        return jsonify(MedicalRecordOut.model_validate(record).model_dump()), 200
+        return response
     except Exception as e:
         logger.error(f"Error getting medical record {record_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -299,6 +462,10 @@ def create_medical_record():
         
         db.session.add(record)
         db.session.commit()
+        entity_caches['medical_records'].invalidate(record.id)
+        stats_cache.record_inserts(
+            'medical_records', [{'id': record.id, 'facility_id': record.facility_id}]
+        )
         
         return jsonify(MedicalRecordOut.model_validate(record).model_dump()), 201
         
@@ -313,58 +480,306 @@ def create_medical_record():
 def get_triage_visits():
     """Get triage visits"""
     try:
-        query = db.session.query(TriageVisit)
+        # Batch lookup: ?ids=1,2,3[&fields=...][&expand=facility]
+        if 'ids' in request.args:
+            return json_response(batch_lookup(TriageVisit, TRIAGE_VISIT_COLUMNS, request.args))
         
-        patient_id = request.args.get('patient_id', type=int)
-        facility_id = request.args.get('facility_id', type=int)
+        query = apply_record_filters(
+            db.session.query(*TRIAGE_VISIT_COLUMNS), TriageVisit, request.args
+        )
         
-        if patient_id:
-            query = query.filter(TriageVisit.patient_id == patient_id)
-        if facility_id:
-            query = query.filter(TriageVisit.facility_id == facility_id)
+        per_page = request.args.get('per_page', 50, type=int)
+        
+        # Opt-in keyset pagination: pass `cursor` (empty for the first page)
+        if 'cursor' in request.args:
+            per_page = min(max(per_page, 1), 500)
+            response = {'per_page': per_page}
+            if request.args.get('include_total', 'false').lower() == 'true':
+                response['total'] = query.order_by(None).count()
+            
+            visits, next_cursor = keyset_paginate(
+                query, TriageVisit, cursor=request.args.get('cursor'), per_page=per_page
+            )
+            response['data'] = rows_to_dicts(visits)
+            response['next_cursor'] = next_cursor
+            return json_response(response)
         
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
         
         visits = query.order_by(TriageVisit.created_at.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
         
-        return jsonify({
-            'data': [TriageVisitOut.model_validate(v).model_dump() for v in visits.items],
+        return json_response({
+            'data': rows_to_dicts(visits.items),
             'total': visits.total,
             'page': page,
             'per_page': per_page,
             'pages': visits.pages
-        }), 200
+        })
         
+    except (InvalidCursorError, InvalidFilterError, BatchRequestError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting triage visits: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
-# Analytics endpoint
+# Record request (transfer) endpoints
+@app.route('/api/record-requests', methods=['GET'])
+def get_record_requests():
+    """Get record requests, filtered by facility and status"""
+    try:
+        query = db.session.query(*RECORD_REQUEST_COLUMNS)
+        
+        for arg in ('requester_facility_id', 'target_facility_id', 'patient_id'):
+            value = request.args.get(arg, type=int)
+            if value:
+                query = query.filter(getattr(RecordRequest, arg) == value)
+        status = request.args.get('status')
+        if status:
+            query = query.filter(RecordRequest.status == status)
+        
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+        requests_page, next_cursor = keyset_paginate(
+            query, RecordRequest, cursor=request.args.get('cursor'), per_page=per_page
+        )
+        return json_response({
+            'data': rows_to_dicts(requests_page),
+            'per_page': per_page,
+            'next_cursor': next_cursor
+        })
+        
+    except InvalidCursorError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting record requests: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/record-requests/<int:request_id>', methods=['GET'])
+def get_record_request(request_id):
+    """Get a specific record request by ID"""
+    try:
+        record_request = db.session.get(RecordRequest, request_id)
+        if not record_request:
+            return jsonify({'error': 'Record request not found'}), 404
+        return jsonify(RecordRequestOut.model_validate(record_request).model_dump())
+    except Exception as e:
+        logger.error(f"Error getting record request {request_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/record-requests', methods=['POST'])
+def create_record_request():
+    """Request a patient's records from another facility"""
+    try:
+        data = request.get_json()
+        record_request = create_request(RecordRequestCreate(**data))
+        return jsonify(RecordRequestOut.model_validate(record_request).model_dump()), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating record request: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/api/record-requests/<int:request_id>/<any(approve, reject):decision>', methods=['POST'])
+def decide_record_request(request_id, decision):
+    """Approve (queue for packaging) or reject a pending record request"""
+    try:
+        record_request = decide_request(request_id, approve=decision == 'approve')
+        if record_request is None:
+            return jsonify({'error': 'Record request not found'}), 404
+        return jsonify(RecordRequestOut.model_validate(record_request).model_dump())
+        
+    except TransferError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error updating record request {request_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/record-requests/<int:request_id>/package', methods=['GET'])
+def download_record_package(request_id):
+    """Download the gzip NDJSON package of a completed record request"""
+    try:
+        record_request = db.session.get(RecordRequest, request_id)
+        if not record_request:
+            return jsonify({'error': 'Record request not found'}), 404
+        if record_request.status != COMPLETED:
+            return jsonify({'error': f"Record request is {record_request.status}"}), 409
+        
+        return send_file(
+            package_path(request_id),
+            mimetype='application/gzip',
+            as_attachment=True,
+            download_name=f'record-request-{request_id}.ndjson.gz'
+        )
+        
+    except FileNotFoundError:
+        return jsonify({'error': 'Package file is missing'}), 410
+    except Exception as e:
+        logger.error(f"Error downloading package for record request {request_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# Bulk ingest endpoint
+@app.route('/api/<entity>/bulk', methods=['POST'])
+def bulk_create(entity):
+    """Create many facilities, patients or medical records from a JSON array or NDJSON body"""
+    if entity not in BULK_ENTITIES:
+        return jsonify({'error': f"Unknown bulk entity: {entity}"}), 404
+    
+    try:
+        items, errors = parse_bulk_body(request)
+        result = bulk_ingest(BULK_ENTITIES[entity], items, errors)
+        return jsonify(result), 201 if not result['failed'] else 207
+        
+    except BulkRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error bulk creating {entity}: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+
+# Export endpoint
+@app.route('/api/export/<entity>', methods=['GET'])
+def export_entity(entity):
+    """Stream every matching medical record or triage visit as NDJSON or CSV"""
+    if entity not in EXPORT_ENTITIES:
+        return jsonify({'error': f"Unknown export entity: {entity}"}), 404
+    
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unsupported format: {fmt}"}), 400
+    
+    try:
+        model, schema = EXPORT_ENTITIES[entity]
+        columns = columns_for(model, schema)
+        query = apply_record_filters(db.session.query(*columns), model, request.args)
+        query = query.order_by(model.created_at, model.id)
+        
+        return Response(
+            stream_with_context(stream_export(query, [c.key for c in columns], fmt)),
+            mimetype=EXPORT_FORMATS[fmt],
+            headers={'Content-Disposition': f'attachment; filename={entity}.{fmt}'}
+        )
+        
+    except InvalidFilterError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error exporting {entity}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# Cache statistics endpoint
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit/miss counters for the single-resource caches"""
+    stats = {name: cache.stats() for name, cache in entity_caches.items()}
+    stats['marts'] = mart_cache.stats()
+    return jsonify(stats), 200
+
+
+# Analytics endpoints
 @app.route('/api/analytics/facility-stats', methods=['GET'])
 def get_facility_stats():
-    """Get facility statistics"""
+    """Get facility statistics, served from the in-process stats cache"""
     try:
-        total_facilities = db.session.query(Facility).count()
-        total_patients = db.session.query(Patient).count()
-        total_records = db.session.query(MedicalRecord).count()
-        total_triage = db.session.query(TriageVisit).count()
+        if request.args.get('exact', 'false').lower() == 'true':
+            snapshot = stats_cache.refresh()
+        else:
+            snapshot = stats_cache.get()
+        
+        response = {
+            'total_facilities': snapshot.totals['facilities'],
+            'total_patients': snapshot.totals['patients'],
+            'total_medical_records': snapshot.totals['medical_records'],
+            'total_triage_visits': snapshot.totals['triage_visits'],
+            'as_of': snapshot.as_of.isoformat()
+        }
         
-        return jsonify({
-            'total_facilities': total_facilities,
-            'total_patients': total_patients,
-            'total_medical_records': total_records,
-            'total_triage_visits': total_triage
-        }), 200
+        facility_id = request.args.get('facility_id', type=int)
+        if facility_id:
+            facility = snapshot.facility(facility_id)
+            if not facility:
+                return jsonify({'error': 'Facility not found'}), 404
+            response['facility'] = facility
+        
+        group_by = request.args.get('group_by')
+        if group_by == 'facility':
+            response['by_facility'] = snapshot.by_facility()
+        elif group_by == 'state':
+            response['by_state'] = snapshot.by_state()
+        elif group_by:
+            return jsonify({'error': f"Unsupported group_by: {group_by}"}), 400
+        
+        return jsonify(response), 200
             
     except Exception as e:
         logger.error(f"Error getting facility stats: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/analytics/<mart>', methods=['GET'])
+def get_mart(mart):
+    """Page through a dbt mart, cached until dbt rebuilds it"""
+    if mart not in MARTS:
+        return jsonify({'error': f"Unknown analytics mart: {mart}"}), 404
+    
+    try:
+        return Response(mart_page(mart, request.args), mimetype='application/json')
+        
+    except (InvalidCursorError, InvalidFilterError) as e:
+        return jsonify({'error': str(e)}), 400
+    except MartNotBuiltError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error getting analytics mart {mart}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/analytics/refresh', methods=['POST'])
+def refresh_facility_stats():
+    """Reload the cached facility statistics with live counts"""
+    try:
+        snapshot = stats_cache.refresh()
+        return jsonify({'status': 'refreshed', 'as_of': snapshot.as_of.isoformat()}), 200
+    except Exception as e:
+        logger.error(f"Error refreshing facility stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# Prometheus metrics
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, SQL and connection pool metrics in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# CLI commands
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """EXPLAIN the API's queries and fail if one is not served by its index"""
+    failed = False
+    for name, expected, used in check_index_usage():
+        ok = expected in used
+        failed = failed or not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: expected {expected}, plan uses {sorted(used) or 'no index'}")
+    sys.exit(1 if failed else 0)
+
+
+@app.cli.command('transfer-worker')
+@click.option('--batch-size', default=None, type=int, help='Requests claimed per batch')
+@click.option('--once', is_flag=True, help='Exit when no approved requests are left')
+def transfer_worker_command(batch_size, once):
+    """Package approved record requests; run one per process to scale out"""
+    run_worker(batch_size=batch_size or TRANSFER_BATCH_SIZE, once=once)
+
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
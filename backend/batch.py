@@ -0,0 +1,84 @@
+"""
+Batch lookups by ID, with field projection and related-facility expansion
+"""
+from database import db
+from models import Facility
+from serializers import FACILITY_COLUMNS, rows_to_dicts
+
+MAX_BATCH_IDS = 500
+EXPANSIONS = ('facility',)
+
+
+class BatchRequestError(ValueError):
+    """Raised when `ids`, `fields` or `expand` cannot be understood"""
+
+
+def _split(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def parse_ids(value):
+    """Comma-separated IDs, de-duplicated in request order"""
+    try:
+        ids = list(dict.fromkeys(int(part) for part in _split(value)))
+    except ValueError as e:
+        raise BatchRequestError(f"ids must be comma-separated integers: {value}") from e
+    if not ids:
+        raise BatchRequestError("ids must list at least one ID")
+    if len(ids) > MAX_BATCH_IDS:
+        raise BatchRequestError(f"At most {MAX_BATCH_IDS} ids per request")
+    return ids
+
+
+def select_fields(columns, fields):
+    """The subset of `columns` named in `fields` (all when empty); `id` is always kept"""
+    names = _split(fields)
+    if not names:
+        return columns
+    by_name = {column.key: column for column in columns}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise BatchRequestError(f"Unknown fields: {', '.join(unknown)}; expected {', '.join(by_name)}")
+    return tuple(column for column in columns if column.key == 'id' or column.key in names)
+
+
+def parse_expand(value, model):
+    expand = _split(value)
+    for name in expand:
+        if name not in EXPANSIONS or not hasattr(model, f'{name}_id'):
+            raise BatchRequestError(f"Cannot expand {name}")
+    return expand
+
+
+def batch_lookup(model, columns, args):
+    """
+    Fetch the rows whose IDs are listed in `args['ids']` with one `IN` query.
+
+    `fields` limits the columns selected and returned, and `expand=facility`
+    embeds each row's facility through a join. Returns the rows in the order
+    the IDs were given, plus the IDs that were not found.
+    """
+    ids = parse_ids(args.get('ids'))
+    selected = select_fields(columns, args.get('fields'))
+    expand = parse_expand(args.get('expand'), model)
+
+    query_columns = list(selected)
+    if 'facility' in expand:
+        query_columns += [column.label(f'facility.{column.key}') for column in FACILITY_COLUMNS]
+    query = db.session.query(*query_columns)
+    if 'facility' in expand:
+        query = query.join(Facility, Facility.id == model.facility_id)
+    rows = rows_to_dicts(query.filter(model.id.in_(ids)))
+
+    by_id = {}
+    for row in rows:
+        if 'facility' in expand:
+            row['facility'] = {
+                key.split('.', 1)[1]: row.pop(key) for key in list(row) if key.startswith('facility.')
+            }
+        by_id[row['id']] = row
+
+    return {
+        'data': [by_id[i] for i in ids if i in by_id],
+        'missing': [i for i in ids if i not in by_id],
+    }
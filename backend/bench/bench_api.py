@@ -0,0 +1,298 @@
+"""
+Load-test the running API and compare the results against a stored baseline
+
+Each scenario requests one endpoint shape (first pages, deep offset pages,
+deep keyset cursors, filters, lookups, search, analytics) with randomized IDs
+taken from the seeded data, from `--concurrency` keep-alive connections. The
+p50/p95/p99 latency, throughput and error count of every scenario are printed
+and written to `--out`. With `--baseline`, a scenario whose p95 grew or whose
+throughput fell by more than `--tolerance`, or which started failing, is
+reported as a regression and the exit status is 1.
+
+Usage:
+    python bench/seed_data.py --scale 1m --truncate
+    python bench/bench_api.py run --concurrency 16 --requests 400 --out results.json
+    python bench/bench_api.py run --out results.json --baseline baseline.json
+    python bench/bench_api.py compare results.json baseline.json
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pagination import encode_cursor
+
+PER_PAGE = 50
+
+
+class Client:
+    """One keep-alive connection per thread"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+
+    def get(self, path):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            raise
+        return response.status, body
+
+
+class Context:
+    """IDs and sizes of the seeded data, discovered through the API"""
+
+    def __init__(self, client):
+        facilities = self._page(client, '/api/facilities?per_page=100')
+        patients = self._page(client, '/api/patients?per_page=100')
+        records = self._page(client, '/api/medical-records?per_page=1&include_total=true&cursor=')
+        if not facilities['data'] or not patients['data']:
+            raise SystemExit("No data to benchmark against; run bench/seed_data.py first")
+
+        self.facilities = facilities['data']
+        self.patients = patients['data']
+        self.facility_pages = max(1, facilities['pages'])
+        self.patient_pages = max(1, patients['total'] // PER_PAGE)
+        self.record_pages = max(1, records['total'] // PER_PAGE)
+        self.now = datetime.utcnow()
+
+    @staticmethod
+    def _page(client, path):
+        status, body = client.get(path)
+        if status != 200:
+            raise SystemExit(f"GET {path} returned {status}: {body[:200]!r}")
+        return json.loads(body)
+
+    def deep_cursor(self, rng):
+        """A cursor pointing somewhere in the older half of the history"""
+        return encode_cursor(self.now - timedelta(days=rng.randint(180, 700)), 2**31 - 1)
+
+
+def _ids(rng, rows, count):
+    return ','.join(str(row['id']) for row in rng.sample(rows, min(count, len(rows))))
+
+
+def _search_query(rng, ctx):
+    """A patient's first name plus a partly typed last name"""
+    patient = rng.choice(ctx.patients)
+    last_name = patient['last_name'][:rng.randint(3, max(3, len(patient['last_name'])))]
+    return quote(f"{patient['first_name']} {last_name}")
+
+
+def _date_range(rng, ctx):
+    start = ctx.now - timedelta(days=rng.randint(30, 700))
+    return f"start_date={start.date()}&end_date={(start + timedelta(days=30)).date()}"
+
+
+SCENARIOS = {
+    'facilities_first_page': lambda rng, ctx: f'/api/facilities?per_page={PER_PAGE}',
+    'facilities_deep_page': lambda rng, ctx: f'/api/facilities?per_page=100&page={ctx.facility_pages}',
+    'facilities_filtered': lambda rng, ctx: f"/api/facilities?state={rng.choice(ctx.facilities)['state']}",
+    'facility_get': lambda rng, ctx: f"/api/facilities/{rng.choice(ctx.facilities)['id']}",
+    'facilities_nearby': lambda rng, ctx: (
+        f"/api/facilities/nearby?lat={rng.uniform(4.5, 12.5):.4f}&lon={rng.uniform(3.0, 8.5):.4f}&limit=10"
+    ),
+    'patients_first_page': lambda rng, ctx: f'/api/patients?per_page={PER_PAGE}',
+    'patients_deep_page': lambda rng, ctx: (
+        f'/api/patients?per_page={PER_PAGE}&page={rng.randint(ctx.patient_pages // 2, ctx.patient_pages)}'
+    ),
+    'patients_by_facility': lambda rng, ctx: f"/api/patients?facility_id={rng.choice(ctx.facilities)['id']}",
+    'patient_get': lambda rng, ctx: f"/api/patients/{rng.choice(ctx.patients)['id']}",
+    'patients_batch_expand': lambda rng, ctx: (
+        f"/api/patients?ids={_ids(rng, ctx.patients, 20)}&expand=facility&fields=first_name,last_name"
+    ),
+    'patient_search': lambda rng, ctx: f'/api/patients/search?q={_search_query(rng, ctx)}',
+    'patient_timeline': lambda rng, ctx: f"/api/patients/{rng.choice(ctx.patients)['id']}/timeline",
+    'records_first_page': lambda rng, ctx: f'/api/medical-records?per_page={PER_PAGE}',
+    'records_deep_offset': lambda rng, ctx: (
+        f'/api/medical-records?per_page={PER_PAGE}&page={rng.randint(ctx.record_pages // 2, ctx.record_pages)}'
+    ),
+    'records_deep_cursor': lambda rng, ctx: (
+        f'/api/medical-records?per_page={PER_PAGE}&cursor={ctx.deep_cursor(rng)}'
+    ),
+    'records_by_facility_dates': lambda rng, ctx: (
+        f"/api/medical-records?facility_id={rng.choice(ctx.facilities)['id']}&{_date_range(rng, ctx)}&cursor="
+    ),
+    'records_by_patient': lambda rng, ctx: f"/api/medical-records?patient_id={rng.choice(ctx.patients)['id']}",
+    'records_by_diagnosis': lambda rng, ctx: (
+        f"/api/medical-records?diagnosis={rng.choice(['malaria', 'hypertension', 'pneumonia'])}&cursor="
+    ),
+    'triage_deep_cursor': lambda rng, ctx: f'/api/triage-visits?per_page={PER_PAGE}&cursor={ctx.deep_cursor(rng)}',
+    'triage_by_patient': lambda rng, ctx: f"/api/triage-visits?patient_id={rng.choice(ctx.patients)['id']}",
+    'facility_stats': lambda rng, ctx: '/api/analytics/facility-stats',
+    'facility_stats_by_state': lambda rng, ctx: '/api/analytics/facility-stats?group_by=state',
+}
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(client, ctx, name, requests, concurrency, warmup, seed):
+    make_path = SCENARIOS[name]
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(worker_id, count):
+        nonlocal errors
+        rng = random.Random(f'{seed}:{name}:{worker_id}')
+        local_latencies, local_errors = [], 0
+        for _ in range(count):
+            path = make_path(rng, ctx)
+            started = time.perf_counter()
+            try:
+                status, _ = client.get(path)
+            except (http.client.HTTPException, OSError):
+                status = None
+            elapsed = time.perf_counter() - started
+            if status == 200:
+                local_latencies.append(elapsed)
+            else:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    warm_rng = random.Random(seed)
+    for _ in range(warmup):
+        client.get(make_path(warm_rng, ctx))
+
+    shares = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency), shares))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'rps': round(len(latencies) / wall, 1) if wall else None,
+    }
+
+
+def print_results(results):
+    print(f"{'scenario':<28} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+    for name, result in results['scenarios'].items():
+        print(f"{name:<28} {result['p50_ms']!s:>9} {result['p95_ms']!s:>9} "
+              f"{result['p99_ms']!s:>9} {result['rps']!s:>9} {result['errors']:>7}")
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression messages for `results` against `baseline`"""
+    regressions = []
+    for name, base in baseline['scenarios'].items():
+        current = results['scenarios'].get(name)
+        if current is None:
+            continue
+        if current['errors'] and not base['errors']:
+            regressions.append(f"{name}: {current['errors']} errors (baseline had none)")
+        if base['p95_ms'] and current['p95_ms'] and current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+        if base['rps'] and current['rps'] is not None and current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['rps']} req/s vs baseline {base['rps']} req/s")
+    return regressions
+
+
+def report_comparison(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, tolerance)
+    if regressions:
+        print(f"\nREGRESSIONS against {baseline_path} (tolerance {tolerance:.0%}):")
+        for message in regressions:
+            print(f"  {message}")
+        return 1
+    print(f"\nNo regressions against {baseline_path} (tolerance {tolerance:.0%})")
+    return 0
+
+
+def run(args):
+    client = Client(args.url)
+    ctx = Context(client)
+    names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    results = {
+        'meta': {
+            'url': args.url, 'concurrency': args.concurrency, 'requests': args.requests,
+            'seed': args.seed, 'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        },
+        'scenarios': {},
+    }
+    for name in names:
+        results['scenarios'][name] = run_scenario(
+            client, ctx, name, args.requests, args.concurrency, args.warmup, args.seed
+        )
+        print(f"  {name}: done", file=sys.stderr)
+
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        return report_comparison(results, args.baseline, args.tolerance)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='benchmark the API')
+    run_parser.add_argument('--url', default='http://localhost:5000')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    run_parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per scenario')
+    run_parser.add_argument('--scenarios', help='comma-separated subset of: ' + ', '.join(SCENARIOS))
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--out', help='write results JSON here (use as a baseline later)')
+    run_parser.add_argument('--baseline', help='fail on regressions against this results file')
+    run_parser.add_argument('--tolerance', type=float, default=0.2)
+
+    compare_parser = commands.add_parser('compare', help='compare a results file to a baseline')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--tolerance', type=float, default=0.2)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        sys.exit(run(args))
+    with open(args.results) as f:
+        results = json.load(f)
+    print_results(results)
+    sys.exit(report_comparison(results, args.baseline, args.tolerance))
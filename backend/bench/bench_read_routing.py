@@ -0,0 +1,75 @@
+"""
+Show read traffic moving off the primary when a read replica is configured
+
+Fires concurrent GETs at the running API, then a write followed by a read,
+and reports how many SQL statements each engine executed (from the
+`db_sql_statements_total` counters on `/metrics`). With `POSTGRES_READ_HOST`
+set, the GET load should land on the `replica` engine and only the write and
+the read-your-writes read on `default`.
+
+Usage:
+    python bench/bench_read_routing.py [--url http://localhost:5000] [--requests 500] [--concurrency 16]
+"""
+import argparse
+import json
+import re
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+READ_PATHS = (
+    '/api/facilities?per_page=50',
+    '/api/patients?per_page=50',
+    '/api/medical-records?per_page=50&cursor=',
+    '/api/triage-visits?per_page=50&cursor=',
+    '/api/analytics/facility-stats',
+)
+
+SQL_COUNTER = re.compile(r'^db_sql_statements_total\{engine="([^"]+)"\} (\S+)$', re.M)
+
+
+def sql_statements(url):
+    with urllib.request.urlopen(f'{url}/metrics') as response:
+        text = response.read().decode()
+    return {engine: float(value) for engine, value in SQL_COUNTER.findall(text)}
+
+
+def delta(before, after):
+    return {engine: int(after[engine] - before.get(engine, 0)) for engine in sorted(after)}
+
+
+def get(url, path, opener=None):
+    with (opener or urllib.request.build_opener()).open(f'{url}{path}') as response:
+        response.read()
+
+
+def run(url, requests, concurrency):
+    before = sql_statements(url)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda i: get(url, READ_PATHS[i % len(READ_PATHS)]), range(requests)))
+    after_reads = sql_statements(url)
+    print(f"{requests} GET requests, SQL statements by engine: {delta(before, after_reads)}")
+
+    # A client that just wrote reads its own write from the primary
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    body = json.dumps({
+        'name': f'Read Routing Check Clinic {int(time.time())}', 'state': 'LAGOS', 'lga': 'Ikeja', 'type': 'Clinic',
+    }).encode()
+    create = urllib.request.Request(
+        f'{url}/api/facilities', data=body, headers={'Content-Type': 'application/json'}
+    )
+    with opener.open(create) as response:
+        facility_id = json.loads(response.read())['id']
+    get(url, '/api/facilities?per_page=1', opener)
+    after_write = sql_statements(url)
+    print(f"POST facility {facility_id} + GET with the write cookie: {delta(after_reads, after_write)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+    run(args.url.rstrip('/'), args.requests, args.concurrency)
@@ -0,0 +1,112 @@
+"""
+Micro-benchmark: ORM + Pydantic + jsonify vs. column tuples + orjson
+
+Serializes one synthetic page per list endpoint both ways, checks that the two
+paths produce the same JSON document, and reports the time per page and the
+speedup. No database is needed; only the serialization cost is measured.
+
+Usage:
+    python bench/bench_serialization.py [--rows 500] [--repeat 50]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import jsonify
+
+from app import app
+from models import Facility, Patient, MedicalRecord, TriageVisit
+from schemas import FacilityOut, PatientOut, MedicalRecordOut, TriageVisitOut
+from serializers import columns_for, json_response, rows_to_dicts
+
+
+def _created_at(i):
+    return datetime(2024, 1, 1) + timedelta(minutes=i)
+
+
+def make_facility(i):
+    return dict(
+        id=i, name=f"General Hospital {i}", state='LAGOS', lga='Ikeja',
+        lat=Decimal('6.60180000') + i, lon=Decimal('3.35150000'), type='Hospital',
+        created_at=_created_at(i),
+    )
+
+
+def make_patient(i):
+    return dict(
+        id=i, facility_id=i % 50 + 1, first_name='John', last_name=f"Doe{i}", sex='M',
+        dob=date(1990, 1, 1) + timedelta(days=i), phone='+2348012345678',
+        created_at=_created_at(i),
+    )
+
+
+def make_medical_record(i):
+    return dict(
+        id=i, patient_id=i, facility_id=i % 50 + 1, record_type='Consultation',
+        data={
+            'diagnosis': 'Hypertension', 'treatment': 'Medication',
+            'medications': 'Amlodipine 5mg daily', 'notes': 'Reduce salt intake',
+        },
+        created_at=_created_at(i), updated_at=_created_at(i + 1),
+    )
+
+
+def make_triage_visit(i):
+    return dict(
+        id=i, patient_id=i, facility_id=i % 50 + 1, triage_level=random.randint(1, 5),
+        likely_conditions=['Malaria', 'Typhoid'], recommendations=['Hydrate', 'Follow up'],
+        language='en', provider='triage-bot', created_at=_created_at(i),
+    )
+
+
+ENDPOINTS = [
+    ('/api/facilities', Facility, FacilityOut, make_facility),
+    ('/api/patients', Patient, PatientOut, make_patient),
+    ('/api/medical-records', MedicalRecord, MedicalRecordOut, make_medical_record),
+    ('/api/triage-visits', TriageVisit, TriageVisitOut, make_triage_visit),
+]
+
+
+def envelope(data, rows):
+    return {'data': data, 'total': rows, 'page': 1, 'per_page': rows, 'pages': 1}
+
+
+def run(rows, repeat):
+    print(f"{'endpoint':<24}{'orm+jsonify ms':>16}{'fast path ms':>14}{'speedup':>10}")
+
+    with app.test_request_context():
+        for path, model, schema, make in ENDPOINTS:
+            values = [make(i) for i in range(1, rows + 1)]
+            objects = [model(**v) for v in values]
+            Row = namedtuple('Row', [c.key for c in columns_for(model, schema)])
+            tuples = [Row(**v) for v in values]
+
+            def orm_path():
+                data = [schema.model_validate(o).model_dump() for o in objects]
+                return jsonify(envelope(data, rows)).get_data()
+
+            def fast_path():
+                return json_response(envelope(rows_to_dicts(tuples), rows)).get_data()
+
+            if json.loads(orm_path()) != json.loads(fast_path()):
+                raise SystemExit(f"{path}: fast path output differs from the ORM path")
+
+            slow = min(timeit.repeat(orm_path, number=1, repeat=repeat)) * 1000
+            fast = min(timeit.repeat(fast_path, number=1, repeat=repeat)) * 1000
+            print(f"{path:<24}{slow:>16.2f}{fast:>14.2f}{slow / fast:>9.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=500, help='rows per page')
+    parser.add_argument('--repeat', type=int, default=50, help='timing repetitions (best is reported)')
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
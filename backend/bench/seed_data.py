@@ -0,0 +1,276 @@
+"""
+Seed Postgres with synthetic facilities, patients, medical records and triage visits
+
+Rows are generated deterministically from `--seed` for the columns of the real
+models and streamed in with COPY, so a scale of tens of millions of rows loads
+in minutes. New rows take IDs above the current maximum of each table and the
+ID sequences are moved past them; ANALYZE runs at the end so the planner sees
+the new sizes. Run `flask db upgrade` first so the schema and indexes exist.
+
+Usage:
+    python bench/seed_data.py --scale 100k [--seed 42] [--chunk-size 100000] [--truncate]
+
+`--scale` is the total number of rows across the four tables (10k .. 50m).
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import app
+from database import db
+from models import Facility, Patient, MedicalRecord, TriageVisit
+
+# Share of the total rows going to each table
+TABLE_SHARES = (
+    (Facility, 0.002),
+    (Patient, 0.2),
+    (MedicalRecord, 0.45),
+    (TriageVisit, 0.348),
+)
+MIN_FACILITIES = 20
+
+STATES = {
+    'LAGOS': ['Ikeja', 'Surulere', 'Eti-Osa', 'Alimosho', 'Kosofe'],
+    'FCT': ['Abuja Municipal', 'Bwari', 'Gwagwalada', 'Kuje'],
+    'KANO': ['Nassarawa', 'Fagge', 'Dala', 'Gwale'],
+    'RIVERS': ['Port Harcourt', 'Obio-Akpor', 'Eleme'],
+    'OYO': ['Ibadan North', 'Ibadan South-West', 'Ogbomosho North'],
+    'KADUNA': ['Kaduna North', 'Kaduna South', 'Zaria'],
+    'ENUGU': ['Enugu East', 'Enugu North', 'Nsukka'],
+    'ANAMBRA': ['Awka South', 'Onitsha North', 'Nnewi North'],
+}
+# Rough state centres for facility coordinates
+STATE_CENTRES = {
+    'LAGOS': (6.52, 3.37), 'FCT': (9.06, 7.49), 'KANO': (12.00, 8.52), 'RIVERS': (4.82, 7.03),
+    'OYO': (7.38, 3.93), 'KADUNA': (10.52, 7.44), 'ENUGU': (6.44, 7.50), 'ANAMBRA': (6.21, 7.07),
+}
+FACILITY_TYPES = ['Hospital', 'Primary Health Centre', 'Clinic', 'Teaching Hospital', 'Maternity']
+FIRST_NAMES = [
+    'Adaeze', 'Chinedu', 'Oluwaseun', 'Aisha', 'Ibrahim', 'Ngozi', 'Emeka', 'Funke', 'Yusuf',
+    'Amina', 'Tunde', 'Chiamaka', 'Bola', 'Musa', 'Kemi', 'Obinna', 'Zainab', 'Segun', 'Halima', 'Ifeanyi',
+]
+LAST_NAMES = [
+    'Okafor', 'Adeyemi', 'Bello', 'Eze', 'Abubakar', 'Okonkwo', 'Balogun', 'Mohammed', 'Nwosu',
+    'Adebayo', 'Usman', 'Obi', 'Ogunleye', 'Danjuma', 'Chukwu', 'Lawal', 'Onyeka', 'Salami',
+]
+RECORD_TYPES = ['Consultation', 'Lab Result', 'Prescription', 'Follow-up', 'Admission']
+DIAGNOSES = {
+    'Malaria': ('Artemether-lumefantrine', 'ACT course, fluids and rest'),
+    'Typhoid fever': ('Ciprofloxacin', 'Antibiotics and hydration'),
+    'Hypertension': ('Amlodipine', 'Lifestyle changes and antihypertensives'),
+    'Type 2 diabetes': ('Metformin', 'Diet control and oral hypoglycaemics'),
+    'Upper respiratory infection': ('Paracetamol', 'Symptomatic treatment'),
+    'Gastroenteritis': ('Oral rehydration salts', 'Rehydration'),
+    'Pneumonia': ('Amoxicillin', 'Antibiotics and monitoring'),
+    'Anaemia': ('Ferrous sulphate', 'Iron supplementation'),
+}
+CONDITIONS = list(DIAGNOSES) + ['Dengue fever', 'Cholera', 'Asthma', 'Migraine']
+RECOMMENDATIONS = [
+    'Visit the nearest health facility', 'Seek emergency care immediately', 'Rest and drink fluids',
+    'Take prescribed medication', 'Book a follow-up within 7 days', 'Monitor temperature',
+]
+LANGUAGES = ['en', 'en', 'en', 'yo', 'ha', 'ig', 'pcm']
+PROVIDERS = ['symptom-checker', 'nurse-line', 'community-health-worker', None]
+
+HISTORY_DAYS = 730
+
+
+def parse_scale(value):
+    units = {'k': 1_000, 'm': 1_000_000}
+    value = value.strip().lower()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def plan(total):
+    counts = {model: int(total * share) for model, share in TABLE_SHARES}
+    counts[Facility] = max(counts[Facility], MIN_FACILITIES)
+    counts[Patient] = max(counts[Patient], 1)
+    return counts
+
+
+class Generator:
+    """Produces rows in the column order of each model's table"""
+
+    def __init__(self, seed, first_ids, counts):
+        self.random = random.Random(seed)
+        self.first_ids = first_ids
+        self.counts = counts
+        self.now = datetime.utcnow().replace(microsecond=0)
+
+    def created_at(self):
+        return self.now - timedelta(seconds=self.random.randrange(HISTORY_DAYS * 86400))
+
+    def facility_of_patient(self, patient_id):
+        # Deterministic so records can be attributed without keeping every patient in memory
+        return self.first_ids[Facility] + (patient_id * 7919) % self.counts[Facility]
+
+    def random_patient(self):
+        return self.first_ids[Patient] + self.random.randrange(self.counts[Patient])
+
+    def facility(self, row_id):
+        state = self.random.choice(list(STATES))
+        lga = self.random.choice(STATES[state])
+        lat, lon = STATE_CENTRES[state]
+        return {
+            'id': row_id,
+            'name': f"{lga} {self.random.choice(FACILITY_TYPES)} {row_id}",
+            'state': state,
+            'lga': lga,
+            'lat': round(lat + self.random.uniform(-0.5, 0.5), 8),
+            'lon': round(lon + self.random.uniform(-0.5, 0.5), 8),
+            'type': self.random.choice(FACILITY_TYPES),
+            'created_at': self.created_at(),
+        }
+
+    def patient(self, row_id):
+        return {
+            'id': row_id,
+            'facility_id': self.facility_of_patient(row_id),
+            'first_name': self.random.choice(FIRST_NAMES),
+            'last_name': self.random.choice(LAST_NAMES),
+            'sex': self.random.choice(('M', 'F')),
+            'dob': date(1940, 1, 1) + timedelta(days=self.random.randrange(30000)),
+            'phone': f"+234{self.random.choice('789')}{self.random.choice('01')}{self.random.randrange(10**8):08d}",
+            'created_at': self.created_at(),
+        }
+
+    def medical_record(self, row_id):
+        patient_id = self.random_patient()
+        diagnosis = self.random.choice(list(DIAGNOSES))
+        medication, treatment = DIAGNOSES[diagnosis]
+        created_at = self.created_at()
+        return {
+            'id': row_id,
+            'patient_id': patient_id,
+            'facility_id': self.facility_of_patient(patient_id),
+            'record_type': self.random.choice(RECORD_TYPES),
+            'data': json.dumps({
+                'diagnosis': diagnosis,
+                'treatment': treatment,
+                'medications': medication,
+                'notes': f"Seen at visit {row_id}",
+            }),
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+
+    def triage_visit(self, row_id):
+        patient_id = self.random_patient()
+        level = self.random.choices((1, 2, 3, 4, 5), weights=(3, 10, 30, 35, 22))[0]
+        return {
+            'id': row_id,
+            'patient_id': patient_id,
+            'facility_id': self.facility_of_patient(patient_id),
+            'triage_level': level,
+            'likely_conditions': self.random.sample(CONDITIONS, self.random.randint(1, 3)),
+            'recommendations': self.random.sample(RECOMMENDATIONS, self.random.randint(1, 2)),
+            'language': self.random.choice(LANGUAGES),
+            'provider': self.random.choice(PROVIDERS),
+            'created_at': self.created_at(),
+        }
+
+
+def _array_literal(values):
+    return '{' + ','.join('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values) + '}'
+
+
+def copy_rows(raw_connection, table, rows, chunk_size):
+    """COPY `rows` (dicts) into `table` in chunks; returns the number of rows written"""
+    columns = [column.name for column in table.columns]
+    statement = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    written = 0
+    while True:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        count = 0
+        for row in rows:
+            writer.writerow([
+                '\\N' if row.get(name) is None
+                else _array_literal(row[name]) if isinstance(row[name], list)
+                else row[name]
+                for name in columns
+            ])
+            count += 1
+            if count == chunk_size:
+                break
+        if not count:
+            return written
+        buffer.seek(0)
+        with raw_connection.cursor() as cursor:
+            cursor.copy_expert(statement, buffer)
+        raw_connection.commit()
+        written += count
+        print(f"  {table.name}: {written:,} rows", end='\r', flush=True)
+
+
+def seed(total, seed_value, chunk_size, truncate):
+    counts = plan(total)
+    with app.app_context():
+        raw = db.engine.raw_connection()
+        try:
+            with raw.cursor() as cursor:
+                if truncate:
+                    cursor.execute(
+                        'TRUNCATE record_requests, triage_visits, medical_records, patients, facilities '
+                        'RESTART IDENTITY CASCADE'
+                    )
+                first_ids = {}
+                for model in counts:
+                    cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {model.__tablename__}')
+                    first_ids[model] = cursor.fetchone()[0]
+            raw.commit()
+
+            generator = Generator(seed_value, first_ids, counts)
+            makers = {
+                Facility: generator.facility, Patient: generator.patient,
+                MedicalRecord: generator.medical_record, TriageVisit: generator.triage_visit,
+            }
+            for model, count in counts.items():
+                started = time.perf_counter()
+                first = first_ids[model]
+                rows = (makers[model](row_id) for row_id in range(first, first + count))
+                written = copy_rows(raw, model.__table__, rows, chunk_size)
+                elapsed = time.perf_counter() - started
+                print(f"  {model.__tablename__}: {written:,} rows in {elapsed:.1f}s "
+                      f"({written / max(elapsed, 1e-9):,.0f} rows/s)")
+
+            with raw.cursor() as cursor:
+                for model in counts:
+                    table = model.__tablename__
+                    cursor.execute(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                        f"(SELECT MAX(id) FROM {table}))"
+                    )
+            raw.commit()
+
+            raw.autocommit = True
+            with raw.cursor() as cursor:
+                for model in counts:
+                    cursor.execute(f'ANALYZE {model.__tablename__}')
+        finally:
+            raw.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', default='100k', help='total rows across all tables, e.g. 10k, 1m, 50m')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=100_000, help='rows per COPY')
+    parser.add_argument('--truncate', action='store_true', help='empty the tables first')
+    args = parser.parse_args()
+
+    total = parse_scale(args.scale)
+    print(f"Seeding {total:,} rows: " + ', '.join(
+        f"{model.__tablename__}={count:,}" for model, count in plan(total).items()
+    ))
+    seed(total, args.seed, args.chunk_size, args.truncate)
@@ -0,0 +1,167 @@
+"""
+Bulk ingest: batched validation and chunked multi-row inserts
+"""
+import json
+from collections import defaultdict
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import insert
+
+from database import db
+from models import Facility, Patient, MedicalRecord
+from schemas import FacilityCreate, PatientCreate, MedicalRecordCreate
+from stats import stats_cache
+from cache import entity_caches
+from geo import geo_index
+
+MAX_BULK_ITEMS = 100_000
+
+# Rows per INSERT ... VALUES statement; each chunk runs in its own savepoint
+BULK_CHUNK_SIZE = 5000
+
+# Lookup chunk for foreign key existence checks
+FK_CHECK_CHUNK_SIZE = 10_000
+
+
+class BulkRequestError(ValueError):
+    """Raised when a bulk request body cannot be processed at all"""
+
+
+class BulkEntity:
+    """How to validate and insert one entity type in bulk"""
+
+    def __init__(self, model, schema, foreign_keys=None):
+        self.model = model
+        self.adapter = TypeAdapter(list[schema])
+        self.foreign_keys = foreign_keys or {}
+
+
+BULK_ENTITIES = {
+    'facilities': BulkEntity(Facility, FacilityCreate),
+    'patients': BulkEntity(Patient, PatientCreate, {'facility_id': Facility}),
+    'medical-records': BulkEntity(
+        MedicalRecord, MedicalRecordCreate, {'patient_id': Patient, 'facility_id': Facility}
+    ),
+}
+
+
+def parse_bulk_body(req):
+    """
+    Read a bulk request body, either a JSON array or NDJSON
+    (`Content-Type: application/x-ndjson`, one object per line).
+
+    Returns the items plus per-row errors for NDJSON lines that are not valid JSON.
+    """
+    errors = {}
+
+    if req.mimetype == 'application/x-ndjson':
+        items = []
+        for line in req.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                errors[len(items)] = [{'loc': [], 'msg': f"Invalid JSON: {str(e)}"}]
+                items.append(None)
+    else:
+        items = req.get_json()
+        if not isinstance(items, list):
+            raise BulkRequestError('Request body must be a JSON array')
+
+    if len(items) > MAX_BULK_ITEMS:
+        raise BulkRequestError(f"Too many items: {len(items)} (max {MAX_BULK_ITEMS})")
+
+    return items, errors
+
+
+def validate_batch(entity, items, errors):
+    """
+    Validate all items in one pass with the list adapter.
+
+    Returns (index, row) pairs for the valid items; failures are added to
+    `errors` keyed by input index.
+    """
+    candidates = [i for i in range(len(items)) if i not in errors]
+    try:
+        validated = entity.adapter.validate_python([items[i] for i in candidates])
+    except ValidationError as e:
+        failed = defaultdict(list)
+        for err in e.errors(include_url=False):
+            position, *loc = err['loc']
+            failed[candidates[position]].append({'loc': loc, 'msg': err['msg']})
+        errors.update(failed)
+
+        # Everything left is known to be valid, so this second pass cannot fail
+        candidates = [i for i in candidates if i not in failed]
+        validated = entity.adapter.validate_python([items[i] for i in candidates])
+
+    return list(zip(candidates, (item.model_dump() for item in validated)))
+
+
+def _existing_ids(model, ids):
+    ids = list(ids)
+    found = set()
+    for start in range(0, len(ids), FK_CHECK_CHUNK_SIZE):
+        chunk = ids[start:start + FK_CHECK_CHUNK_SIZE]
+        found.update(row[0] for row in db.session.query(model.id).filter(model.id.in_(chunk)))
+    return found
+
+
+def check_foreign_keys(entity, rows, errors):
+    """Drop rows that reference missing parents, using one set lookup per foreign key"""
+    for column, parent in entity.foreign_keys.items():
+        existing = _existing_ids(parent, {row[column] for _, row in rows})
+        for index, row in rows:
+            if row[column] not in existing:
+                errors.setdefault(index, []).append({
+                    'loc': [column], 'msg': f"{parent.__tablename__} {row[column]} does not exist"
+                })
+
+    return [(index, row) for index, row in rows if index not in errors]
+
+
+def insert_chunks(entity, rows, errors):
+    """
+    Insert rows with multi-row INSERT ... RETURNING id, one savepoint per chunk,
+    so a failing chunk is reported without aborting the rest of the batch.
+
+    Returns a mapping of input index to the new row id.
+    """
+    statement = insert(entity.model).returning(entity.model.id, sort_by_parameter_order=True)
+    ids = {}
+
+    for start in range(0, len(rows), BULK_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_CHUNK_SIZE]
+        try:
+            with db.session.begin_nested():
+                result = db.session.execute(statement, [row for _, row in chunk])
+                ids.update(zip((index for index, _ in chunk), result.scalars()))
+        except Exception as e:
+            for index, _ in chunk:
+                errors[index] = [{'loc': [], 'msg': str(e.__cause__ or e)}]
+
+    return ids
+
+
+def bulk_ingest(entity, items, errors):
+    """Validate, check and insert `items`; returns the response body"""
+    rows = validate_batch(entity, items, errors)
+    rows = check_foreign_keys(entity, rows, errors)
+    ids = insert_chunks(entity, rows, errors)
+    db.session.commit()
+
+    table = entity.model.__tablename__
+    for new_id in ids.values():
+        entity_caches[table].invalidate(new_id)
+    stats_cache.record_inserts(table, [dict(row, id=ids[index]) for index, row in rows if index in ids])
+    if table == 'facilities' and ids:
+        geo_index.invalidate()
+
+    return {
+        'received': len(items),
+        'inserted': len(ids),
+        'failed': len(errors),
+        'ids': [ids.get(i) for i in range(len(items))],
+        'errors': [{'index': i, 'errors': errors[i]} for i in sorted(errors)],
+    }
@@ -0,0 +1,112 @@
+"""
+Bounded LRU + TTL cache for single-resource lookups, with ETag support
+
+Entity entries are tagged with their table's ELT change counter
+(data_versions.py) and ignored once it moves, so every worker stops serving
+a row the pipeline rewrote within DATA_VERSION_CHECK_SECONDS.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import Response, request
+
+from data_versions import data_versions
+from serializers import dumps
+
+ENTITY_CACHE_MAXSIZE = int(os.getenv('ENTITY_CACHE_MAXSIZE', '10000'))
+ENTITY_CACHE_TTL_SECONDS = int(os.getenv('ENTITY_CACHE_TTL_SECONDS', '300'))
+# Facility rows almost never change, so they can be kept much longer
+FACILITY_CACHE_TTL_SECONDS = int(os.getenv('FACILITY_CACHE_TTL_SECONDS', '3600'))
+
+CachedEntity = namedtuple('CachedEntity', ['body', 'etag', 'version'])
+
+
+class LRUTTLCache:
+    """Thread-safe cache holding at most `maxsize` entries, each for at most `ttl` seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() > entry[1]:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+entity_caches = {
+    'facilities': LRUTTLCache(ENTITY_CACHE_MAXSIZE, FACILITY_CACHE_TTL_SECONDS),
+    'patients': LRUTTLCache(ENTITY_CACHE_MAXSIZE, ENTITY_CACHE_TTL_SECONDS),
+    'medical_records': LRUTTLCache(ENTITY_CACHE_MAXSIZE, ENTITY_CACHE_TTL_SECONDS),
+}
+
+
+def entity_response(table, key, load, schema):
+    """
+    Respond with one resource of `table`, serialized once and then served
+    from its entity cache.
+
+    `load(key)` fetches the ORM object on a miss, or when the ELT has written
+    `table` since the entry was cached. The ETag is a hash of the serialized
+    body, so when a cached entry matches `If-None-Match` the 304 is answered
+    without loading or re-serializing the resource. Returns None when the
+    resource does not exist.
+    """
+    cache = entity_caches[table]
+    # Read before loading, so an entry is never tagged newer than its body
+    version = data_versions.version(table)
+    entry = cache.get(key)
+    if entry is None or entry.version != version:
+        obj = load(key)
+        if obj is None:
+            return None
+        body = dumps(schema.model_validate(obj).model_dump()) + b'\n'
+        entry = CachedEntity(body, hashlib.sha256(body).hexdigest()[:32], version)
+        cache.set(key, entry)
+
+    if request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    return response
@@ -0,0 +1,58 @@
+"""
+Database connection settings from the environment
+
+The primary is configured with `POSTGRES_*` variables. Setting
+`POSTGRES_READ_HOST` adds a read replica; its other `POSTGRES_READ_*`
+settings default to the primary's.
+"""
+import os
+
+
+def _clean_host(host):
+    return host.replace('http://', '').replace('https://', '').strip('/')
+
+
+def database_settings(prefix='POSTGRES', defaults=None):
+    """Host, port, user, password and database name for `prefix`, e.g. `POSTGRES_READ`"""
+    defaults = defaults or {
+        'host': 'localhost', 'port': '5432', 'user': 'postgres', 'password': 'secret', 'db': 'postgres',
+    }
+    settings = {key: os.getenv(f'{prefix}_{key.upper()}', default) for key, default in defaults.items()}
+    settings['host'] = _clean_host(settings['host'])
+    return settings
+
+
+def database_uri(settings):
+    return (
+        f"postgresql://{settings['user']}:{settings['password']}"
+        f"@{settings['host']}:{settings['port']}/{settings['db']}"
+    )
+
+
+def redacted_uri(settings):
+    return f"postgresql://{settings['user']}:***@{settings['host']}:{settings['port']}/{settings['db']}"
+
+
+def engine_options(prefix='POSTGRES', defaults=None):
+    """
+    Connection pool options for `prefix`: `{prefix}_POOL_SIZE`, `_MAX_OVERFLOW`,
+    `_POOL_TIMEOUT` (seconds to wait for a connection) and `_POOL_RECYCLE`.
+    """
+    defaults = defaults or {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30, 'pool_recycle': 300}
+    options = {
+        key: int(os.getenv(f'{prefix}_{key.upper()}', default)) for key, default in defaults.items()
+    }
+    options['pool_pre_ping'] = True
+    return options
+
+
+PRIMARY = database_settings('POSTGRES')
+PRIMARY_ENGINE_OPTIONS = engine_options('POSTGRES')
+
+READ_REPLICA = None
+READ_REPLICA_ENGINE_OPTIONS = None
+if os.getenv('POSTGRES_READ_HOST'):
+    READ_REPLICA = database_settings('POSTGRES_READ', defaults=PRIMARY)
+    READ_REPLICA_ENGINE_OPTIONS = engine_options(
+        'POSTGRES_READ', defaults={k: v for k, v in PRIMARY_ENGINE_OPTIONS.items() if k != 'pool_pre_ping'}
+    )
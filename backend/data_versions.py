@@ -0,0 +1,50 @@
+"""
+Change counters of the tables the ELT writes
+
+The transform stage (elt/generate_ids.py) bumps a table's counter in
+`data_versions` in the same transaction as each chunk it writes. The
+in-process caches remember the counters they were filled under and reload
+once those move. Each API worker re-reads the counters at most every
+DATA_VERSION_CHECK_SECONDS, which bounds how long it serves data older than
+a pipeline write.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy.exc import ProgrammingError
+
+from database import db
+from models import DataVersion
+
+DATA_VERSION_CHECK_SECONDS = float(os.getenv('DATA_VERSION_CHECK_SECONDS', '5'))
+
+
+class DataVersions:
+    """The counter of every table, re-read at most every `interval` seconds"""
+
+    def __init__(self, interval=DATA_VERSION_CHECK_SECONDS):
+        self.interval = interval
+        self._versions = {}
+        self._read_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """{table: version} as last read; tables the ELT has not written are absent"""
+        with self._lock:
+            due = self._read_at is None or time.monotonic() - self._read_at >= self.interval
+            if due:
+                self._read_at = time.monotonic()
+        if due:
+            try:
+                self._versions = dict(db.session.query(DataVersion.table_name, DataVersion.version))
+            except ProgrammingError:
+                # The migration creating the table has not been run yet
+                db.session.rollback()
+        return self._versions
+
+    def version(self, table):
+        return self.current().get(table, 0)
+
+
+data_versions = DataVersions()
@@ -1,10 +1,72 @@
 """
 Database instance
 """
+import os
+
+from flask import g, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from sqlalchemy.orm import DeclarativeBase
 
+REPLICA_BIND = 'replica'
+# After a write, the client's reads stay on the primary for this long
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+READ_PRIMARY_COOKIE = 'read_primary'
+READ_PRIMARY_HEADER = 'X-Read-Primary'
+
+
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
\ No newline at end of file
+
+class RoutingSession(Session):
+    """
+    Sends the SELECTs of GET requests to the read replica when one is bound.
+
+    Everything else goes to the primary: writes, SELECT ... FOR UPDATE, work
+    outside a request (CLI, migrations), requests that opted into
+    read-your-writes, and any statement after this session has flushed.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, clause):
+        if self._flushing:
+            self.info['wrote'] = True
+            return False
+        return (
+            REPLICA_BIND in self._db.engines
+            and has_request_context()
+            and g.get('read_replica', False)
+            and not self.info.get('wrote')
+            and getattr(clause, 'is_select', False)
+            and getattr(clause, '_for_update_arg', None) is None
+        )
+
+
+def _route_request():
+    g.read_replica = (
+        request.method in ('GET', 'HEAD')
+        and READ_PRIMARY_HEADER not in request.headers
+        and READ_PRIMARY_COOKIE not in request.cookies
+    )
+
+
+def _remember_write(response):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE, '1', max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax'
+        )
+    return response
+
+
+def init_read_routing(app):
+    """Route GET requests to the replica, except right after the client wrote"""
+    app.before_request(_route_request)
+    app.after_request(_remember_write)
+
+
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
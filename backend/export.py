@@ -0,0 +1,85 @@
+"""
+Streaming bulk export of medical records and triage visits
+
+Dates and datetimes are written as ISO-8601 (`2025-01-02`,
+`2025-01-02T10:00:00.500000`, UTC without an offset) rather than the HTTP dates
+the list endpoints return: exports feed other loaders, so they keep
+microseconds and the date/datetime distinction, and parse back with
+`fromisoformat`.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from models import MedicalRecord, TriageVisit
+from schemas import MedicalRecordOut, TriageVisitOut
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = 2000
+
+EXPORT_ENTITIES = {
+    'medical-records': (MedicalRecord, MedicalRecordOut),
+    'triage-visits': (TriageVisit, TriageVisitOut),
+}
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def stream_ndjson(rows, names):
+    """Yield newline-delimited JSON, one chunk per fetched batch"""
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(dict(zip(names, row)), default=_json_default))
+        if len(buffer) >= EXPORT_BATCH_SIZE:
+            yield '\n'.join(buffer) + '\n'
+            buffer = []
+    if buffer:
+        yield '\n'.join(buffer) + '\n'
+
+
+def stream_csv(rows, names):
+    """Yield CSV with a header row; JSONB and array columns are JSON-encoded"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(names)
+
+    count = 0
+    for row in rows:
+        writer.writerow([
+            json.dumps(v) if isinstance(v, (dict, list))
+            else v.isoformat() if isinstance(v, (datetime, date))
+            else v
+            for v in row
+        ])
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate(0)
+    yield out.getvalue()
+
+
+def stream_export(query, names, fmt):
+    """
+    Stream `query` in the requested format.
+
+    `yield_per` makes psycopg2 use a server-side cursor, so only one batch of
+    rows is held in memory at a time regardless of the export size.
+    """
+    rows = query.yield_per(EXPORT_BATCH_SIZE)
+    if fmt == 'csv':
+        return stream_csv(rows, names)
+    return stream_ndjson(rows, names)
@@ -0,0 +1,54 @@
+"""
+Query filters shared by the list and export endpoints
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from models import MedicalRecord
+
+# Must match the expression of `ix_medical_records_diagnosis_created_at_id`
+DIAGNOSIS = func.lower(MedicalRecord.data['diagnosis'].astext)
+
+
+class InvalidFilterError(ValueError):
+    """Raised when a filter argument cannot be parsed"""
+
+
+def date_arg(args, name):
+    """The YYYY-MM-DD date in `args[name]`, or None if it is missing"""
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise InvalidFilterError(f"Invalid {name}: {value} (expected YYYY-MM-DD)") from None
+
+
+def apply_record_filters(query, model, args):
+    """
+    Filter a medical record / triage visit query by the common request args:
+    `patient_id`, `facility_id`, and an inclusive `start_date`/`end_date`
+    range (YYYY-MM-DD) on `created_at`. Medical records can also be filtered
+    by `diagnosis` (case-insensitive exact match on `data->>'diagnosis'`).
+    Raises InvalidFilterError for a malformed date.
+    """
+    patient_id = args.get('patient_id', type=int)
+    facility_id = args.get('facility_id', type=int)
+    start_date = date_arg(args, 'start_date')
+    end_date = date_arg(args, 'end_date')
+    diagnosis = args.get('diagnosis', '').strip()
+
+    if patient_id:
+        query = query.filter(model.patient_id == patient_id)
+    if facility_id:
+        query = query.filter(model.facility_id == facility_id)
+    if start_date:
+        query = query.filter(model.created_at >= start_date)
+    if end_date:
+        query = query.filter(model.created_at < end_date + timedelta(days=1))
+    if diagnosis and model is MedicalRecord:
+        query = query.filter(DIAGNOSIS == diagnosis.lower())
+
+    return query
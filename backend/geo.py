@@ -0,0 +1,259 @@
+"""
+In-memory spatial index for nearest-facility lookups
+
+Facilities are bucketed into a fixed lat/lon grid. A query visits grid rings
+outward from the query point's cell and stops as soon as no unvisited ring can
+hold a closer facility (or one inside the radius), so a lookup only touches the
+few cells around the point. Candidates are ranked by haversine distance.
+
+Rings never extend past the facilities' bounding box. When reaching the
+facilities would take walking many empty cells (a point far from all of
+them), every facility is ranked in one vectorized pass instead.
+"""
+import heapq
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from database import db
+from models import Facility
+from serializers import FACILITY_COLUMNS, rows_to_dicts
+
+GEO_CELL_DEGREES = float(os.getenv('GEO_CELL_DEGREES', '0.25'))
+# A ring search walking more than facilities / GEO_SCAN_RATIO cells falls back
+# to the vectorized pass, which is roughly that much cheaper per point
+GEO_SCAN_RATIO = int(os.getenv('GEO_SCAN_RATIO', '16'))
+# Full rebuild interval, to pick up facilities written outside the API
+GEO_INDEX_TTL_SECONDS = int(os.getenv('GEO_INDEX_TTL_SECONDS', '600'))
+MAX_NEARBY_LIMIT = 100
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def unit_vectors(lats, lons):
+    """Points on the unit sphere, as an (n, 3) array, for degrees lat/lon"""
+    phi, lam = np.radians(lats), np.radians(lons)
+    return np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+
+
+def cosine_to_km(cosines):
+    """Great-circle distance for the dot product of two unit vectors"""
+    return EARTH_RADIUS_KM * np.arccos(np.clip(cosines, -1.0, 1.0))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class FacilityGeoIndex:
+    def __init__(self, cell_degrees=GEO_CELL_DEGREES, ttl=GEO_INDEX_TTL_SECONDS):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self.lon_cells = math.ceil(360 / cell_degrees)
+        self._cells = None
+        self._facilities = {}
+        self._size = 0
+        # (unit vectors, ids) arrays for the vectorized pass, and the occupied
+        # grid rows/columns as (min_row, max_row, min_col, max_col)
+        self._points = (np.empty((0, 3)), np.empty(0, dtype=np.int64))
+        self._bounds = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def _cell(self, lat, lon):
+        return (
+            math.floor((lat + 90) / self.cell_degrees),
+            math.floor((lon + 180) / self.cell_degrees) % self.lon_cells,
+        )
+
+    def _insert(self, cells, facility):
+        lat, lon = float(facility['lat']), float(facility['lon'])
+        cells.setdefault(self._cell(lat, lon), []).append((lat, lon, facility['id']))
+
+    def rebuild(self):
+        """Load every facility with coordinates and rebuild the grid"""
+        rows = rows_to_dicts(
+            db.session.query(*FACILITY_COLUMNS)
+            .filter(Facility.lat.isnot(None), Facility.lon.isnot(None))
+        )
+        cells = {}
+        for facility in rows:
+            self._insert(cells, facility)
+        points = (
+            unit_vectors([float(facility['lat']) for facility in rows], [float(facility['lon']) for facility in rows]),
+            np.array([facility['id'] for facility in rows], dtype=np.int64),
+        )
+
+        with self._lock:
+            self._cells = cells
+            self._facilities = {facility['id']: facility for facility in rows}
+            self._size = len(rows)
+            self._points = points
+            self._bounds = self._cell_bounds(cells)
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """Force a rebuild on the next query"""
+        with self._lock:
+            self._cells = None
+
+    def add(self, facility):
+        """Add one newly created facility (a `FacilityOut` dict) without a rebuild"""
+        if facility.get('lat') is None or facility.get('lon') is None:
+            return
+        with self._lock:
+            if self._cells is None:
+                return
+            self._insert(self._cells, facility)
+            self._facilities = {**self._facilities, facility['id']: facility}
+            self._size += 1
+            lat, lon = float(facility['lat']), float(facility['lon'])
+            vectors, ids = self._points
+            self._points = (np.vstack((vectors, unit_vectors([lat], [lon]))), np.append(ids, facility['id']))
+            self._bounds = self._cell_bounds([self._cell(lat, lon)], self._bounds)
+
+    def _ensure_built(self):
+        if self._cells is None or time.monotonic() - self._built_at > self.ttl:
+            self.rebuild()
+
+    @staticmethod
+    def _cell_bounds(cells, bounds=None):
+        rows = [row for row, _ in cells]
+        cols = [col for _, col in cells]
+        if bounds is not None:
+            rows += bounds[:2]
+            cols += bounds[2:]
+        return (min(rows), max(rows), min(cols), max(cols)) if rows else None
+
+    def _col_distance(self, col, other):
+        return min(abs(col - other), self.lon_cells - abs(col - other))
+
+    def _span(self, row, col, bounds):
+        """
+        (gap, span): the ring from (row, col) that first reaches the occupied
+        cells in `bounds`, and the ring after which all of them have been visited
+        """
+        min_row, max_row, min_col, max_col = bounds
+        half = self.lon_cells // 2
+        row_gap = max(min_row - row, row - max_row, 0)
+        col_gap = 0 if min_col <= col <= max_col else min(self._col_distance(col, c) for c in (min_col, max_col))
+        if min_col <= (col + half) % self.lon_cells <= max_col:
+            col_span = half + 1
+        else:
+            col_span = max(self._col_distance(col, c) for c in (min_col, max_col))
+        return max(row_gap, col_gap), max(abs(row - min_row), abs(row - max_row), col_span)
+
+    def _ring(self, row, col, radius):
+        if radius == 0:
+            yield row, col
+            return
+        for r in range(row - radius, row + radius + 1):
+            step = 1 if r in (row - radius, row + radius) else 2 * radius
+            for c in range(col - radius, col + radius + 1, step):
+                yield r, c % self.lon_cells
+
+    def _ring_lower_bound_km(self, lat, lon, row, col, radius):
+        """
+        No facility in ring `radius` or beyond can be closer than this to the
+        query point: its distance to the nearest edge of the block of cells in
+        the rings inside `radius`. A latitude edge is reached along the
+        meridian, and a longitude edge at its closest point, which is a pole
+        once it is 90 degrees or more away.
+        """
+        if radius == 0:
+            return 0.0
+        inner, cell = radius - 1, self.cell_degrees
+        south, north = (row - inner) * cell - 90, (row + inner + 1) * cell - 90
+        bounds = []
+        if north < 90:
+            bounds.append((north - lat) * KM_PER_DEGREE)
+        if south > -90:
+            bounds.append((lat - south) * KM_PER_DEGREE)
+        if 2 * inner + 1 < self.lon_cells:
+            # Longitude within the grid's [0, 360) columns, so the edges are measured from the query's cell
+            x = (lon + 180) % 360
+            for delta in ((col + inner + 1) * cell - x, x - (col - inner) * cell):
+                if delta >= 90:
+                    bounds.append((90 - abs(lat)) * KM_PER_DEGREE)
+                else:
+                    sine = math.cos(math.radians(lat)) * math.sin(math.radians(delta))
+                    bounds.append(EARTH_RADIUS_KM * math.asin(min(1.0, sine)))
+        return min(bounds) if bounds else math.inf
+
+    def nearby(self, lat, lon, limit=10, radius_km=None):
+        """
+        Return up to `limit` facilities nearest to (lat, lon), optionally only
+        those within `radius_km`, as (distance_km, facility) pairs sorted by distance.
+        """
+        if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            raise ValueError('lat must be within ±90 and lon within ±180')
+        self._ensure_built()
+        cells, facilities, size, bounds = self._cells, self._facilities, self._size, self._bounds
+        if not size:
+            return []
+
+        row, col = self._cell(lat, lon)
+        gap, span = self._span(row, col, bounds)
+        if radius_km is not None and self._ring_lower_bound_km(lat, lon, row, col, gap) > radius_km:
+            return []
+        max_cells = size // GEO_SCAN_RATIO
+        if (2 * gap + 1) ** 2 > max_cells:
+            return self._scan(lat, lon, limit, radius_km)
+        best = []  # max-heap of (-distance, id), bounded by `limit`
+        visited = set()
+        radius = 0
+
+        while radius <= span:
+            bound = self._ring_lower_bound_km(lat, lon, row, col, radius)
+            if radius_km is not None and bound > radius_km:
+                break
+            if limit is not None and len(best) >= limit and bound > -best[0][0]:
+                break
+            # Walking further costs more than ranking every facility at once
+            if (2 * radius + 1) ** 2 > max_cells:
+                return self._scan(lat, lon, limit, radius_km)
+
+            for cell in self._ring(row, col, radius):
+                if cell in visited:
+                    continue
+                visited.add(cell)
+                for point_lat, point_lon, facility_id in cells.get(cell, ()):
+                    distance = haversine_km(lat, lon, point_lat, point_lon)
+                    if radius_km is not None and distance > radius_km:
+                        continue
+                    if limit is None or len(best) < limit:
+                        heapq.heappush(best, (-distance, facility_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, facility_id))
+            radius += 1
+
+        return [(-d, facilities[facility_id]) for d, facility_id in sorted(best, reverse=True)]
+
+    def _scan(self, lat, lon, limit, radius_km):
+        """
+        Rank every facility in one vectorized pass. The dot product of unit
+        vectors falls as great-circle distance grows, so points are ranked by
+        it and only the facilities returned are converted to kilometres.
+        """
+        facilities, (vectors, ids) = self._facilities, self._points
+        nearness = -(vectors @ unit_vectors([lat], [lon])[0])
+        order = np.arange(len(nearness))
+        if radius_km is not None:
+            order = order[nearness <= -math.cos(min(math.pi, radius_km / EARTH_RADIUS_KM))]
+        if limit is not None and limit < len(order):
+            order = order[np.argpartition(nearness[order], limit - 1)[:limit]]
+        order = order[np.argsort(nearness[order], kind='stable')]
+        distances = cosine_to_km(-nearness[order])
+        return [(float(distance), facilities[int(ids[i])]) for distance, i in zip(distances, order)]
+
+
+geo_index = FacilityGeoIndex()
@@ -0,0 +1,172 @@
+"""
+Read access to the dbt mart tables, cached per dbt build
+
+Each mart is exposed with equality filters and keyset paging on its unique
+key. Responses are cached in-process under the mart's current build marker:
+dbt's on-run-end hook (macros/record_model_runs.sql) records the invocation
+that last built each model in `marts.dbt_model_runs`, so a rebuilt mart gets
+a new marker and its cached pages simply stop matching. Until the hook has run
+once, the newest `dbt_updated_at` of the mart is used as the marker instead.
+"""
+import hashlib
+import os
+from collections import namedtuple
+from datetime import date
+
+from sqlalchemy import and_, column, func, literal_column, or_, select, table
+from sqlalchemy.exc import ProgrammingError
+
+from cache import LRUTTLCache
+from database import db
+from filters import date_arg
+from pagination import InvalidCursorError, decode_position, encode_position
+from serializers import dumps, rows_to_dicts
+
+MARTS_SCHEMA = os.getenv('MARTS_SCHEMA', 'marts')
+MART_CACHE_MAXSIZE = int(os.getenv('MART_CACHE_MAXSIZE', '1000'))
+# Entries are keyed on the build marker, so the TTL is only a backstop
+MART_CACHE_TTL_SECONDS = int(os.getenv('MART_CACHE_TTL_SECONDS', '86400'))
+MAX_MART_PAGE_SIZE = 1000
+
+mart_cache = LRUTTLCache(MART_CACHE_MAXSIZE, MART_CACHE_TTL_SECONDS)
+
+MODEL_RUNS = table(
+    'dbt_model_runs', column('model'), column('invocation_id'), schema=MARTS_SCHEMA
+)
+
+
+class MartNotBuiltError(LookupError):
+    """Raised when the mart table does not exist yet (dbt has not built it)"""
+
+
+class Mart(namedtuple('Mart', ['table', 'keys', 'filters', 'date_column'])):
+    """
+    `keys` are (column, parser) pairs forming the mart's unique, ascending
+    sort key; `filters` are the columns accepted as equality filters, and
+    `date_column` (if any) takes `start_date`/`end_date`.
+    """
+
+
+MARTS = {
+    'facility-performance': Mart(
+        'facility_performance', (('facility_id', int),),
+        ('state', 'lga', 'facility_category', 'volume_category', 'acuity_category'), None,
+    ),
+    'patient-summary': Mart(
+        'patient_summary', (('patient_id', int),),
+        ('facility_name', 'facility_state', 'age_group', 'sex'), None,
+    ),
+    'triage-trends': Mart(
+        'triage_trends', (('facility_state', str), ('visit_date', date.fromisoformat)),
+        ('facility_state',), 'visit_date',
+    ),
+    'condition-analysis': Mart(
+        'condition_analysis', (('condition', str),),
+        ('severity_category', 'frequency_category'), None,
+    ),
+}
+
+
+def _table(mart):
+    return table(mart.table, schema=MARTS_SCHEMA)
+
+
+def build_marker(mart):
+    """Identity of the dbt build the mart table currently holds"""
+    try:
+        marker = db.session.execute(
+            select(MODEL_RUNS.c.invocation_id).where(MODEL_RUNS.c.model == mart.table)
+        ).scalar()
+        if marker is not None:
+            return marker
+    except ProgrammingError:
+        db.session.rollback()
+
+    try:
+        built_at = db.session.execute(
+            select(func.max(column('dbt_updated_at'))).select_from(_table(mart))
+        ).scalar()
+    except ProgrammingError as e:
+        db.session.rollback()
+        raise MartNotBuiltError(f"{MARTS_SCHEMA}.{mart.table} has not been built by dbt yet") from e
+    return str(built_at) if built_at is not None else 'empty'
+
+
+def _decode_cursor(mart, cursor):
+    try:
+        values = decode_position(cursor)
+        if len(values) != len(mart.keys):
+            raise ValueError(cursor)
+        return [parse(value) for (_, parse), value in zip(mart.keys, values)]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def _after(mart, position):
+    """Rows strictly after `position` in ascending key order"""
+    key_columns = [column(name) for name, _ in mart.keys]
+    clauses = []
+    for i, key_column in enumerate(key_columns):
+        clauses.append(and_(*[key_columns[j] == position[j] for j in range(i)], key_column > position[i]))
+    return or_(*clauses)
+
+
+def query_mart(mart, args, per_page):
+    """One page of the mart as (rows, next_cursor)"""
+    query = select(literal_column('*')).select_from(_table(mart))
+    for name in mart.filters:
+        value = args.get(name)
+        if value:
+            query = query.where(column(name) == value)
+    if mart.date_column:
+        start_date = date_arg(args, 'start_date')
+        end_date = date_arg(args, 'end_date')
+        if start_date:
+            query = query.where(column(mart.date_column) >= start_date)
+        if end_date:
+            query = query.where(column(mart.date_column) <= end_date)
+
+    cursor = args.get('cursor')
+    if cursor:
+        query = query.where(_after(mart, _decode_cursor(mart, cursor)))
+    query = query.order_by(*[column(name) for name, _ in mart.keys]).limit(per_page + 1)
+
+    try:
+        rows = rows_to_dicts(db.session.execute(query))
+    except ProgrammingError as e:
+        db.session.rollback()
+        raise MartNotBuiltError(f"{MARTS_SCHEMA}.{mart.table} has not been built by dbt yet") from e
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_position([
+            last[name].isoformat() if isinstance(last[name], date) else last[name]
+            for name, _ in mart.keys
+        ])
+    return rows, next_cursor
+
+
+def mart_page(name, args):
+    """
+    Serialized JSON body for one page of mart `name`, from the cache when
+    the mart has not been rebuilt since the page was cached.
+    """
+    mart = MARTS[name]
+    per_page = min(max(args.get('per_page', 100, type=int), 1), MAX_MART_PAGE_SIZE)
+    marker = build_marker(mart)
+
+    request_key = hashlib.sha256(dumps(sorted(args.items(multi=True)))).hexdigest()
+    key = (name, marker, per_page, request_key)
+    body = mart_cache.get(key)
+    if body is None:
+        rows, next_cursor = query_mart(mart, args, per_page)
+        body = dumps({
+            'data': rows,
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+            'dbt_build': marker,
+        }) + b'\n'
+        mart_cache.set(key, body)
+    return body
@@ -0,0 +1,308 @@
+"""
+Per-request performance instrumentation, exported in Prometheus text format
+
+For every request we record, by route, the latency, the number of SQL
+statements and the time spent in them (from SQLAlchemy cursor events), the
+rows serialized and the response size. Connection pool state is sampled when
+`/metrics` is scraped. Requests slower than `SLOW_REQUEST_MS` are logged with
+that breakdown, and when `PROFILING_ENABLED` is set a request carrying the
+`X-Profile` header is run under a profiler whose report is logged.
+"""
+import bisect
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, exc
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # optional, falls back to cProfile
+    Profiler = None
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '500'))
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_HEADER = 'X-Profile'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(state) for labels, state in self._values.items()}
+        for labels, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labelnames, labels, [('le', bound)]), cumulative)
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), state[-1]
+
+
+class Gauge:
+    """A gauge whose samples are computed by `collect()` at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+ROUTE_LABELS = ('method', 'route')
+
+REQUESTS = Counter('http_requests_total', 'Requests handled', ('method', 'route', 'status'))
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency', ROUTE_LABELS, LATENCY_BUCKETS
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements', 'SQL statements issued per request', ROUTE_LABELS, COUNT_BUCKETS
+)
+REQUEST_SQL_TIME = Histogram(
+    'http_request_sql_duration_seconds', 'Time spent executing SQL per request',
+    ROUTE_LABELS, LATENCY_BUCKETS
+)
+RESPONSE_ROWS = Counter('http_response_rows_total', 'Rows serialized into responses', ROUTE_LABELS)
+RESPONSE_BYTES = Histogram(
+    'http_response_size_bytes', 'Response body size (streamed responses excluded)',
+    ROUTE_LABELS, BYTES_BUCKETS
+)
+SQL_STATEMENTS = Counter('db_sql_statements_total', 'SQL statements executed', ('engine',))
+SQL_TIME = Counter('db_sql_duration_seconds_total', 'Time spent executing SQL', ('engine',))
+POOL_CHECKOUTS = Counter('db_pool_checkouts_total', 'Connections checked out of the pool', ('engine',))
+POOL_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection',
+    ('engine',), LATENCY_BUCKETS
+)
+POOL_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up waiting for a connection', ('engine',)
+)
+
+_engines = {}
+
+
+def _pool_stats():
+    for name, engine in sorted(_engines.items()):
+        pool = engine.pool
+        for stat in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, stat):
+                yield (name, stat), getattr(pool, stat)()
+
+
+POOL_STATE = Gauge('db_pool_connections', 'Connection pool state', ('engine', 'state'), _pool_stats)
+
+REGISTRY = [
+    REQUESTS, REQUEST_LATENCY, REQUEST_SQL_STATEMENTS, REQUEST_SQL_TIME, RESPONSE_ROWS,
+    RESPONSE_BYTES, SQL_STATEMENTS, SQL_TIME, POOL_CHECKOUTS, POOL_WAIT, POOL_TIMEOUTS, POOL_STATE,
+]
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    __slots__ = ('started', 'sql_statements', 'sql_seconds', 'rows', 'profiler')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.profiler = None
+
+
+def _current():
+    return g.get('_request_stats') if has_request_context() else None
+
+
+def record_rows(count):
+    """Count `count` rows serialized for the current request"""
+    stats = _current()
+    if stats is not None:
+        stats.rows += count
+
+
+def _instrument_engine(name, engine):
+    labels = (name,)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_query_started'].pop()
+        SQL_STATEMENTS.inc(labels)
+        SQL_TIME.inc(labels, elapsed)
+        stats = _current()
+        if stats is not None:
+            stats.sql_statements += 1
+            stats.sql_seconds += elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        started = context.connection.info.get('_query_started') if context.connection else None
+        if started:
+            started.pop()
+
+    @event.listens_for(engine.pool, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        POOL_CHECKOUTS.inc(labels)
+
+    # The pool has no "checkout requested" event, so time the call that waits on it
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        started = time.perf_counter()
+        try:
+            return raw_connection()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc(labels)
+            raise
+        finally:
+            POOL_WAIT.observe(labels, time.perf_counter() - started)
+
+    engine.raw_connection = timed_raw_connection
+    _engines[name] = engine
+
+
+def _start_profiler():
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _profile_report(profiler):
+    if Profiler is not None and isinstance(profiler, Profiler):
+        profiler.stop()
+        return profiler.output_text(unicode=True)
+    profiler.disable()
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+    return out.getvalue()
+
+
+def _before_request():
+    stats = g._request_stats = RequestStats()
+    if PROFILING_ENABLED and request.headers.get(PROFILE_HEADER):
+        stats.profiler = _start_profiler()
+
+
+def _after_request(response):
+    stats = _current()
+    if stats is None:
+        return response
+
+    elapsed = time.perf_counter() - stats.started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (request.method, route)
+
+    REQUESTS.inc((request.method, route, str(response.status_code)))
+    REQUEST_LATENCY.observe(labels, elapsed)
+    REQUEST_SQL_STATEMENTS.observe(labels, stats.sql_statements)
+    REQUEST_SQL_TIME.observe(labels, stats.sql_seconds)
+    if stats.rows:
+        RESPONSE_ROWS.inc(labels, stats.rows)
+    size = None if response.is_streamed else response.calculate_content_length()
+    if size is not None:
+        RESPONSE_BYTES.observe(labels, size)
+
+    if stats.profiler is not None:
+        logger.info(f"Profile for {request.method} {request.full_path.rstrip('?')}:\n{_profile_report(stats.profiler)}")
+
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        logger.warning(
+            f"Slow request: {request.method} {request.full_path.rstrip('?')} -> {response.status_code} "
+            f"in {elapsed * 1000:.1f}ms; {stats.sql_statements} SQL statements "
+            f"({stats.sql_seconds * 1000:.1f}ms), {stats.rows} rows, "
+            f"{'unknown size' if size is None else f'{size} bytes'}"
+        )
+    return response
+
+
+def init_app(app, db):
+    """Install the request hooks and instrument every engine of `db`"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            _instrument_engine(bind_key or 'default', engine)
@@ -0,0 +1,34 @@
+"""data versions
+
+Per-table change counters that the ELT transform bumps with every chunk it
+writes, so the API workers' in-process caches can tell when pipeline writes
+have made them stale.
+
+Revision ID: 5e9c0d7a3f21
+Revises: 88000b73d63b
+Create Date: 2026-10-17 16:40:03.118425
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9c0d7a3f21'
+down_revision = '88000b73d63b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'data_versions',
+        sa.Column('table_name', sa.String(length=50), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('table_name'),
+    )
+
+
+def downgrade():
+    op.drop_table('data_versions')
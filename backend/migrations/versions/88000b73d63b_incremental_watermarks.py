@@ -0,0 +1,45 @@
+"""incremental watermarks
+
+The incremental fact dbt models select the rows written since their last
+build by `updated_at`. Triage visits gain that column; existing rows get
+the migration time, so the next dbt run merges them once. The indexes
+behind both watermarks are built CONCURRENTLY, like the API indexes.
+
+Revision ID: 88000b73d63b
+Revises: c51e07d9a2b6
+Create Date: 2026-10-17 14:05:12.207911
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '88000b73d63b'
+down_revision = 'c51e07d9a2b6'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_medical_records_updated_at', 'medical_records', '(updated_at)'),
+    ('ix_triage_visits_updated_at', 'triage_visits', '(updated_at)'),
+]
+
+
+def upgrade():
+    # A constant default fills existing rows without rewriting the table. IF NOT
+    # EXISTS covers databases bootstrapped by an init.sql that declared the column.
+    op.execute(
+        "ALTER TABLE triage_visits ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT timezone('utc', now())"
+    )
+    op.execute('ALTER TABLE triage_visits ALTER COLUMN updated_at DROP DEFAULT')
+    with op.get_context().autocommit_block():
+        for name, table, definition in INDEXES:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    op.drop_column('triage_visits', 'updated_at')
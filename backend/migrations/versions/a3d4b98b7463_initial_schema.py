@@ -0,0 +1,106 @@
+"""initial schema
+
+Tables as originally created by elt/init.sql. A table that already exists
+is left alone, so databases bootstrapped before migrations existed can be
+brought under management with a plain `flask db upgrade`.
+
+Revision ID: a3d4b98b7463
+Revises: 
+Create Date: 2026-10-17 00:22:32.177810
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d4b98b7463'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _create_table(name, *columns):
+    # Offline (--sql) runs cannot inspect the database, so they emit every table
+    if op.get_context().as_sql or not sa.inspect(op.get_bind()).has_table(name):
+        op.create_table(name, *columns)
+
+
+def upgrade():
+    _create_table(
+        'facilities',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('state', sa.String(length=100), nullable=False),
+        sa.Column('lga', sa.String(length=100), nullable=False),
+        sa.Column('lat', sa.Numeric(precision=10, scale=8), nullable=True),
+        sa.Column('lon', sa.Numeric(precision=11, scale=8), nullable=True),
+        sa.Column('type', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    _create_table(
+        'patients',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('facility_id', sa.Integer(), nullable=False),
+        sa.Column('first_name', sa.String(length=100), nullable=False),
+        sa.Column('last_name', sa.String(length=100), nullable=False),
+        sa.Column('sex', sa.String(length=10), nullable=False),
+        sa.Column('dob', sa.Date(), nullable=False),
+        sa.Column('phone', sa.String(length=20), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['facility_id'], ['facilities.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    _create_table(
+        'medical_records',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('patient_id', sa.Integer(), nullable=False),
+        sa.Column('facility_id', sa.Integer(), nullable=False),
+        sa.Column('record_type', sa.String(length=100), nullable=True),
+        sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['facility_id'], ['facilities.id']),
+        sa.ForeignKeyConstraint(['patient_id'], ['patients.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    _create_table(
+        'triage_visits',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('patient_id', sa.Integer(), nullable=False),
+        sa.Column('facility_id', sa.Integer(), nullable=False),
+        sa.Column('triage_level', sa.Integer(), nullable=False),
+        sa.Column('likely_conditions', postgresql.ARRAY(sa.Text()), nullable=True),
+        sa.Column('recommendations', postgresql.ARRAY(sa.Text()), nullable=True),
+        sa.Column('language', sa.String(length=10), nullable=True),
+        sa.Column('provider', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['facility_id'], ['facilities.id']),
+        sa.ForeignKeyConstraint(['patient_id'], ['patients.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    _create_table(
+        'record_requests',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('requester_facility_id', sa.Integer(), nullable=False),
+        sa.Column('target_facility_id', sa.Integer(), nullable=False),
+        sa.Column('patient_id', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('acted_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['patient_id'], ['patients.id']),
+        sa.ForeignKeyConstraint(['requester_facility_id'], ['facilities.id']),
+        sa.ForeignKeyConstraint(['target_facility_id'], ['facilities.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('record_requests')
+    op.drop_table('triage_visits')
+    op.drop_table('medical_records')
+    op.drop_table('patients')
+    op.drop_table('facilities')
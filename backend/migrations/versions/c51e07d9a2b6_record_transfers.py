@@ -0,0 +1,49 @@
+"""record transfers
+
+Columns the transfer worker uses to claim approved record requests and to
+record where each finished package was written, plus the indexes behind the
+request lists and the worker's claim query.
+
+Revision ID: c51e07d9a2b6
+Revises: fb721a29e5bb
+Create Date: 2026-10-17 09:12:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c51e07d9a2b6'
+down_revision = 'fb721a29e5bb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('record_requests', sa.Column('claimed_at', sa.DateTime(), nullable=True))
+    op.add_column('record_requests', sa.Column('completed_at', sa.DateTime(), nullable=True))
+    op.add_column('record_requests', sa.Column('package_uri', sa.Text(), nullable=True))
+    op.add_column('record_requests', sa.Column('error', sa.Text(), nullable=True))
+    op.create_index(
+        'ix_record_requests_requester_created_at_id', 'record_requests',
+        ['requester_facility_id', 'created_at', 'id'], if_not_exists=True,
+    )
+    op.create_index(
+        'ix_record_requests_target_created_at_id', 'record_requests',
+        ['target_facility_id', 'created_at', 'id'], if_not_exists=True,
+    )
+    op.create_index(
+        'ix_record_requests_claimable', 'record_requests', ['id'],
+        postgresql_where=sa.text("status IN ('approved', 'processing')"), if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.drop_index('ix_record_requests_claimable', table_name='record_requests')
+    op.drop_index('ix_record_requests_target_created_at_id', table_name='record_requests')
+    op.drop_index('ix_record_requests_requester_created_at_id', table_name='record_requests')
+    op.drop_column('record_requests', 'error')
+    op.drop_column('record_requests', 'package_uri')
+    op.drop_column('record_requests', 'completed_at')
+    op.drop_column('record_requests', 'claimed_at')
@@ -0,0 +1,36 @@
+"""phone digits index
+
+Patient search compares phone numbers by their digits only, so the trigram
+index on `phone` is replaced by one on the phone number stripped of every
+non-digit. Both are built and dropped CONCURRENTLY, like the other API indexes.
+
+Revision ID: e41b6c8f2d57
+Revises: 5e9c0d7a3f21
+Create Date: 2026-10-17 17:22:48.604113
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b6c8f2d57'
+down_revision = '5e9c0d7a3f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_patients_phone_digits_trgm ON patients '
+            r"USING gin (regexp_replace(phone, '\D', '', 'g') gin_trgm_ops)"
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_patients_phone_trgm')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_patients_phone_trgm ON patients USING gin (phone gin_trgm_ops)'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_patients_phone_digits_trgm')
@@ -0,0 +1,52 @@
+"""api indexes
+
+Secondary indexes for the API's filter + order patterns, the fuzzy patient
+search, and the JSONB keys the dbt models extract from medical_records.data.
+They are built CONCURRENTLY so applying this to a live database does not
+block writes. IF NOT EXISTS covers indexes already created by `create_all`.
+
+Revision ID: fb721a29e5bb
+Revises: a3d4b98b7463
+Create Date: 2026-10-17 00:22:33.063439
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'fb721a29e5bb'
+down_revision = 'a3d4b98b7463'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_patients_facility_id_id', 'patients', '(facility_id, id)'),
+    ('ix_patients_full_name_trgm', 'patients',
+     "USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)"),
+    ('ix_patients_phone_trgm', 'patients', 'USING gin (phone gin_trgm_ops)'),
+    ('ix_medical_records_created_at_id', 'medical_records', '(created_at, id)'),
+    ('ix_medical_records_patient_created_at_id', 'medical_records', '(patient_id, created_at, id)'),
+    ('ix_medical_records_facility_created_at_id', 'medical_records', '(facility_id, created_at, id)'),
+    ('ix_medical_records_diagnosis_created_at_id', 'medical_records',
+     "(lower(data ->> 'diagnosis'), created_at, id)"),
+    ('ix_medical_records_treatment', 'medical_records', "(lower(data ->> 'treatment'))"),
+    ('ix_medical_records_medications', 'medical_records', "(lower(data ->> 'medications'))"),
+    ('ix_medical_records_data_gin', 'medical_records', 'USING gin (data jsonb_path_ops)'),
+    ('ix_triage_visits_created_at_id', 'triage_visits', '(created_at, id)'),
+    ('ix_triage_visits_patient_created_at_id', 'triage_visits', '(patient_id, created_at, id)'),
+    ('ix_triage_visits_facility_created_at_id', 'triage_visits', '(facility_id, created_at, id)'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        for name, table, definition in INDEXES:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in reversed(INDEXES):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
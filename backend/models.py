@@ -2,7 +2,7 @@
 SQLAlchemy models
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Date, DateTime, Numeric, Text, ForeignKey
+from sqlalchemy import Column, BigInteger, Integer, String, Date, DateTime, Numeric, Text, ForeignKey, Index, DDL, event, func, text
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from sqlalchemy.orm import relationship
 from database import db  # Import from database.py instead of app.py
@@ -40,6 +40,27 @@ class Patient(db.Model):
     medical_records = relationship('MedicalRecord', back_populates='patient', lazy='dynamic')
     triage_visits = relationship('TriageVisit', back_populates='patient', lazy='dynamic')
     record_requests = relationship('RecordRequest', back_populates='patient', lazy='dynamic')
+    
+    # Indexes are created by the migrations in migrations/versions
+    __table_args__ = (
+        Index('ix_patients_facility_id_id', 'facility_id', 'id'),
+        # Trigram (pg_trgm) indexes backing the fuzzy patient search
+        Index(
+            'ix_patients_full_name_trgm',
+            func.lower(first_name + ' ' + last_name).label('full_name'),
+            postgresql_using='gin',
+            postgresql_ops={'full_name': 'gin_trgm_ops'},
+        ),
+        Index(
+            'ix_patients_phone_digits_trgm',
+            func.regexp_replace(phone, r'\D', '', 'g').label('phone_digits'),
+            postgresql_using='gin',
+            postgresql_ops={'phone_digits': 'gin_trgm_ops'},
+        ),
+    )
+
+
+event.listen(Patient.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
 
 
 class MedicalRecord(db.Model):
@@ -55,6 +76,26 @@ class MedicalRecord(db.Model):
     
     patient = relationship('Patient', back_populates='medical_records')
     facility = relationship('Facility', back_populates='medical_records')
+    
+    # Composite indexes matching the (created_at DESC, id DESC) keyset order used by the list endpoints
+    __table_args__ = (
+        Index('ix_medical_records_created_at_id', 'created_at', 'id'),
+        Index('ix_medical_records_patient_created_at_id', 'patient_id', 'created_at', 'id'),
+        Index('ix_medical_records_facility_created_at_id', 'facility_id', 'created_at', 'id'),
+        Index(
+            'ix_medical_records_diagnosis_created_at_id',
+            func.lower(data['diagnosis'].astext), 'created_at', 'id',
+        ),
+        Index('ix_medical_records_treatment', func.lower(data['treatment'].astext)),
+        Index('ix_medical_records_medications', func.lower(data['medications'].astext)),
+        Index(
+            'ix_medical_records_data_gin', 'data',
+            postgresql_using='gin',
+            postgresql_ops={'data': 'jsonb_path_ops'},
+        ),
+        # Watermark of the incremental fct_medical_records dbt model (time of the last write)
+        Index('ix_medical_records_updated_at', 'updated_at'),
+    )
 
 
 class TriageVisit(db.Model):
@@ -69,9 +110,19 @@ class TriageVisit(db.Model):
     language = Column(String(10), default='en')
     provider = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     patient = relationship('Patient', back_populates='triage_visits')
     facility = relationship('Facility', back_populates='triage_visits')
+    
+    # Composite indexes matching the (created_at DESC, id DESC) keyset order used by the list endpoints
+    __table_args__ = (
+        Index('ix_triage_visits_created_at_id', 'created_at', 'id'),
+        Index('ix_triage_visits_patient_created_at_id', 'patient_id', 'created_at', 'id'),
+        Index('ix_triage_visits_facility_created_at_id', 'facility_id', 'created_at', 'id'),
+        # Watermark of the incremental fct_triage_visits dbt model
+        Index('ix_triage_visits_updated_at', 'updated_at'),
+    )
 
 
 class RecordRequest(db.Model):
@@ -85,5 +136,29 @@ class RecordRequest(db.Model):
     status = Column(String(50), default='pending')
     created_at = Column(DateTime, default=datetime.utcnow)
     acted_at = Column(DateTime)
+    # Set by the transfer worker (see transfers.py)
+    claimed_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    package_uri = Column(Text)
+    error = Column(Text)
+    
+    patient = relationship('Patient', back_populates='record_requests')
+    
+    __table_args__ = (
+        Index('ix_record_requests_requester_created_at_id', 'requester_facility_id', 'created_at', 'id'),
+        Index('ix_record_requests_target_created_at_id', 'target_facility_id', 'created_at', 'id'),
+        # Keeps the worker's claim query cheap however many requests have completed
+        Index(
+            'ix_record_requests_claimable', 'id',
+            postgresql_where=text("status IN ('approved', 'processing')"),
+        ),
+    )
+
+
+class DataVersion(db.Model):
+    """Change counter of a table the ELT writes (see data_versions.py)"""
+    __tablename__ = 'data_versions'
     
-    patient = relationship('Patient', back_populates='record_requests')
\ No newline at end of file
+    table_name = Column(String(50), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime)
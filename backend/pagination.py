@@ -0,0 +1,73 @@
+"""
+Keyset (cursor) pagination helpers
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a client supplies a cursor we did not issue"""
+
+
+def encode_position(values):
+    """Build an opaque cursor from a list of JSON-serializable sort key values"""
+    payload = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_position(cursor):
+    """Turn a cursor back into the list of values it was built from"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except ValueError as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(values, list):
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def encode_cursor(created_at, row_id):
+    """Build an opaque cursor from the (created_at, id) of the last row on a page"""
+    return encode_position([created_at.isoformat(), row_id])
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into its (created_at, id) position"""
+    try:
+        created_at, row_id = decode_position(cursor)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_query(query, model, cursor=None, per_page=50):
+    """
+    Limit `query` to one page ordered by (created_at DESC, id DESC).
+
+    Instead of OFFSET, the page starts strictly after the row the cursor points
+    at, so the database walks the (created_at, id) index from that position and
+    the cost of a page does not grow with its depth. One extra row is fetched to
+    tell whether another page exists.
+    """
+    if per_page < 1:
+        raise ValueError(f"per_page must be at least 1, got {per_page}")
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1)
+
+
+def keyset_paginate(query, model, cursor=None, per_page=50):
+    """Return one page of `query` (see `keyset_query`) and the cursor for the next"""
+    rows = keyset_query(query, model, cursor=cursor, per_page=per_page).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    return rows, next_cursor
@@ -74,6 +74,16 @@ class MedicalRecordOut(BaseModel):
 
 
 # Triage schemas
+class TriageVisitCreate(BaseModel):
+    patient_id: int = Field(..., gt=0)
+    facility_id: int = Field(..., gt=0)
+    triage_level: int = Field(..., ge=1, le=5)
+    likely_conditions: Optional[List[str]] = None
+    recommendations: Optional[List[str]] = None
+    language: Optional[str] = Field(None, max_length=10)
+    provider: Optional[str] = Field(None, max_length=255)
+
+
 class TriageVisitOut(BaseModel):
     id: int
     patient_id: int
@@ -90,6 +100,7 @@ class TriageVisitOut(BaseModel):
 
 # Record Request schemas
 class RecordRequestCreate(BaseModel):
+    requester_facility_id: int = Field(..., gt=0)
     patient_id: int = Field(..., gt=0)
     target_facility_id: int = Field(..., gt=0)
     reason: Optional[str] = None
@@ -104,5 +115,7 @@ class RecordRequestOut(BaseModel):
     status: str
     created_at: datetime
     acted_at: Optional[datetime]
+    completed_at: Optional[datetime]
+    error: Optional[str]
     
     model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
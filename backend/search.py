@@ -0,0 +1,53 @@
+"""
+Fuzzy patient search over the pg_trgm indexes on name and phone
+"""
+import re
+
+from sqlalchemy import case, func, literal, or_
+
+from database import db
+from models import Patient
+from serializers import PATIENT_COLUMNS
+
+MIN_QUERY_LENGTH = 2
+MAX_SEARCH_LIMIT = 100
+
+# Must match the expression of `ix_patients_full_name_trgm` for the index to be used
+FULL_NAME = func.lower(Patient.first_name + ' ' + Patient.last_name)
+# Likewise for `ix_patients_phone_digits_trgm`: the phone number with only its digits
+PHONE_DIGITS = func.regexp_replace(Patient.phone, r'\D', '', 'g')
+
+
+def normalize_query(q):
+    return ' '.join((q or '').lower().split())
+
+
+def patient_search_query(q, facility_id=None, limit=20):
+    """
+    Build the query ranking patients against `q` by trigram similarity.
+
+    Names match typo-tolerantly (`%`) or as a partial word, e.g. while the user
+    is still typing (`<%`). A query carrying 3+ digits also matches phone
+    numbers containing them, comparing digits only on both sides (so
+    `0801 234 5678` finds `+234-801-234-5678`) and ignoring a leading trunk
+    `0`. Every predicate is served by a GIN trigram index.
+    """
+    digits = re.sub(r'\D', '', q).lstrip('0')
+
+    score = func.greatest(func.similarity(FULL_NAME, q), func.word_similarity(q, FULL_NAME))
+    conditions = [FULL_NAME.op('%')(q), literal(q).op('<%')(FULL_NAME)]
+    if len(digits) >= 3:
+        phone_match = PHONE_DIGITS.like(f'%{digits}%')
+        conditions.append(phone_match)
+        score = func.greatest(score, case((phone_match, 1.0), else_=0.0))
+
+    score = score.label('score')
+    query = db.session.query(*PATIENT_COLUMNS, score).filter(or_(*conditions))
+    if facility_id:
+        query = query.filter(Patient.facility_id == facility_id)
+
+    return query.order_by(score.desc(), Patient.id).limit(limit)
+
+
+def search_patients(q, facility_id=None, limit=20):
+    return patient_search_query(q, facility_id=facility_id, limit=limit).all()
@@ -0,0 +1,98 @@
+"""
+Fast-path serialization for list endpoints
+
+List endpoints select only the columns of the matching `*Out` schema as plain
+tuples and encode them straight to JSON bytes, skipping ORM hydration,
+`model_validate(...).model_dump()` and the `jsonify` re-encode. The output is
+the same JSON document the ORM + Pydantic + `jsonify` path produces:
+
+* keys are sorted, as Flask's default JSON provider does
+* `datetime` and `date` values are HTTP dates (`Mon, 01 Jan 1990 00:00:00 GMT`),
+  as `jsonify` renders them
+* `Decimal` values (`Numeric` lat/lon) become floats, as the `Optional[float]`
+  schema fields do
+
+Non-ASCII text is written as UTF-8 rather than `\\u` escapes.
+"""
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask import Response
+
+from metrics import record_rows
+from models import Facility, Patient, MedicalRecord, TriageVisit, RecordRequest
+from schemas import FacilityOut, PatientOut, MedicalRecordOut, TriageVisitOut, RecordRequestOut
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+def columns_for(model, schema):
+    """Model columns backing each field of `schema`, in field order"""
+    return tuple(getattr(model, name) for name in schema.model_fields)
+
+
+FACILITY_COLUMNS = columns_for(Facility, FacilityOut)
+PATIENT_COLUMNS = columns_for(Patient, PatientOut)
+MEDICAL_RECORD_COLUMNS = columns_for(MedicalRecord, MedicalRecordOut)
+TRIAGE_VISIT_COLUMNS = columns_for(TriageVisit, TriageVisitOut)
+RECORD_REQUEST_COLUMNS = columns_for(RecordRequest, RecordRequestOut)
+
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(value):
+    """
+    Same output as `werkzeug.http.http_date`, which `jsonify` uses, without
+    its trip through `email.utils`; naive values are taken as UTC.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        hour, minute, second = value.hour, value.minute, value.second
+    else:
+        hour = minute = second = 0
+    return (
+        f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} "
+        f"{value.year:04d} {hour:02d}:{minute:02d}:{second:02d} GMT"
+    )
+
+
+def _default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(payload):
+        return orjson.dumps(payload, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def dumps(payload):
+        return json.dumps(
+            payload, default=_default, sort_keys=True, separators=(',', ':'), ensure_ascii=False
+        ).encode()
+
+
+def rows_to_dicts(rows):
+    """Turn selected `Row` tuples into dicts keyed by column name"""
+    rows = list(rows)
+    if not rows:
+        return []
+    record_rows(len(rows))
+    names = rows[0]._fields
+    return [dict(zip(names, row)) for row in rows]
+
+
+def json_response(payload, status=200):
+    """Encode `payload` directly to a JSON response"""
+    return Response(dumps(payload) + b'\n', status=status, mimetype='application/json')
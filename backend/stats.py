@@ -0,0 +1,134 @@
+"""
+In-process cache for the facility statistics endpoint
+
+A snapshot of the table counts, broken down per facility, is loaded with one
+grouped query per table and then served from memory. Inserts made through the
+API swap in a bumped copy of the snapshot, so it stays current between refreshes. Rows
+the ELT writes move the tables' change counters (data_versions.py), and the
+snapshot is reloaded once they no longer match those it was loaded under.
+Rows inserted through other API workers are picked up when the snapshot
+expires after `STATS_TTL_SECONDS`, or immediately through
+`POST /api/analytics/refresh`.
+"""
+import copy
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import func
+
+from data_versions import data_versions
+from database import db
+from models import Facility, Patient, MedicalRecord, TriageVisit
+
+STATS_TTL_SECONDS = int(os.getenv('STATS_TTL_SECONDS', '60'))
+
+# Tables counted per facility, keyed by the name used in responses
+PER_FACILITY_TABLES = {
+    'patients': Patient,
+    'medical_records': MedicalRecord,
+    'triage_visits': TriageVisit,
+}
+
+
+class StatsSnapshot:
+    def __init__(self, facility_states, per_facility, versions):
+        self.facility_states = facility_states
+        self.per_facility = per_facility
+        self.totals = {'facilities': len(facility_states)}
+        for table in PER_FACILITY_TABLES:
+            self.totals[table] = sum(counts[table] for counts in per_facility.values())
+        # Change counters read before the counts, so a snapshot is never newer than them
+        self.versions = versions
+        self.as_of = datetime.utcnow()
+        self.loaded_at = time.monotonic()
+
+    def facility(self, facility_id):
+        if facility_id not in self.facility_states:
+            return None
+        counts = self.per_facility.get(facility_id, {})
+        return {
+            'facility_id': facility_id,
+            'state': self.facility_states[facility_id],
+            **{table: counts.get(table, 0) for table in PER_FACILITY_TABLES},
+        }
+
+    def by_facility(self):
+        return [self.facility(facility_id) for facility_id in sorted(self.facility_states)]
+
+    def by_state(self):
+        states = defaultdict(lambda: dict.fromkeys(['facilities', *PER_FACILITY_TABLES], 0))
+        for facility_id, state in self.facility_states.items():
+            states[state]['facilities'] += 1
+            for table, count in self.per_facility.get(facility_id, {}).items():
+                states[state][table] += count
+        return [{'state': state, **counts} for state, counts in sorted(states.items())]
+
+
+class StatsCache:
+    def __init__(self, ttl=STATS_TTL_SECONDS):
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the cached snapshot, reloading it if it is missing, expired or the ELT has written since"""
+        snapshot = self._snapshot
+        if (
+            snapshot is None
+            or time.monotonic() - snapshot.loaded_at > self.ttl
+            or snapshot.versions != data_versions.current()
+        ):
+            snapshot = self.refresh()
+        return snapshot
+
+    def refresh(self):
+        """Reload the snapshot with live counts"""
+        versions = data_versions.current()
+        facility_states = dict(db.session.query(Facility.id, Facility.state))
+        per_facility = defaultdict(lambda: dict.fromkeys(PER_FACILITY_TABLES, 0))
+        for table, model in PER_FACILITY_TABLES.items():
+            query = db.session.query(model.facility_id, func.count()).group_by(model.facility_id)
+            for facility_id, count in query:
+                per_facility[facility_id][table] = count
+
+        snapshot = StatsSnapshot(facility_states, dict(per_facility), versions)
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def record_inserts(self, table, rows):
+        """
+        Bump the cached counts for newly committed rows of `table`.
+
+        Each row is a dict with the new row's `id` and its `facility_id`
+        (or `state`, for facilities). The counts are bumped on a copy that
+        then replaces the snapshot, once per call, so requests reading the
+        current snapshot never see it partly updated.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return
+            updated = copy.copy(snapshot)
+            if table == 'facilities':
+                updated.facility_states = {
+                    **snapshot.facility_states, **{row['id']: row['state'] for row in rows}
+                }
+            else:
+                updated.per_facility = dict(snapshot.per_facility)
+                copied = set()
+                for row in rows:
+                    facility_id = row['facility_id']
+                    if facility_id not in copied:
+                        counts = snapshot.per_facility.get(facility_id) or dict.fromkeys(PER_FACILITY_TABLES, 0)
+                        updated.per_facility[facility_id] = dict(counts)
+                        copied.add(facility_id)
+                    updated.per_facility[facility_id][table] += 1
+            updated.totals = {**snapshot.totals, table: snapshot.totals[table] + len(rows)}
+            self._snapshot = updated
+
+
+stats_cache = StatsCache()
@@ -0,0 +1,92 @@
+"""
+Patient timeline: medical records and triage visits merged into one stream
+"""
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from database import db
+from models import Facility, Patient, MedicalRecord, TriageVisit
+from pagination import InvalidCursorError, decode_position, encode_position
+from serializers import PATIENT_COLUMNS, MEDICAL_RECORD_COLUMNS, TRIAGE_VISIT_COLUMNS, rows_to_dicts
+
+# Entry types in the order they are listed when two entries share a created_at
+TIMELINE_SOURCES = {
+    'medical_record': (MedicalRecord, MEDICAL_RECORD_COLUMNS),
+    'triage_visit': (TriageVisit, TRIAGE_VISIT_COLUMNS),
+}
+
+
+def decode_timeline_cursor(cursor):
+    try:
+        created_at, kind, row_id = decode_position(cursor)
+        if kind not in TIMELINE_SOURCES:
+            raise ValueError(kind)
+        return datetime.fromisoformat(created_at), kind, int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def _after(model, kind, position):
+    """Rows of `model` that come after `position` in timeline order"""
+    created_at, position_kind, row_id = position
+    if kind == position_kind:
+        return tuple_(model.created_at, model.id) < tuple_(created_at, row_id)
+    if kind > position_kind:
+        return model.created_at <= created_at
+    return model.created_at < created_at
+
+
+def _source_page(kind, patient_id, position, limit):
+    model, columns = TIMELINE_SOURCES[kind]
+    query = (
+        db.session.query(*columns, Facility.name.label('facility_name'))
+        .join(Facility, Facility.id == model.facility_id)
+        .filter(model.patient_id == patient_id, model.created_at.isnot(None))
+    )
+    if position:
+        query = query.filter(_after(model, kind, position))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit).all()
+
+    entries = rows_to_dicts(rows)
+    for entry in entries:
+        entry['type'] = kind
+    return entries
+
+
+def patient_timeline(patient_id, cursor=None, per_page=50):
+    """
+    Return (patient, entries, next_cursor) for one page of a patient's chart.
+
+    Exactly three queries are issued regardless of page size: the patient with
+    their facility name, then one keyset page (plus one row) per source over
+    its (patient_id, created_at, id) index, each joined to facilities for the
+    facility name. The two pages are merged in memory. Returns None when the
+    patient does not exist.
+    """
+    position = decode_timeline_cursor(cursor) if cursor else None
+
+    patient = (
+        db.session.query(*PATIENT_COLUMNS, Facility.name.label('facility_name'))
+        .join(Facility, Facility.id == Patient.facility_id)
+        .filter(Patient.id == patient_id)
+        .first()
+    )
+    if patient is None:
+        return None
+
+    entries = []
+    for kind in TIMELINE_SOURCES:
+        entries.extend(_source_page(kind, patient_id, position, per_page + 1))
+    # (created_at DESC, type ASC, id DESC) via stable sorts, least significant key first
+    entries.sort(key=lambda entry: entry['id'], reverse=True)
+    entries.sort(key=lambda entry: entry['type'])
+    entries.sort(key=lambda entry: entry['created_at'], reverse=True)
+
+    next_cursor = None
+    if len(entries) > per_page:
+        entries = entries[:per_page]
+        last = entries[-1]
+        next_cursor = encode_position([last['created_at'].isoformat(), last['type'], last['id']])
+
+    return rows_to_dicts([patient])[0], entries, next_cursor
@@ -0,0 +1,172 @@
+"""
+Record transfers: packaging a patient's chart for the requesting facility
+
+A record request moves pending -> approved (or rejected) through the API, and
+approved requests are packaged outside the API by `flask transfer-worker`.
+Each worker claims a batch with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of worker processes can run side by side without picking up the same
+request twice, then streams the patient's medical records and triage visits
+into a gzip-compressed NDJSON package.
+"""
+import gzip
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, literal, or_, select
+
+from database import db
+from export import EXPORT_BATCH_SIZE, stream_ndjson
+from models import Facility, Patient, MedicalRecord, TriageVisit, RecordRequest
+from serializers import PATIENT_COLUMNS, MEDICAL_RECORD_COLUMNS, TRIAGE_VISIT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_PACKAGE_DIR = os.getenv('TRANSFER_PACKAGE_DIR', '/tmp/record_packages')
+TRANSFER_BATCH_SIZE = int(os.getenv('TRANSFER_BATCH_SIZE', '20'))
+TRANSFER_POLL_SECONDS = float(os.getenv('TRANSFER_POLL_SECONDS', '5'))
+# A request left in `processing` this long (e.g. its worker died) is claimed again
+TRANSFER_CLAIM_TIMEOUT_SECONDS = int(os.getenv('TRANSFER_CLAIM_TIMEOUT_SECONDS', '900'))
+
+PENDING, APPROVED, REJECTED = 'pending', 'approved', 'rejected'
+PROCESSING, COMPLETED, FAILED = 'processing', 'completed', 'failed'
+
+# What goes into a package, in order; each line is tagged with its `type`
+PACKAGE_SECTIONS = (
+    ('patient', Patient, PATIENT_COLUMNS, 'id'),
+    ('medical_record', MedicalRecord, MEDICAL_RECORD_COLUMNS, 'patient_id'),
+    ('triage_visit', TriageVisit, TRIAGE_VISIT_COLUMNS, 'patient_id'),
+)
+
+
+class TransferError(ValueError):
+    """Raised when a record request cannot be created or moved to the asked status"""
+
+
+def create_request(data):
+    """Insert a pending request from a `RecordRequestCreate`"""
+    for facility_id in (data.requester_facility_id, data.target_facility_id):
+        if db.session.get(Facility, facility_id) is None:
+            raise TransferError(f"Facility {facility_id} not found")
+    if db.session.get(Patient, data.patient_id) is None:
+        raise TransferError(f"Patient {data.patient_id} not found")
+
+    record_request = RecordRequest(
+        requester_facility_id=data.requester_facility_id,
+        target_facility_id=data.target_facility_id,
+        patient_id=data.patient_id,
+        reason=data.reason,
+        status=PENDING,
+    )
+    db.session.add(record_request)
+    db.session.commit()
+    return record_request
+
+
+def decide_request(request_id, approve):
+    """Approve or reject a pending request; returns None when it does not exist"""
+    record_request = db.session.execute(
+        select(RecordRequest).where(RecordRequest.id == request_id).with_for_update()
+    ).scalar_one_or_none()
+    if record_request is None:
+        return None
+    if record_request.status != PENDING:
+        db.session.rollback()
+        raise TransferError(f"Record request {request_id} is already {record_request.status}")
+
+    record_request.status = APPROVED if approve else REJECTED
+    record_request.acted_at = datetime.utcnow()
+    db.session.commit()
+    return record_request
+
+
+def claim_batch(size=TRANSFER_BATCH_SIZE):
+    """
+    Mark up to `size` approved requests as processing and return their
+    (id, patient_id) pairs. Rows another worker has locked are skipped rather
+    than waited on, and the claim is committed before any packaging starts.
+    """
+    now = datetime.utcnow()
+    claimable = or_(
+        RecordRequest.status == APPROVED,
+        and_(
+            RecordRequest.status == PROCESSING,
+            RecordRequest.claimed_at < now - timedelta(seconds=TRANSFER_CLAIM_TIMEOUT_SECONDS),
+        ),
+    )
+    claimed = db.session.execute(
+        select(RecordRequest)
+        .where(claimable)
+        .order_by(RecordRequest.id)
+        .limit(size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    for record_request in claimed:
+        record_request.status = PROCESSING
+        record_request.claimed_at = now
+        record_request.error = None
+    batch = [(record_request.id, record_request.patient_id) for record_request in claimed]
+    db.session.commit()
+    return batch
+
+
+def package_path(request_id):
+    return os.path.join(TRANSFER_PACKAGE_DIR, f'record-request-{request_id}.ndjson.gz')
+
+
+def write_package(request_id, patient_id):
+    """Stream the patient's chart into a gzip NDJSON file and return its path"""
+    os.makedirs(TRANSFER_PACKAGE_DIR, exist_ok=True)
+    path = package_path(request_id)
+    partial = f'{path}.partial'
+
+    with gzip.open(partial, 'wt', encoding='utf-8', compresslevel=6) as out:
+        for kind, model, columns, patient_column in PACKAGE_SECTIONS:
+            query = (
+                db.session.query(literal(kind).label('type'), *columns)
+                .filter(getattr(model, patient_column) == patient_id)
+                .order_by(model.id)
+            )
+            names = ['type'] + [column.key for column in columns]
+            for chunk in stream_ndjson(query.yield_per(EXPORT_BATCH_SIZE), names):
+                out.write(chunk)
+
+    os.replace(partial, path)
+    return path
+
+
+def process_batch(size=TRANSFER_BATCH_SIZE):
+    """Claim and package one batch; returns the number of requests handled"""
+    batch = claim_batch(size)
+    for request_id, patient_id in batch:
+        try:
+            path = write_package(request_id, patient_id)
+            status, error, uri = COMPLETED, None, f'file://{path}'
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error packaging record request {request_id}: {str(e)}")
+            status, error, uri = FAILED, str(e), None
+
+        record_request = db.session.get(RecordRequest, request_id)
+        record_request.status = status
+        record_request.error = error
+        record_request.package_uri = uri
+        record_request.completed_at = datetime.utcnow()
+        db.session.commit()
+    return len(batch)
+
+
+def run_worker(batch_size=TRANSFER_BATCH_SIZE, poll_seconds=TRANSFER_POLL_SECONDS, once=False):
+    """Process batches until none are left (`once`) or forever, sleeping while idle"""
+    logger.info(f"Transfer worker started (batch size {batch_size}, packages in {TRANSFER_PACKAGE_DIR})")
+    while True:
+        started = time.perf_counter()
+        handled = process_batch(batch_size)
+        if handled:
+            logger.info(f"Packaged {handled} record requests in {time.perf_counter() - started:.1f}s")
+            continue
+        if once:
+            return
+        time.sleep(poll_seconds)
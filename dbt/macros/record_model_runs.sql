@@ -0,0 +1,30 @@
+{#
+    on-run-end hook: remember which invocation last built each model.
+    The API keys its cache of mart pages on this (backend/marts.py), so
+    cached pages are dropped exactly when dbt rebuilds the mart.
+#}
+{% macro record_model_runs(results) %}
+    {%- set built = [] -%}
+    {%- for result in results -%}
+        {%- if result.node.resource_type == 'model' and result.status == 'success' -%}
+            {%- do built.append(result.node.name) -%}
+        {%- endif -%}
+    {%- endfor -%}
+
+    create schema if not exists marts;
+    create table if not exists marts.dbt_model_runs (
+        model text primary key,
+        invocation_id text not null,
+        built_at timestamp not null default current_timestamp
+    );
+    {%- if built %}
+    insert into marts.dbt_model_runs (model, invocation_id, built_at)
+    values
+    {%- for model in built %}
+        ('{{ model }}', '{{ invocation_id }}', current_timestamp){{ ',' if not loop.last }}
+    {%- endfor %}
+    on conflict (model) do update
+        set invocation_id = excluded.invocation_id,
+            built_at = excluded.built_at;
+    {%- endif %}
+{% endmacro %}
@@ -1,18 +1,9 @@
 -- Condition and diagnosis analysis for analysts
--- Analysis of common conditions and diagnoses
+-- Analysis of common conditions and diagnoses, from the agg_triage_conditions_daily rollup
 
 with triage_conditions as (
-    select
-        unnest(likely_conditions) as condition,
-        facility_state,
-        patient_age_group,
-        patient_sex,
-        triage_level,
-        priority_category,
-        date_trunc('month', visit_date) as month
-    from {{ ref('fct_triage_visits') }}
-    where likely_conditions is not null
-        and visit_date >= current_date - interval '12 months'
+    select * from {{ ref('agg_triage_conditions_daily') }}
+    where visit_day >= current_date - interval '12 months'
 ),
 
 condition_summary as (
@@ -21,13 +12,12 @@ condition_summary as (
         facility_state,
         patient_age_group,
         patient_sex,
-        month,
-        count(*) as occurrence_count,
-        avg(triage_level) as avg_triage_level,
-        count(*) filter (where priority_category = 'Critical') as critical_count
+        date_trunc('month', visit_day::timestamp) as month,
+        sum(occurrence_count) as occurrence_count,
+        sum(triage_level * occurrence_count)::numeric / sum(occurrence_count) as avg_triage_level,
+        coalesce(sum(occurrence_count) filter (where priority_category = 'Critical'), 0) as critical_count
     from triage_conditions
-    where condition is not null and trim(condition) != ''
-    group by condition, facility_state, patient_age_group, patient_sex, month
+    group by condition, facility_state, patient_age_group, patient_sex, date_trunc('month', visit_day::timestamp)
 ),
 
 condition_totals as (
@@ -1,9 +1,9 @@
 -- Triage trends analysis for data analysts
--- Time-series analysis of triage patterns
+-- Time-series analysis of triage patterns, from the agg_triage_daily rollup
 
 with daily_triage as (
     select
-        date(visit_date) as visit_date,
+        visit_day as visit_date,
         facility_id,
         facility_state,
         facility_category,
@@ -11,12 +11,9 @@ with daily_triage as (
         priority_category,
         patient_age_group,
         patient_sex,
-        count(*) as visit_count
-    from {{ ref('fct_triage_visits') }}
-    where visit_date >= current_date - interval '90 days'
-    group by 
-        date(visit_date), facility_id, facility_state, facility_category,
-        triage_level, priority_category, patient_age_group, patient_sex
+        visit_count
+    from {{ ref('agg_triage_daily') }}
+    where visit_day >= current_date - interval '90 days'
 ),
 
 state_daily_totals as (
@@ -1,5 +1,5 @@
 -- Facility performance metrics for analysts
--- KPIs and operational metrics by facility
+-- KPIs and operational metrics by facility, from the triage rollups
 
 with facilities as (
     select * from {{ ref('dim_facilities') }}
@@ -8,15 +8,24 @@ with facilities as (
 monthly_visits as (
     select
         facility_id,
-        date_trunc('month', visit_date) as month,
-        count(*) as triage_visits,
-        count(distinct patient_id) as unique_patients,
-        avg(triage_level) as avg_triage_level,
-        count(*) filter (where triage_level <= 2) as critical_visits,
-        count(*) filter (where triage_level >= 4) as low_priority_visits
-    from {{ ref('fct_triage_visits') }}
-    where visit_date >= current_date - interval '12 months'
-    group by facility_id, date_trunc('month', visit_date)
+        date_trunc('month', visit_day::timestamp) as month,
+        sum(visit_count) as triage_visits,
+        sum(triage_level * visit_count)::numeric / sum(visit_count) as avg_triage_level,
+        coalesce(sum(visit_count) filter (where triage_level <= 2), 0) as critical_visits,
+        coalesce(sum(visit_count) filter (where triage_level >= 4), 0) as low_priority_visits
+    from {{ ref('agg_triage_daily') }}
+    where visit_day >= current_date - interval '12 months'
+    group by facility_id, date_trunc('month', visit_day::timestamp)
+),
+
+monthly_patients as (
+    select
+        facility_id,
+        visit_month as month,
+        count(*) as unique_patients
+    from {{ ref('agg_triage_patients_monthly') }}
+    where last_visit_date >= current_date - interval '12 months'
+    group by facility_id, visit_month
 ),
 
 monthly_records as (
@@ -33,11 +42,11 @@ monthly_records as (
 recent_activity as (
     select
         facility_id,
-        count(*) as visits_last_30_days,
-        avg(triage_level) as avg_triage_level_30d,
-        count(*) filter (where triage_level <= 2) as critical_visits_30d
-    from {{ ref('fct_triage_visits') }}
-    where visit_date >= current_date - interval '30 days'
+        sum(visit_count) as visits_last_30_days,
+        sum(triage_level * visit_count)::numeric / sum(visit_count) as avg_triage_level_30d,
+        coalesce(sum(visit_count) filter (where triage_level <= 2), 0) as critical_visits_30d
+    from {{ ref('agg_triage_daily') }}
+    where visit_day >= current_date - interval '30 days'
     group by facility_id
 ),
 
@@ -59,7 +68,7 @@ final as (
         
         -- Calculate averages from monthly data (12 months)
         round(avg(mv.triage_visits), 0) as avg_monthly_visits,
-        round(avg(mv.unique_patients), 0) as avg_monthly_unique_patients,
+        round(avg(mp.unique_patients), 0) as avg_monthly_unique_patients,
         round(avg(mv.avg_triage_level), 2) as avg_monthly_triage_level,
         round(avg(mr.medical_records), 0) as avg_monthly_records,
         
@@ -84,6 +93,7 @@ final as (
         
     from facilities f
     left join monthly_visits mv on f.facility_id = mv.facility_id
+    left join monthly_patients mp on f.facility_id = mp.facility_id and mv.month = mp.month
     left join monthly_records mr on f.facility_id = mr.facility_id and mv.month = mr.month
     left join recent_activity ra on f.facility_id = ra.facility_id
     group by 
@@ -16,14 +16,27 @@ recent_records as (
     group by patient_id
 ),
 
+recent_triage_visits as (
+    select * from {{ ref('fct_triage_visits') }}
+    where visit_date >= current_date - interval '12 months'
+),
+
+recent_conditions as (
+    select
+        tv.patient_id,
+        array_agg(distinct c.condition order by c.condition) as conditions
+    from recent_triage_visits tv
+    cross join lateral unnest(tv.likely_conditions) as c(condition)
+    where c.condition is not null and trim(c.condition) != ''
+    group by tv.patient_id
+),
+
 recent_triage as (
     select
         patient_id,
-        array_agg(distinct unnest(likely_conditions) order by unnest(likely_conditions)) as conditions,
         max(triage_level) as most_severe_triage,
         max(visit_date) as last_triage_date
-    from {{ ref('fct_triage_visits') }}
-    where visit_date >= current_date - interval '12 months'
+    from recent_triage_visits
     group by patient_id
 ),
 
@@ -43,7 +56,7 @@ final as (
         p.total_triage_visits,
         rr.record_types as recent_record_types,
         rr.diagnoses as recent_diagnoses,
-        rt.conditions as recent_conditions,
+        rc.conditions as recent_conditions,
         
         -- Risk assessment
         p.has_critical_triage_history,
@@ -70,6 +83,7 @@ final as (
     from patients p
     left join recent_records rr on p.patient_id = rr.patient_id
     left join recent_triage rt on p.patient_id = rt.patient_id
+    left join recent_conditions rc on p.patient_id = rc.patient_id
 )
 
 select * from final
\ No newline at end of file
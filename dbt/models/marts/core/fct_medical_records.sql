@@ -1,8 +1,27 @@
 -- Fact table for medical records
 -- Contains all medical record transactions
+-- Incremental: each run merges the rows written (`updated_at`, the time of the
+-- last write, not of the event) since `fact_lookback_hours` before the newest
+-- write already built, so backfilled and updated rows are picked up however
+-- old they are; run with --full-refresh to rebuild from scratch
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='record_id',
+        incremental_strategy=var('fact_incremental_strategy', 'merge'),
+        on_schema_change='append_new_columns'
+    )
+}}
 
 with medical_records as (
     select * from {{ ref('stg_medical_records') }}
+    {% if is_incremental() %}
+    where updated_at >= (
+        select coalesce(max(updated_at), '-infinity') - interval '{{ var("fact_lookback_hours", 1) }} hours'
+        from {{ this }}
+    )
+    {% endif %}
 ),
 
 patients as (
@@ -1,8 +1,31 @@
 -- Fact table for triage visits
 -- Contains all triage visit transactions
+-- Incremental: each run merges the rows written (`updated_at`, the time of the
+-- last write, not of the event) since `fact_lookback_hours` before the newest
+-- write already built, so backfilled and updated rows are picked up however
+-- old they are; run with --full-refresh to rebuild from scratch
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='triage_id',
+        incremental_strategy=var('fact_incremental_strategy', 'merge'),
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['visit_date']},
+            {'columns': ['dbt_updated_at']}
+        ]
+    )
+}}
 
 with triage_visits as (
     select * from {{ ref('stg_triage_visits') }}
+    {% if is_incremental() %}
+    where updated_at >= (
+        select coalesce(max(updated_at), '-infinity') - interval '{{ var("fact_lookback_hours", 1) }} hours'
+        from {{ this }}
+    )
+    {% endif %}
 ),
 
 patients as (
@@ -44,6 +67,7 @@ final as (
         tv.language_code,
         tv.provider_name,
         tv.visit_date,
+        tv.updated_at,
         
         -- Date dimensions
         date(tv.visit_date) as visit_date_only,
@@ -0,0 +1,78 @@
+-- Daily likely-condition counts from triage visits, one row per condition
+-- by facility, triage level, age group and sex
+-- Unnests likely_conditions once, as rows arrive, instead of in every mart
+-- Incremental: rebuilt a whole day at a time, like agg_triage_daily. A changed
+-- day may no longer list any condition, so the pre-hook clears changed days
+-- first rather than relying on delete+insert to replace them
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='visit_day',
+        incremental_strategy='delete+insert',
+        on_schema_change='append_new_columns',
+        pre_hook="""
+            {% if is_incremental() %}
+            delete from {{ this }}
+            where visit_day in (
+                select visit_date_only from {{ ref('fct_triage_visits') }}
+                where dbt_updated_at > (select max(dbt_updated_at) from {{ this }})
+            )
+            {% endif %}
+        """
+    )
+}}
+
+with
+
+{% if is_incremental() %}
+changed_days as (
+    select distinct visit_date_only as visit_day
+    from {{ ref('fct_triage_visits') }}
+    where dbt_updated_at > (select coalesce(max(dbt_updated_at), '-infinity') from {{ this }})
+),
+{% endif %}
+
+triage_visits as (
+    select tv.* from {{ ref('fct_triage_visits') }} tv
+    {% if is_incremental() %}
+    join changed_days d on tv.visit_date >= d.visit_day and tv.visit_date < d.visit_day + 1
+    {% endif %}
+    where tv.visit_date is not null
+        and tv.likely_conditions is not null
+),
+
+triage_conditions as (
+    select
+        date(tv.visit_date) as visit_day,
+        tv.facility_id,
+        tv.facility_state,
+        tv.triage_level,
+        tv.priority_category,
+        tv.patient_age_group,
+        tv.patient_sex,
+        c.condition
+    from triage_visits tv
+    cross join lateral unnest(tv.likely_conditions) as c(condition)
+    where c.condition is not null and trim(c.condition) != ''
+),
+
+final as (
+    select
+        visit_day,
+        condition,
+        facility_id,
+        facility_state,
+        triage_level,
+        priority_category,
+        patient_age_group,
+        patient_sex,
+        count(*) as occurrence_count,
+        current_timestamp as dbt_updated_at
+    from triage_conditions
+    group by
+        visit_day, condition, facility_id, facility_state,
+        triage_level, priority_category, patient_age_group, patient_sex
+)
+
+select * from final
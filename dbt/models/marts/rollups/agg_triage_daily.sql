@@ -0,0 +1,51 @@
+-- Daily triage visit counts by facility, triage level, age group and sex
+-- Shared rollup the analytics marts aggregate from instead of rescanning fct_triage_visits
+-- Incremental: each run rebuilds, whole, the days of the fact rows merged
+-- since the last rollup (by their `dbt_updated_at`), however old the days are
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='visit_day',
+        incremental_strategy='delete+insert',
+        on_schema_change='append_new_columns'
+    )
+}}
+
+with
+
+{% if is_incremental() %}
+changed_days as (
+    select distinct visit_date_only as visit_day
+    from {{ ref('fct_triage_visits') }}
+    where dbt_updated_at > (select coalesce(max(dbt_updated_at), '-infinity') from {{ this }})
+),
+{% endif %}
+
+triage_visits as (
+    select tv.* from {{ ref('fct_triage_visits') }} tv
+    {% if is_incremental() %}
+    join changed_days d on tv.visit_date >= d.visit_day and tv.visit_date < d.visit_day + 1
+    {% endif %}
+    where tv.visit_date is not null
+),
+
+final as (
+    select
+        date(visit_date) as visit_day,
+        facility_id,
+        facility_state,
+        facility_category,
+        triage_level,
+        priority_category,
+        patient_age_group,
+        patient_sex,
+        count(*) as visit_count,
+        current_timestamp as dbt_updated_at
+    from triage_visits
+    group by
+        date(visit_date), facility_id, facility_state, facility_category,
+        triage_level, priority_category, patient_age_group, patient_sex
+)
+
+select * from final
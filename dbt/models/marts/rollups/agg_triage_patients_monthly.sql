@@ -0,0 +1,46 @@
+-- Patients seen per facility and month, one row per patient
+-- Distinct patient counts do not add up across days, so facility_performance
+-- counts them from here rather than from agg_triage_daily
+-- Incremental: rebuilds, whole, the months of the fact rows merged since the
+-- last rollup (by their `dbt_updated_at`)
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='visit_month',
+        incremental_strategy='delete+insert',
+        on_schema_change='append_new_columns'
+    )
+}}
+
+with
+
+{% if is_incremental() %}
+changed_months as (
+    select distinct date_trunc('month', visit_date) as visit_month
+    from {{ ref('fct_triage_visits') }}
+    where dbt_updated_at > (select coalesce(max(dbt_updated_at), '-infinity') from {{ this }})
+),
+{% endif %}
+
+triage_visits as (
+    select tv.* from {{ ref('fct_triage_visits') }} tv
+    {% if is_incremental() %}
+    join changed_months m on tv.visit_date >= m.visit_month and tv.visit_date < m.visit_month + interval '1 month'
+    {% endif %}
+    where tv.visit_date is not null
+),
+
+final as (
+    select
+        date_trunc('month', visit_date) as visit_month,
+        facility_id,
+        patient_id,
+        count(*) as visit_count,
+        max(visit_date) as last_visit_date,
+        current_timestamp as dbt_updated_at
+    from triage_visits
+    group by date_trunc('month', visit_date), facility_id, patient_id
+)
+
+select * from final
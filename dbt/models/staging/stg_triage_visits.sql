@@ -16,6 +16,7 @@ cleaned as (
         trim(language) as language_code,
         trim(provider) as provider_name,
         created_at as visit_date,
+        updated_at,
         
         -- Triage level descriptions
         case triage_level
@@ -0,0 +1,253 @@
+"""
+Typed Parquet intermediates between the extract and load stages
+
+Each extracted CSV is parsed once, in streaming batches, into a
+zstd-compressed Parquet file next to it. Columns are typed per entity, and
+repetitive ones (state, LGA, facility type, facility name, ...) are
+dictionary-encoded. Timestamps are ISO-8601, with optional fractional
+seconds and a `Z` or UTC offset, and are stored in UTC. A value that does
+not parse as its type becomes null rather than failing the file, and the
+original text is kept in a `<column>_unparsed` column so validation can
+quarantine the row. Later stages read the Parquet file memory-mapped, and
+only the columns they need.
+"""
+import csv
+import io
+import os
+from functools import lru_cache
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+# Bytes of CSV parsed per batch while converting
+CSV_BLOCK_BYTES = int(os.getenv('CSV_BLOCK_BYTES', str(16 * 1024 * 1024)))
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd')
+# Parquet metadata key holding the ETag of the S3 object a file was converted from
+SOURCE_ETAG_KEY = b'medilink.source_etag'
+
+STRING = pa.string()
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp('us')
+
+# Column types of each entity's intermediate; other CSV columns are dropped
+SCHEMAS = {
+    'facilities': {
+        'name': STRING, 'state': CATEGORY, 'lga': CATEGORY,
+        'lat': pa.float64(), 'lon': pa.float64(), 'type': CATEGORY,
+    },
+    'patients': {
+        'facility_name': CATEGORY, 'first_name': STRING, 'last_name': STRING,
+        'sex': CATEGORY, 'dob': pa.date32(), 'phone': STRING,
+    },
+    'medical_records': {
+        'facility_name': CATEGORY, 'patient_first_name': STRING, 'patient_last_name': STRING,
+        'record_type': CATEGORY, 'diagnosis': CATEGORY, 'treatment': STRING, 'medications': STRING,
+        'notes': STRING, 'created_at': TIMESTAMP,
+    },
+    'triage_visits': {
+        'facility_name': CATEGORY, 'patient_first_name': STRING, 'patient_last_name': STRING,
+        'triage_level': pa.int32(), 'chief_complaint': STRING, 'vital_signs': STRING,
+        'conditions': STRING, 'recommendations': STRING, 'language': CATEGORY, 'provider': CATEGORY,
+        'created_at': TIMESTAMP,
+    },
+}
+
+INTEGER_PATTERN = r'^[+-]?\d+$'
+FLOAT_PATTERN = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+# Date, then optionally a time with fractional seconds and a Z or +HH:MM / +HHMM / +HH offset
+TIMESTAMP_PATTERN = (
+    r'^(?P<date>\d{4}-\d{2}-\d{2})'
+    r'(?:[T ](?P<time>\d{2}:\d{2}(?::\d{2})?)(?:[.,](?P<fraction>\d+))?'
+    r'\s*(?P<offset>[Zz]|[+-]\d{2}(?::?\d{2})?)?)?$'
+)
+UNPARSED_SUFFIX = '_unparsed'
+
+
+def entity_for(filename):
+    """The entity a source file holds, going by its name, or None"""
+    name = filename.lower()
+    if 'facilities' in name:
+        return 'facilities'
+    if 'patients' in name:
+        return 'patients'
+    if 'triage' in name:
+        return 'triage_visits'
+    if 'records' in name:
+        return 'medical_records'
+    return None
+
+
+def parquet_path(csv_path):
+    return f'{os.path.splitext(csv_path)[0]}.parquet'
+
+
+def _header(csv_path):
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        return tuple(next(csv.reader(f), []))
+
+
+@lru_cache(maxsize=64)
+def resolve_schema(entity, header):
+    """
+    Normalized column names for a CSV `header`, and the Arrow schema of the
+    known columns it contains. Cached, since every file of an entity
+    usually has the same header.
+    """
+    names = tuple(column.strip().lower() for column in header)
+    types = SCHEMAS[entity]
+    fields = [(name, types[name]) for name in types if name in names]
+    fields += [(unparsed_column(name), STRING) for name, type_ in fields if is_parsed(type_)]
+    return names, pa.schema(fields)
+
+
+def is_parsed(type_):
+    """Whether values of `type_` are parsed from text, and so can fail to parse"""
+    return type_ not in (STRING, CATEGORY)
+
+
+def unparsed_column(column):
+    """Column holding the text of the values of `column` that did not parse"""
+    return f'{column}{UNPARSED_SUFFIX}'
+
+
+def _blank_to_null(strings):
+    strings = pc.utf8_trim_whitespace(strings)
+    return pc.if_else(pc.equal(strings, ''), pa.scalar(None, STRING), strings)
+
+
+def _strptime(strings, fmt):
+    # strptime rolls impossible dates over (1990-02-30 -> 1990-03-02), so they must round-trip
+    parsed = pc.strptime(strings, format=fmt, unit='s', error_is_null=True)
+    exact = pc.fill_null(pc.equal(pc.strftime(parsed, format=fmt), strings), False)
+    return pc.if_else(exact, parsed, pa.scalar(None, parsed.type))
+
+
+def _digits(strings, start, stop, default='0'):
+    """Integer value of the characters [start, stop) of `strings`, `default` where empty"""
+    digits = pc.utf8_slice_codeunits(strings, start, stop)
+    return pc.cast(pc.if_else(pc.equal(digits, ''), default, digits), pa.int64())
+
+
+def _microseconds(values):
+    return pc.cast(values, pa.duration('us'))
+
+
+def _parse_timestamp(strings):
+    """ISO-8601 timestamps, normalized to UTC; null where a value is not one"""
+    parts = pc.extract_regex(strings, TIMESTAMP_PATTERN)
+    time = pc.struct_field(parts, 'time')
+    time = pc.if_else(pc.equal(time, ''), '00:00:00', time)
+    time = pc.if_else(pc.equal(pc.utf8_length(time), 5), pc.binary_join_element_wise(time, ':00', ''), time)
+    seconds = _strptime(pc.binary_join_element_wise(pc.struct_field(parts, 'date'), time, ' '), '%Y-%m-%d %H:%M:%S')
+
+    # Fractions beyond microseconds are truncated
+    fraction = pc.utf8_rpad(pc.struct_field(parts, 'fraction'), width=6, padding='0')
+    fraction = _microseconds(_digits(fraction, 0, 6))
+
+    offset = pc.replace_substring(pc.utf8_upper(pc.struct_field(parts, 'offset')), ':', '')
+    offset = pc.if_else(pc.equal(offset, 'Z'), '', offset)
+    offset_seconds = pc.add(pc.multiply(_digits(offset, 1, 3), 3600), pc.multiply(_digits(offset, 3, 5), 60))
+    sign = pc.if_else(pc.equal(pc.utf8_slice_codeunits(offset, 0, 1), '-'), -1, 1)
+    offset = _microseconds(pc.multiply(pc.multiply(offset_seconds, sign), 1_000_000))
+
+    return pc.subtract(pc.add(pc.cast(seconds, TIMESTAMP), fraction), offset)
+
+
+def coerce(strings, type_):
+    """Vectorized conversion of a string column; unparseable values become null"""
+    strings = _blank_to_null(strings)
+    if type_ == STRING:
+        return strings
+    if type_ == CATEGORY:
+        return pc.dictionary_encode(strings)
+    if type_ == TIMESTAMP:
+        return _parse_timestamp(strings)
+    if type_ == pa.date32():
+        return pc.cast(_strptime(strings, '%Y-%m-%d'), type_)
+    pattern = INTEGER_PATTERN if pa.types.is_integer(type_) else FLOAT_PATTERN
+    valid = pc.fill_null(pc.match_substring_regex(strings, pattern), False)
+    return pc.cast(pc.if_else(valid, strings, pa.scalar(None, STRING)), type_)
+
+
+def _unparsed(strings, values):
+    """The non-blank `strings` whose parsed `values` are null, null elsewhere"""
+    strings = _blank_to_null(strings)
+    failed = pc.and_(pc.is_valid(strings), pc.is_null(values))
+    return pc.if_else(failed, strings, pa.scalar(None, STRING))
+
+
+def _csv_batches(csv_path, entity):
+    """Typed record batches of a CSV file, parsed CSV_BLOCK_BYTES at a time"""
+    names, schema = resolve_schema(entity, _header(csv_path))
+    columns = [name for name in schema.names if name in SCHEMAS[entity]]
+    reader = pa_csv.open_csv(
+        csv_path,
+        read_options=pa_csv.ReadOptions(column_names=list(names), skip_rows=1, block_size=CSV_BLOCK_BYTES),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={name: STRING for name in columns},
+            strings_can_be_null=False,
+        ),
+    )
+    for batch in reader:
+        arrays = {name: coerce(batch.column(name), schema.field(name).type) for name in columns}
+        for name in columns:
+            if is_parsed(schema.field(name).type):
+                arrays[unparsed_column(name)] = _unparsed(batch.column(name), arrays[name])
+        yield pa.RecordBatch.from_arrays([arrays[name] for name in schema.names], schema=schema)
+
+
+def csv_to_parquet(csv_path, entity, source_etag=None):
+    """Convert a CSV file to its typed Parquet intermediate; returns the Parquet path"""
+    path = parquet_path(csv_path)
+    _, schema = resolve_schema(entity, _header(csv_path))
+    if source_etag:
+        schema = schema.with_metadata({SOURCE_ETAG_KEY: source_etag.encode()})
+    partial = f'{path}.partial'
+    with pq.ParquetWriter(partial, schema, compression=PARQUET_COMPRESSION) as writer:
+        for batch in _csv_batches(csv_path, entity):
+            writer.write_batch(batch)
+    os.replace(partial, path)
+    return path
+
+
+def source_etag(path):
+    """ETag recorded in a Parquet intermediate, or None when there is none"""
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path, memory_map=True).metadata or {}
+    value = metadata.get(SOURCE_ETAG_KEY)
+    return value.decode() if value else None
+
+
+def read_batches(path, entity, columns, batch_size, row_groups=None):
+    """
+    Record batches of `columns` (those the file has) from a Parquet
+    intermediate, memory-mapped and optionally only `row_groups` of it, or
+    straight from a CSV file.
+    """
+    if path.endswith('.parquet'):
+        parquet = pq.ParquetFile(path, memory_map=True)
+        present = [column for column in columns if column in parquet.schema_arrow.names]
+        yield from parquet.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=present)
+        return
+    wanted = set(columns)
+    for batch in _csv_batches(path, entity):
+        yield batch.select([name for name in batch.schema.names if name in wanted])
+
+
+def to_csv_buffer(batch, columns):
+    """`batch` as headerless CSV in `columns` order (absent columns empty), ready for COPY"""
+    arrays = [
+        batch.column(column) if column in batch.schema.names else pa.nulls(batch.num_rows, STRING)
+        for column in columns
+    ]
+    buffer = io.BytesIO()
+    pa_csv.write_csv(
+        pa.Table.from_arrays(arrays, names=list(columns)), buffer, pa_csv.WriteOptions(include_header=False)
+    )
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,84 @@
+"""
+Postgres connections for the ELT stages
+"""
+import io
+import os
+from datetime import datetime
+
+import psycopg2
+
+INIT_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init.sql')
+# Created by the backend migrations; the ELT only writes to them
+APPLICATION_TABLES = ('facilities', 'patients', 'medical_records', 'triage_visits', 'data_versions')
+# Serialises concurrent schema setup from parallel load tasks
+SCHEMA_LOCK_ID = 4_172_020_001
+
+
+def connect():
+    return psycopg2.connect(
+        host=(os.getenv('POSTGRES_HOST') or 'localhost').replace('http://', '').replace('https://', '').strip('/'),
+        port=os.getenv('POSTGRES_PORT') or '5432',
+        user=os.getenv('POSTGRES_USER') or 'postgres',
+        password=os.getenv('POSTGRES_PASSWORD') or 'secret',
+        dbname=os.getenv('POSTGRES_DB') or 'postgres',
+        application_name='medilink-elt',
+    )
+
+
+def ensure_schema(connection):
+    """
+    Run init.sql (idempotent) so the ELT tables exist. The application tables
+    come from the backend migrations, which must have run first.
+    """
+    with open(INIT_SQL) as f:
+        statements = f.read()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM unnest(%s::TEXT[]) AS name WHERE to_regclass(name) IS NULL",
+            (list(APPLICATION_TABLES),),
+        )
+        missing = [name for name, in cursor.fetchall()]
+        if missing:
+            raise RuntimeError(
+                f"Application tables {', '.join(missing)} do not exist; run `flask db upgrade` before the loaders"
+            )
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', (SCHEMA_LOCK_ID,))
+        cursor.execute(statements)
+    connection.commit()
+
+
+def copy_frame(cursor, table, frame):
+    """COPY the rows of a DataFrame into the same-named columns of `table`"""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(frame.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def table_write_counts(connection, tables):
+    """
+    Rows inserted, updated and deleted in each of `tables` (in the public
+    schema) since statistics were last reset, from Postgres' cumulative
+    statistics. Cheap to read; any write, including the API's, changes them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname, n_tup_ins, n_tup_upd, n_tup_del FROM pg_stat_user_tables "
+            "WHERE schemaname = 'public' AND relname = ANY(%s)",
+            (list(tables),),
+        )
+        return {table: [inserted, updated, deleted] for table, inserted, updated, deleted in cursor.fetchall()}
+
+
+def audit(connection, batch_id, table_name, source_file, status, started_at,
+          processed=0, inserted=0, failed=0, error=None, updated=0, unchanged=0):
+    """Commit one row to etl_audit_log"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO etl_audit_log (batch_id, table_name, source_file, status, records_processed, "
+            "records_inserted, records_updated, records_unchanged, records_failed, started_at, finished_at, "
+            "error_message) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            (batch_id, table_name, source_file, status, processed, inserted, updated, unchanged, failed,
+             started_at, datetime.utcnow(), error),
+        )
+    connection.commit()
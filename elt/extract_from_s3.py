@@ -0,0 +1,258 @@
+"""
+Extract the Medilink CSV drops from S3
+
+Objects under S3_INPUT_PREFIX are listed page by page and downloaded by a
+thread pool; boto3's managed transfer splits large objects into concurrent
+ranged GETs. A manifest of every object that made it through the pipeline
+(ETag, size and last-modified) is kept in the bucket, so an object that was
+already processed is skipped on later runs even if archiving it failed.
+Each CSV of a known entity is then converted once into a typed Parquet
+intermediate (columnar.py), which the later stages read instead, and the CSV
+is removed. Archiving is a concurrent server-side copy into S3_ARCHIVE_PREFIX
+followed by a delete of the original.
+
+Set S3_ENDPOINT_URL to run against MinIO or moto's server instead of AWS:
+    python elt/extract_from_s3.py --endpoint-url http://localhost:9000 --dry-run
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from columnar import csv_to_parquet, entity_for, parquet_path, source_etag
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+S3_BUCKET = os.getenv('S3_BUCKET') or os.getenv('S3_BUCKET_NAME', 'medilink-data-bucket')
+S3_INPUT_PREFIX = os.getenv('S3_INPUT_PREFIX') or 'medical_records/input/'
+S3_ARCHIVE_PREFIX = os.getenv('S3_ARCHIVE_PREFIX') or 'medical_records/archive/'
+S3_MANIFEST_KEY = os.getenv('S3_MANIFEST_KEY') or 'medical_records/_manifest.json'
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+AWS_REGION = os.getenv('AWS_REGION') or 'eu-west-1'
+EXTRACT_DIR = os.getenv('EXTRACT_DIR', '/tmp/medical_records')
+# Objects downloaded (or archived) at the same time
+S3_MAX_WORKERS = int(os.getenv('S3_MAX_WORKERS', '8'))
+# Objects above the threshold are fetched as parallel ranged GETs of this size
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', '64'))
+S3_MULTIPART_CHUNKSIZE_MB = int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', '16'))
+S3_PART_CONCURRENCY = int(os.getenv('S3_PART_CONCURRENCY', '4'))
+# Manifest entries older than this are dropped when the manifest is saved
+S3_MANIFEST_RETENTION_DAYS = int(os.getenv('S3_MANIFEST_RETENTION_DAYS', '90'))
+
+
+class S3Extractor:
+    """Downloads new CSV objects from the input prefix and archives them once processed"""
+
+    def __init__(self, bucket=S3_BUCKET, input_prefix=S3_INPUT_PREFIX, archive_prefix=S3_ARCHIVE_PREFIX,
+                 local_dir=EXTRACT_DIR, manifest_key=S3_MANIFEST_KEY, endpoint_url=S3_ENDPOINT_URL,
+                 max_workers=S3_MAX_WORKERS, client=None):
+        self.bucket = bucket
+        self.input_prefix = input_prefix
+        self.archive_prefix = archive_prefix
+        self.local_dir = local_dir
+        self.manifest_key = manifest_key
+        self.max_workers = max_workers
+        # Every download can have S3_PART_CONCURRENCY ranged GETs in flight
+        self.client = client or boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=AWS_REGION,
+            config=Config(
+                max_pool_connections=max_workers * S3_PART_CONCURRENCY,
+                retries={'max_attempts': 10, 'mode': 'adaptive'},
+            ),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD_MB * MB,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE_MB * MB,
+            max_concurrency=S3_PART_CONCURRENCY,
+        )
+        self.last_stats = {}
+
+    def list_objects(self):
+        """Every CSV object under the input prefix, following continuation tokens"""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.input_prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].lower().endswith('.csv'):
+                    yield obj
+
+    def load_manifest(self):
+        """Processed objects by key: {'etag', 'size', 'last_modified', 'processed_at'}"""
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.manifest_key)['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return {}
+            raise
+        return json.loads(body)
+
+    def save_manifest(self, manifest):
+        cutoff = (datetime.utcnow() - timedelta(days=S3_MANIFEST_RETENTION_DAYS)).isoformat()
+        manifest = {key: entry for key, entry in manifest.items() if entry['processed_at'] >= cutoff}
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.manifest_key,
+            Body=json.dumps(manifest, sort_keys=True).encode(),
+            ContentType='application/json',
+        )
+
+    @staticmethod
+    def _is_processed(manifest, obj):
+        entry = manifest.get(obj['Key'])
+        return entry is not None and entry['etag'] == obj['ETag'] and entry['size'] == obj['Size']
+
+    def _local_path(self, key):
+        relative = key[len(self.input_prefix):] if key.startswith(self.input_prefix) else key
+        return os.path.join(self.local_dir, relative.lstrip('/'))
+
+    def _file_info(self, obj):
+        return {
+            'filename': os.path.basename(obj['Key']),
+            'entity': entity_for(os.path.basename(obj['Key'])),
+            'local_path': self._local_path(obj['Key']),
+            's3_key': obj['Key'],
+            'etag': obj['ETag'],
+            'size': obj['Size'],
+            'last_modified': obj['LastModified'].isoformat(),
+        }
+
+    def download(self, file_info):
+        """Fetch one object; a complete local copy left by an earlier attempt is reused"""
+        path = file_info['local_path']
+        # Downloads are stamped with the object's last-modified time to recognise them on retry
+        mtime = datetime.fromisoformat(file_info['last_modified']).timestamp()
+        if os.path.exists(path) and os.path.getsize(path) == file_info['size'] and os.path.getmtime(path) == mtime:
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.partial'
+        self.client.download_file(self.bucket, file_info['s3_key'], partial, Config=self.transfer_config)
+        os.utime(partial, (mtime, mtime))
+        os.replace(partial, path)
+        return file_info['size']
+
+    def fetch(self, file_info):
+        """
+        Download one object and convert it to its Parquet intermediate, which
+        replaces the CSV as `local_path`. An intermediate already converted
+        from the same object version is reused. Returns the bytes downloaded.
+        """
+        if file_info['entity'] is None:
+            return self.download(file_info)
+        csv_path = file_info['local_path']
+        if source_etag(parquet_path(csv_path)) == file_info['etag']:
+            file_info['local_path'] = parquet_path(csv_path)
+            return 0
+        downloaded = self.download(file_info)
+        file_info['local_path'] = csv_to_parquet(csv_path, file_info['entity'], file_info['etag'])
+        os.remove(csv_path)
+        return downloaded
+
+    def extract_all(self):
+        """
+        Download every input object not yet in the manifest and return their
+        file info dicts (filename, entity, local_path, s3_key, etag, size,
+        last_modified).
+        """
+        started = time.perf_counter()
+        manifest = self.load_manifest()
+        pending, skipped = [], 0
+        for obj in self.list_objects():
+            if self._is_processed(manifest, obj):
+                skipped += 1
+            else:
+                pending.append(self._file_info(obj))
+
+        downloaded_bytes = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.fetch, file_info): file_info for file_info in pending}
+            for future in as_completed(futures):
+                downloaded_bytes += future.result()
+
+        elapsed = time.perf_counter() - started
+        source_bytes = sum(file_info['size'] for file_info in pending if file_info['entity'])
+        parquet_bytes = sum(os.path.getsize(file_info['local_path']) for file_info in pending if file_info['entity'])
+        self.last_stats = {
+            'files': len(pending),
+            'skipped': skipped,
+            'bytes': downloaded_bytes,
+            'csv_bytes': source_bytes,
+            'parquet_bytes': parquet_bytes,
+            'seconds': round(elapsed, 3),
+            'mb_per_second': round(downloaded_bytes / MB / max(elapsed, 1e-9), 2),
+        }
+        logger.info(
+            f"Extracted {len(pending)} files ({downloaded_bytes / MB:.1f} MB) from s3://{self.bucket}/"
+            f"{self.input_prefix} in {elapsed:.1f}s ({self.last_stats['mb_per_second']} MB/s); "
+            f"{skipped} already processed; {source_bytes / MB:.1f} MB of CSV stored as "
+            f"{parquet_bytes / MB:.1f} MB of Parquet"
+        )
+        return sorted(pending, key=lambda file_info: file_info['s3_key'])
+
+    def archive_key(self, s3_key):
+        relative = s3_key[len(self.input_prefix):] if s3_key.startswith(self.input_prefix) else s3_key
+        return f"{self.archive_prefix}{datetime.utcnow():%Y/%m/%d}/{relative.lstrip('/')}"
+
+    def archive_file(self, s3_key):
+        """Server-side copy of one object into the archive prefix, then delete the original"""
+        destination = self.archive_key(s3_key)
+        self.client.copy(
+            {'Bucket': self.bucket, 'Key': s3_key}, self.bucket, destination, Config=self.transfer_config
+        )
+        self.client.delete_object(Bucket=self.bucket, Key=s3_key)
+        return destination
+
+    def archive_files(self, files):
+        """
+        Record `files` (as returned by `extract_all`) in the manifest, then
+        archive them concurrently. Returns the number archived; failures are
+        logged and left in place, and the manifest still keeps them from
+        being processed again.
+        """
+        manifest = self.load_manifest()
+        processed_at = datetime.utcnow().isoformat()
+        for file_info in files:
+            manifest[file_info['s3_key']] = {
+                'etag': file_info['etag'],
+                'size': file_info['size'],
+                'last_modified': file_info['last_modified'],
+                'processed_at': processed_at,
+            }
+        self.save_manifest(manifest)
+
+        archived = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.archive_file, file_info['s3_key']): file_info for file_info in files}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    archived += 1
+                except Exception as e:
+                    logger.error(f"Failed to archive {futures[future]['s3_key']}: {str(e)}")
+        return archived
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--endpoint-url', default=S3_ENDPOINT_URL, help='S3-compatible endpoint, e.g. MinIO')
+    parser.add_argument('--bucket', default=S3_BUCKET)
+    parser.add_argument('--workers', type=int, default=S3_MAX_WORKERS)
+    parser.add_argument('--dry-run', action='store_true', help='download only; do not archive or update the manifest')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    extractor = S3Extractor(bucket=args.bucket, endpoint_url=args.endpoint_url, max_workers=args.workers)
+    files = extractor.extract_all()
+    print(json.dumps(extractor.last_stats))
+    if not args.dry_run:
+        print(f"Archived {extractor.archive_files(files)} of {len(files)} files")
@@ -0,0 +1,389 @@
+"""
+Move staged rows into the application tables, assigning their IDs
+
+IDs are assigned chunk by chunk, never row by row. A chunk's natural keys
+(facility name + state + LGA; patient facility + names + date of birth; the
+key hash of a medical record or triage visit) are looked up in `etl_id_map`.
+Keys seen for the first time get IDs reserved from the table's sequence in a
+single statement, and the mapping is stored. A rerun, or a row that changes
+later, therefore keeps its ID. Facility and patient IDs are cached in memory
+for the run, so the foreign keys of medical records and triage visits
+resolve with pandas lookups instead of a query per row.
+
+Only the key columns travel to Python: the chunk's IDs are COPYed into a
+temp table and joined back to the staging table by an
+INSERT ... ON CONFLICT (id) DO UPDATE. Only new and changed rows are pending
+in staging (see load_to_postgres.py), so that is all the transform writes;
+the content hash of each row written is recorded in `etl_row_hashes` in the
+same transaction, and the table's change counter in `data_versions` (which
+the API's in-process caches watch) is bumped. `updated_at` is the time of
+the write, never the source event time, so the incremental dbt models pick
+up backfilled rows.
+"""
+import logging
+import os
+import time
+import uuid
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from db import audit, connect, copy_frame, ensure_schema
+
+logger = logging.getLogger(__name__)
+
+TRANSFORM_CHUNK_ROWS = int(os.getenv('TRANSFORM_CHUNK_ROWS', '100000'))
+KEY_SEPARATOR = '\x1f'
+
+
+class Step(namedtuple('Step', ['table', 'staging', 'key', 'columns', 'temp_columns', 'upsert'])):
+    """
+    Transform of `staging` into `table`. `key` is the staging primary key
+    (chunks are paged on it), `columns` the staging columns read into pandas,
+    and `temp_columns` the typed columns of `transform_<table>`, which
+    `upsert` joins back to the staging table. `upsert` returns whether each
+    row was inserted.
+    """
+
+    @property
+    def temp_table(self):
+        return f'transform_{self.table}'
+
+
+UPSERT_FACILITIES = """
+INSERT INTO facilities (id, name, state, lga, lat, lon, type, created_at)
+SELECT t.id, s.name, s.state, s.lga, s.lat, s.lon, s.type, s.loaded_at
+FROM transform_facilities t
+JOIN staging_facilities s ON s.key_hash = t.key_hash
+ON CONFLICT (id) DO UPDATE SET
+    name = EXCLUDED.name, state = EXCLUDED.state, lga = EXCLUDED.lga,
+    lat = EXCLUDED.lat, lon = EXCLUDED.lon, type = EXCLUDED.type
+RETURNING xmax = 0
+"""
+
+UPSERT_PATIENTS = """
+INSERT INTO patients (id, facility_id, first_name, last_name, sex, dob, phone, created_at)
+SELECT t.id, t.facility_id, s.first_name, s.last_name, s.sex, s.dob, s.phone, s.loaded_at
+FROM transform_patients t
+JOIN staging_patients s ON s.key_hash = t.key_hash
+ON CONFLICT (id) DO UPDATE SET
+    facility_id = EXCLUDED.facility_id, first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name,
+    sex = EXCLUDED.sex, dob = EXCLUDED.dob, phone = EXCLUDED.phone
+RETURNING xmax = 0
+"""
+
+UPSERT_MEDICAL_RECORDS = """
+INSERT INTO medical_records (id, patient_id, facility_id, record_type, data, created_at, updated_at)
+SELECT t.id, t.patient_id, t.facility_id, s.record_type, s.data,
+       COALESCE(s.created_at, s.loaded_at), timezone('utc', now())
+FROM transform_medical_records t
+JOIN staging_medical_records s ON s.key_hash = t.key_hash
+ON CONFLICT (id) DO UPDATE SET
+    patient_id = EXCLUDED.patient_id, facility_id = EXCLUDED.facility_id,
+    record_type = EXCLUDED.record_type, data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+RETURNING xmax = 0
+"""
+
+UPSERT_TRIAGE_VISITS = """
+INSERT INTO triage_visits (
+    id, patient_id, facility_id, triage_level, likely_conditions, recommendations, language, provider,
+    created_at, updated_at
+)
+SELECT t.id, t.patient_id, t.facility_id, s.triage_level, s.likely_conditions, s.recommendations,
+       COALESCE(s.language, 'en'), s.provider, COALESCE(s.created_at, s.loaded_at), timezone('utc', now())
+FROM transform_triage_visits t
+JOIN staging_triage_visits s ON s.key_hash = t.key_hash
+ON CONFLICT (id) DO UPDATE SET
+    patient_id = EXCLUDED.patient_id, facility_id = EXCLUDED.facility_id,
+    triage_level = EXCLUDED.triage_level, likely_conditions = EXCLUDED.likely_conditions,
+    recommendations = EXCLUDED.recommendations, language = EXCLUDED.language, provider = EXCLUDED.provider,
+    updated_at = EXCLUDED.updated_at
+RETURNING xmax = 0
+"""
+
+STEPS = (
+    Step(
+        'facilities', 'staging_facilities', ('key_hash',),
+        ('key_hash', 'name', 'state', 'lga'),
+        (('key_hash', 'UUID'), ('id', 'INTEGER')),
+        UPSERT_FACILITIES,
+    ),
+    Step(
+        'patients', 'staging_patients', ('key_hash',),
+        ('key_hash', 'facility_name', 'first_name', 'last_name', 'dob', 'sex'),
+        (('key_hash', 'UUID'), ('id', 'INTEGER'), ('facility_id', 'INTEGER')),
+        UPSERT_PATIENTS,
+    ),
+    Step(
+        'medical_records', 'staging_medical_records', ('key_hash',),
+        ('key_hash', 'facility_name', 'patient_first_name', 'patient_last_name'),
+        (('key_hash', 'UUID'), ('id', 'INTEGER'), ('facility_id', 'INTEGER'), ('patient_id', 'INTEGER')),
+        UPSERT_MEDICAL_RECORDS,
+    ),
+    Step(
+        'triage_visits', 'staging_triage_visits', ('key_hash',),
+        ('key_hash', 'facility_name', 'patient_first_name', 'patient_last_name', 'triage_level'),
+        (('key_hash', 'UUID'), ('id', 'INTEGER'), ('facility_id', 'INTEGER'), ('patient_id', 'INTEGER')),
+        UPSERT_TRIAGE_VISITS,
+    ),
+)
+
+# Rows that were in the application tables before the ID map existed keep their IDs
+ADOPT_EXISTING_IDS = """
+INSERT INTO etl_id_map (entity, natural_key, id)
+SELECT 'facilities', upper(btrim(name)) || chr(31) || upper(btrim(state)) || chr(31) || upper(btrim(lga)), min(id)
+FROM facilities
+WHERE NOT EXISTS (SELECT 1 FROM etl_id_map WHERE entity = 'facilities')
+GROUP BY 2
+ON CONFLICT (entity, natural_key) DO NOTHING;
+
+INSERT INTO etl_id_map (entity, natural_key, id)
+SELECT 'patients',
+       upper(btrim(f.name)) || chr(31) || upper(btrim(p.first_name)) || chr(31) || upper(btrim(p.last_name))
+           || chr(31) || to_char(p.dob, 'YYYY-MM-DD'),
+       min(p.id)
+FROM patients p
+JOIN facilities f ON f.id = p.facility_id
+WHERE NOT EXISTS (SELECT 1 FROM etl_id_map WHERE entity = 'patients')
+GROUP BY 2
+ON CONFLICT (entity, natural_key) DO NOTHING;
+"""
+
+# What each row written to `entity` now holds, for the next load to compare against
+RECORD_ROW_HASHES = """
+INSERT INTO etl_row_hashes (entity, key_hash, content_hash, updated_at)
+SELECT %s, s.key_hash, s.content_hash, now()
+FROM {temp_table} t
+JOIN {staging} s ON s.key_hash = t.key_hash
+ON CONFLICT (entity, key_hash) DO UPDATE SET
+    content_hash = EXCLUDED.content_hash, updated_at = EXCLUDED.updated_at
+"""
+
+# Tells the API workers' caches the table has changed (backend/data_versions.py)
+BUMP_DATA_VERSION = """
+INSERT INTO data_versions (table_name, version, updated_at)
+VALUES (%s, 1, timezone('utc', now()))
+ON CONFLICT (table_name) DO UPDATE SET
+    version = data_versions.version + 1, updated_at = EXCLUDED.updated_at
+"""
+
+FACILITIES_BY_NAME = """
+SELECT upper(btrim(name)), min(id)
+FROM facilities
+WHERE upper(btrim(name)) = ANY(%s)
+GROUP BY 1
+"""
+
+# Medical records and triage visits name the patient but not their date of birth,
+# so a name shared by patients born on different days resolves to no ID (NULL)
+PATIENTS_BY_NAME = """
+SELECT upper(btrim(f.name)) || chr(31) || upper(btrim(p.first_name)) || chr(31) || upper(btrim(p.last_name)),
+       CASE WHEN count(DISTINCT p.dob) <= 1 THEN min(p.id) END
+FROM patients p
+JOIN facilities f ON f.id = p.facility_id
+WHERE upper(btrim(f.name)) = ANY(%s)
+GROUP BY 1
+"""
+
+
+def natural_keys(frame, columns):
+    """Vectorized natural key: the normalized `columns` joined by KEY_SEPARATOR"""
+    parts = [frame[column].astype(str).str.strip().str.upper() for column in columns]
+    return parts[0].str.cat(parts[1:], sep=KEY_SEPARATOR) if len(parts) > 1 else parts[0]
+
+
+class IDGenerator:
+    """Transforms the pending staging rows of every table, in foreign-key order"""
+
+    def __init__(self, batch_id=None, chunk_rows=TRANSFORM_CHUNK_ROWS):
+        self.batch_id = batch_id or uuid.uuid4().hex
+        self.chunk_rows = chunk_rows
+        # Per run: natural key -> ID for facilities and patients
+        self.id_maps = {'facilities': {}, 'patients': {}}
+        self.facility_ids = {}
+        self.patient_ids = {}
+        self.patient_facilities = set()
+        self.ambiguous_patients = set()
+        self.sequences = {}
+
+    def transform_all(self):
+        """
+        Transform every table; returns
+        {table: {'transformed', 'inserted', 'updated', 'skipped', 'ambiguous', 'new_ids'}}
+        """
+        results = {}
+        with closing(connect()) as connection:
+            ensure_schema(connection)
+            with connection.cursor() as cursor:
+                cursor.execute(ADOPT_EXISTING_IDS)
+            connection.commit()
+            for step in STEPS:
+                results[step.table] = self.transform(connection, step)
+        return results
+
+    def transform(self, connection, step):
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        counts = {'transformed': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'ambiguous': 0, 'new_ids': 0}
+        resolve = getattr(self, f'_resolve_{step.table}')
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TEMP TABLE IF NOT EXISTS {step.temp_table} "
+                    f"({', '.join(f'{name} {type_}' for name, type_ in step.temp_columns)}) ON COMMIT DELETE ROWS"
+                )
+                after = None
+                while True:
+                    chunk = self._pending(cursor, step, after)
+                    if chunk.empty:
+                        break
+                    after = tuple(chunk.iloc[-1][list(step.key)])
+
+                    resolved = resolve(cursor, chunk, counts)
+                    counts['skipped'] += len(chunk) - len(resolved)
+                    if not resolved.empty:
+                        copy_frame(cursor, step.temp_table, resolved[[name for name, _ in step.temp_columns]])
+                        cursor.execute(step.upsert)
+                        inserted = [row[0] for row in cursor.fetchall()]
+                        counts['transformed'] += len(inserted)
+                        counts['inserted'] += sum(inserted)
+                        counts['updated'] += len(inserted) - sum(inserted)
+                        cursor.execute(
+                            RECORD_ROW_HASHES.format(temp_table=step.temp_table, staging=step.staging),
+                            (step.table,),
+                        )
+                        cursor.execute(BUMP_DATA_VERSION, (step.table,))
+                        cursor.execute(
+                            f"UPDATE {step.staging} s SET transformed_at = now() FROM {step.temp_table} t "
+                            f"WHERE ({', '.join(f's.{column}' for column in step.key)}) "
+                            f"= ({', '.join(f't.{column}' for column in step.key)})"
+                        )
+                    connection.commit()
+        except Exception as e:
+            connection.rollback()
+            logger.error(f"Error transforming {step.staging} into {step.table}: {str(e)}")
+            audit(connection, self.batch_id, step.table, None, 'failed', started_at,
+                  counts['transformed'] + counts['skipped'], counts['inserted'], counts['skipped'], str(e),
+                  updated=counts['updated'])
+            raise
+
+        logger.info(
+            f"Transformed {counts['transformed']:,} rows into {step.table} in {time.perf_counter() - started:.1f}s "
+            f"({counts['inserted']:,} inserted, {counts['updated']:,} updated, {counts['new_ids']:,} new IDs, "
+            f"{counts['skipped']:,} left in staging, {counts['ambiguous']:,} of them naming an ambiguous patient)"
+        )
+        audit(connection, self.batch_id, step.table, None, 'success', started_at,
+              counts['transformed'] + counts['skipped'], counts['inserted'], counts['skipped'],
+              updated=counts['updated'])
+        return counts
+
+    def _pending(self, cursor, step, after):
+        """The next chunk of untransformed staging rows, in key order"""
+        key = ', '.join(step.key)
+        where = 'transformed_at IS NULL'
+        params = []
+        if after is not None:
+            where += f" AND ({key}) > ({', '.join(['%s'] * len(after))})"
+            params = list(after)
+        cursor.execute(
+            f"SELECT {', '.join(step.columns)} FROM {step.staging} WHERE {where} ORDER BY {key} LIMIT %s",
+            params + [self.chunk_rows],
+        )
+        return pd.DataFrame(cursor.fetchall(), columns=list(step.columns))
+
+    def ids_for(self, cursor, table, keys, counts, cache=None):
+        """
+        IDs for a Series of natural keys: from `cache`, else from etl_id_map,
+        else newly reserved from `table`'s sequence and recorded in the map.
+        """
+        cache = {} if cache is None else cache
+        unknown = pd.unique(keys[keys.map(cache).isna()]).tolist()
+        if unknown:
+            cursor.execute(
+                "SELECT natural_key, id FROM etl_id_map WHERE entity = %s AND natural_key = ANY(%s)",
+                (table, unknown),
+            )
+            cache.update(cursor.fetchall())
+            new = sorted(key for key in unknown if key not in cache)
+            if new:
+                cache.update(self._reserve(cursor, table, new))
+                counts['new_ids'] += len(new)
+        return keys.map(cache).astype('int64')
+
+    def _reserve(self, cursor, table, keys):
+        if table not in self.sequences:
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+            self.sequences[table] = cursor.fetchone()[0]
+        cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)", (self.sequences[table], len(keys)))
+        reserved = sorted(row[0] for row in cursor.fetchall())
+        # A concurrent run may have mapped a key first; RETURNING gives whichever ID won
+        return execute_values(
+            cursor,
+            "INSERT INTO etl_id_map (entity, natural_key, id) VALUES %s "
+            "ON CONFLICT (entity, natural_key) DO UPDATE SET entity = EXCLUDED.entity "
+            "RETURNING natural_key, id",
+            [(table, key, row_id) for key, row_id in zip(keys, reserved)],
+            page_size=len(keys),
+            fetch=True,
+        )
+
+    def _facility_ids_by_name(self, cursor, names):
+        missing = [name for name in pd.unique(names).tolist() if name not in self.facility_ids]
+        if missing:
+            self.facility_ids.update(dict.fromkeys(missing))
+            cursor.execute(FACILITIES_BY_NAME, (missing,))
+            self.facility_ids.update(cursor.fetchall())
+        return names.map(self.facility_ids)
+
+    def _patient_ids_by_name(self, cursor, chunk):
+        """Patient IDs by name for `chunk`, and a mask of the names that are ambiguous"""
+        names = natural_keys(chunk, ['facility_name'])
+        missing = [name for name in pd.unique(names).tolist() if name not in self.patient_facilities]
+        if missing:
+            cursor.execute(PATIENTS_BY_NAME, (missing,))
+            found = cursor.fetchall()
+            self.patient_ids.update(found)
+            self.ambiguous_patients.update(key for key, patient_id in found if patient_id is None)
+            self.patient_facilities.update(missing)
+        refs = natural_keys(chunk, ['facility_name', 'patient_first_name', 'patient_last_name'])
+        return refs.map(self.patient_ids), refs.isin(self.ambiguous_patients)
+
+    def _resolve_facilities(self, cursor, chunk, counts):
+        keys = natural_keys(chunk, ['name', 'state', 'lga'])
+        chunk['id'] = self.ids_for(cursor, 'facilities', keys, counts, self.id_maps['facilities'])
+        return chunk
+
+    def _resolve_patients(self, cursor, chunk, counts):
+        chunk['facility_id'] = self._facility_ids_by_name(cursor, natural_keys(chunk, ['facility_name']))
+        chunk = chunk[chunk['facility_id'].notna() & chunk['sex'].notna()].copy()
+        chunk['facility_id'] = chunk['facility_id'].astype('int64')
+        keys = natural_keys(chunk, ['facility_name', 'first_name', 'last_name', 'dob'])
+        chunk['id'] = self.ids_for(cursor, 'patients', keys, counts, self.id_maps['patients'])
+        return chunk
+
+    def _resolve_patient_rows(self, cursor, table, chunk, counts):
+        """Facility and patient IDs by name, then IDs by row hash, for rows of `table`"""
+        chunk['facility_id'] = self._facility_ids_by_name(cursor, natural_keys(chunk, ['facility_name']))
+        chunk['patient_id'], ambiguous = self._patient_ids_by_name(cursor, chunk)
+        if ambiguous.any():
+            counts['ambiguous'] += int(ambiguous.sum())
+            logger.warning(
+                f"{int(ambiguous.sum()):,} rows of {table} name a patient shared by patients with different "
+                f"dates of birth; left in staging"
+            )
+        chunk = chunk[chunk['facility_id'].notna() & chunk['patient_id'].notna()].copy()
+        chunk[['facility_id', 'patient_id']] = chunk[['facility_id', 'patient_id']].astype('int64')
+        # Key hashes are unique per row, so they are not worth caching across chunks
+        chunk['id'] = self.ids_for(cursor, table, natural_keys(chunk, ['key_hash']), counts)
+        return chunk
+
+    def _resolve_medical_records(self, cursor, chunk, counts):
+        return self._resolve_patient_rows(cursor, 'medical_records', chunk, counts)
+
+    def _resolve_triage_visits(self, cursor, chunk, counts):
+        chunk = chunk[chunk['triage_level'].notna()].copy()
+        return self._resolve_patient_rows(cursor, 'triage_visits', chunk, counts)
@@ -0,0 +1,211 @@
+-- Medilink ELT tables (staging, audit, quarantine, ID map, row hashes)
+-- Safe to run more than once; the loaders run it before their first batch.
+-- The application tables (facilities, patients, medical_records,
+-- triage_visits, record_requests) and their indexes are owned by the Alembic
+-- migrations in backend/migrations: run `flask db upgrade` before the loaders.
+
+-- Staging tables, one row per natural key, stored as `key_hash`: an md5 of
+-- the normalized key (facility name + state + LGA; patient facility + names
+-- + date of birth; the patient and timestamp of a medical record or triage
+-- visit). `content_hash` is an md5 of the whole staged row. They can be
+-- rebuilt from the source files, so they are UNLOGGED. `transformed_at` is
+-- cleared whenever a row changes and set once the transform stage has moved
+-- it into the application tables. `load_sequence` is the run position of the
+-- source row a row was last staged from, so parallel loads only overwrite it
+-- with a later row.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_facilities (
+    key_hash UUID PRIMARY KEY,
+    content_hash UUID NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    state VARCHAR(100) NOT NULL,
+    lga VARCHAR(100) NOT NULL,
+    lat NUMERIC(10, 8),
+    lon NUMERIC(11, 8),
+    type VARCHAR(100),
+    batch_id TEXT NOT NULL,
+    load_sequence BIGINT NOT NULL DEFAULT 0,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    transformed_at TIMESTAMP
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_patients (
+    key_hash UUID PRIMARY KEY,
+    content_hash UUID NOT NULL,
+    facility_name VARCHAR(255) NOT NULL,
+    first_name VARCHAR(100) NOT NULL,
+    last_name VARCHAR(100) NOT NULL,
+    sex VARCHAR(10),
+    dob DATE NOT NULL,
+    phone VARCHAR(20),
+    batch_id TEXT NOT NULL,
+    load_sequence BIGINT NOT NULL DEFAULT 0,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    transformed_at TIMESTAMP
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_medical_records (
+    key_hash UUID PRIMARY KEY,
+    content_hash UUID NOT NULL,
+    facility_name VARCHAR(255) NOT NULL,
+    patient_first_name VARCHAR(100) NOT NULL,
+    patient_last_name VARCHAR(100) NOT NULL,
+    record_type VARCHAR(100),
+    data JSONB NOT NULL,
+    created_at TIMESTAMP,
+    batch_id TEXT NOT NULL,
+    load_sequence BIGINT NOT NULL DEFAULT 0,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    transformed_at TIMESTAMP
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_triage_visits (
+    key_hash UUID PRIMARY KEY,
+    content_hash UUID NOT NULL,
+    facility_name VARCHAR(255) NOT NULL,
+    patient_first_name VARCHAR(100) NOT NULL,
+    patient_last_name VARCHAR(100) NOT NULL,
+    triage_level INTEGER,
+    chief_complaint TEXT,
+    vital_signs TEXT,
+    likely_conditions TEXT[],
+    recommendations TEXT[],
+    language VARCHAR(10),
+    provider VARCHAR(255),
+    created_at TIMESTAMP,
+    batch_id TEXT NOT NULL,
+    load_sequence BIGINT NOT NULL DEFAULT 0,
+    loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+    transformed_at TIMESTAMP
+);
+
+-- Rows waiting for the transform stage, in the order it pages through them
+CREATE INDEX IF NOT EXISTS ix_staging_facilities_pending
+    ON staging_facilities (key_hash) WHERE transformed_at IS NULL;
+CREATE INDEX IF NOT EXISTS ix_staging_patients_pending
+    ON staging_patients (key_hash) WHERE transformed_at IS NULL;
+CREATE INDEX IF NOT EXISTS ix_staging_medical_records_pending
+    ON staging_medical_records (key_hash) WHERE transformed_at IS NULL;
+CREATE INDEX IF NOT EXISTS ix_staging_triage_visits_pending
+    ON staging_triage_visits (key_hash) WHERE transformed_at IS NULL;
+
+-- Content hash of the row last written to each application table per natural
+-- key; loads compare against it to tell new, changed and unchanged rows apart
+
+CREATE TABLE IF NOT EXISTS etl_row_hashes (
+    entity VARCHAR(50) NOT NULL,
+    key_hash UUID NOT NULL,
+    content_hash UUID NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (entity, key_hash)
+);
+
+-- The ID the transform stage gave each natural key (the key hash of a
+-- medical record or triage visit), so re-running a transform assigns the
+-- same IDs again
+
+CREATE TABLE IF NOT EXISTS etl_id_map (
+    entity VARCHAR(50) NOT NULL,
+    natural_key TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (entity, natural_key)
+);
+
+-- Source rows the validation stage kept out of the load, with the rules they
+-- broke; `record` holds the row as it was in the source file
+
+CREATE TABLE IF NOT EXISTS etl_quarantine (
+    id BIGSERIAL PRIMARY KEY,
+    batch_id TEXT NOT NULL,
+    entity VARCHAR(50) NOT NULL,
+    source_file TEXT,
+    row_number BIGINT,
+    reasons TEXT[] NOT NULL,
+    record JSONB NOT NULL,
+    quarantined_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS ix_etl_quarantine_batch_id ON etl_quarantine (batch_id, entity);
+
+-- One row per file loaded (or per table transformed) in a pipeline run
+
+CREATE TABLE IF NOT EXISTS etl_audit_log (
+    id BIGSERIAL PRIMARY KEY,
+    batch_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    source_file TEXT,
+    status VARCHAR(20) NOT NULL,
+    records_processed INTEGER NOT NULL DEFAULT 0,
+    records_inserted INTEGER NOT NULL DEFAULT 0,
+    records_updated INTEGER NOT NULL DEFAULT 0,
+    records_unchanged INTEGER NOT NULL DEFAULT 0,
+    records_failed INTEGER NOT NULL DEFAULT 0,
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP,
+    error_message TEXT
+);
+
+CREATE INDEX IF NOT EXISTS ix_etl_audit_log_batch_id ON etl_audit_log (batch_id);
+
+-- Casts used by the staging merges that give NULL for a value that does not
+-- fit its type, instead of failing the whole chunk. They only test patterns
+-- and ranges, so they stay plain (inlinable) SQL without exception blocks.
+CREATE OR REPLACE FUNCTION etl_date(value TEXT) RETURNS DATE
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN btrim(value) ~ '^\d{4}-\d{2}-\d{2}$' THEN
+        CASE WHEN substr(btrim(value), 1, 4)::INT >= 1 AND substr(btrim(value), 6, 2)::INT BETWEEN 1 AND 12 THEN
+            CASE WHEN substr(btrim(value), 9, 2)::INT BETWEEN 1 AND extract(DAY FROM
+                    make_date(substr(btrim(value), 1, 4)::INT, substr(btrim(value), 6, 2)::INT, 1)
+                    + INTERVAL '1 month - 1 day')
+                THEN btrim(value)::DATE
+            END
+        END
+    END
+$$;
+
+-- ISO-8601 without an offset: the Parquet intermediates hold UTC times
+CREATE OR REPLACE FUNCTION etl_timestamp(value TEXT) RETURNS TIMESTAMP
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN btrim(value) ~ '^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?)?$' THEN
+        CASE
+            WHEN length(btrim(value)) = 10 THEN etl_date(btrim(value))::TIMESTAMP
+            WHEN substr(btrim(value), 12, 2)::INT < 24 AND substr(btrim(value), 15, 2)::INT < 60
+                 AND coalesce(NULLIF(substr(btrim(value), 18, 2), '')::INT, 0) < 60
+                THEN etl_date(left(btrim(value), 10)) + substr(btrim(value), 12)::INTERVAL
+        END
+    END
+$$;
+
+-- A NUMERIC(digits, scale) value, rounded to `scale` like the cast would
+CREATE OR REPLACE FUNCTION etl_numeric(value TEXT, digits INTEGER, scale INTEGER) RETURNS NUMERIC
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN btrim(value) ~ '^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d{1,3})?$' THEN
+        CASE WHEN abs(round(btrim(value)::NUMERIC, scale)) < 10::NUMERIC ^ (digits - scale)
+            THEN round(btrim(value)::NUMERIC, scale)
+        END
+    END
+$$;
+
+CREATE OR REPLACE FUNCTION etl_integer(value TEXT) RETURNS INTEGER
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN btrim(value) ~ '^[+-]?\d{1,10}$' THEN
+        CASE WHEN btrim(value)::BIGINT BETWEEN -2147483648 AND 2147483647 THEN btrim(value)::INTEGER END
+    END
+$$;
+
+-- Text arrays in the source CSVs arrive as a JSON list, a Postgres array
+-- literal, or items separated by ';' or '|'
+CREATE OR REPLACE FUNCTION etl_text_array(value TEXT) RETURNS TEXT[]
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN value IS NULL OR btrim(value) = '' THEN NULL
+        WHEN left(btrim(value), 1) = '[' THEN ARRAY(SELECT jsonb_array_elements_text(value::jsonb))
+        WHEN left(btrim(value), 1) = '{' THEN value::TEXT[]
+        ELSE ARRAY(
+            SELECT btrim(item)
+            FROM unnest(regexp_split_to_array(value, '[;|]')) AS item
+            WHERE btrim(item) <> ''
+        )
+    END
+$$;
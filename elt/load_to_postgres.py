@@ -0,0 +1,375 @@
+"""
+Load the extracted files into the staging tables
+
+Each file (normally the Parquet intermediate written at extract time, see
+columnar.py; a raw CSV also works) is read in batches of LOAD_CHUNK_ROWS rows
+and only the columns the staging table needs, so memory stays bounded
+whatever its size. A batch is COPYed as text into a temporary (unlogged)
+table, rows missing a required column are dropped, and a single
+INSERT ... ON CONFLICT merges the rest into the staging table. Typing, the
+JSONB `data` of medical records and the text arrays of triage visits are all
+built in that statement, not row by row in Python. Typing uses the safe casts
+of init.sql, so a value that does not fit its column becomes NULL (and
+rejects the row, for a required column) instead of failing the file. Every
+file gets a row in `etl_audit_log`.
+
+Each row is hashed twice in that statement: its natural key and its
+content. Against the content last staged or written to production for the
+key (`etl_row_hashes`) the row is new, changed or unchanged, and unchanged
+rows are not staged, so a rerun over the same files writes nothing.
+
+`plan_loads` splits a run's files into parts that can be loaded in parallel:
+one per file, or for large files one per range of Parquet row groups. Every
+staged facility and patient row carries the position of its source row in
+the run, so whichever part commits last, the last row in the source wins.
+"""
+import logging
+import math
+import os
+import time
+import uuid
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime
+
+import pyarrow.parquet as pq
+
+from columnar import read_batches, to_csv_buffer
+from db import audit, connect, ensure_schema
+
+logger = logging.getLogger(__name__)
+
+LOAD_CHUNK_ROWS = int(os.getenv('LOAD_CHUNK_ROWS', '100000'))
+# Files whose source CSV is larger than this are loaded as several parts
+LOAD_SPLIT_MB = int(os.getenv('LOAD_SPLIT_MB', '256'))
+# A staged row's sequence is its file's position in the run shifted by this, plus its row number
+SEQUENCE_FILE_BITS = 40
+# Required columns that must also parse as their type, and the safe cast (elt/init.sql) checking it
+REQUIRED_CASTS = {'dob': 'etl_date'}
+# Row counts in `PostgresLoader.last_stats`
+STAT_KEYS = ('processed', 'merged', 'rejected', 'inserted', 'updated', 'unchanged')
+
+
+class Entity(namedtuple('Entity', ['table', 'columns', 'required', 'merge'])):
+    """
+    `columns` are the CSV columns COPYed into `load_<table>` (absent ones load
+    as NULL) and `required` those a row cannot be staged without. `merge`
+    moves the temp table into `table`, with `%(batch_id)s` and
+    `%(sequence)s` (the run position of the chunk's first row) as parameters.
+    """
+
+    @property
+    def temp_table(self):
+        return f'load_{self.table}'
+
+
+# Classifies a chunk against the content last staged or written to
+# production for each natural key, stages only new and changed rows, and
+# returns the number of rows in each class and the number staged. Within a
+# chunk the last row of a key wins; rows are staged in key order so parallel
+# loads lock shared keys in the same order.
+CHANGE_MERGE = """
+WITH typed AS ({typed}),
+chunk AS (
+    SELECT DISTINCT ON (key_hash) *
+    FROM (
+        SELECT typed.*, md5({key})::UUID AS key_hash, md5(ROW({columns})::TEXT)::UUID AS content_hash
+        FROM typed
+    ) hashed
+    ORDER BY key_hash, line DESC
+),
+classified AS (
+    SELECT chunk.*,
+           CASE
+               WHEN current.content_hash IS NULL THEN 'insert'
+               WHEN current.content_hash = chunk.content_hash THEN 'unchanged'
+               ELSE 'update'
+           END AS change
+    FROM chunk
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(
+            (SELECT s.content_hash FROM {table} s WHERE s.key_hash = chunk.key_hash AND s.transformed_at IS NULL),
+            (SELECT h.content_hash FROM etl_row_hashes h WHERE h.entity = '{entity}' AND h.key_hash = chunk.key_hash)
+        ) AS content_hash
+    ) current ON true
+),
+staged AS (
+    INSERT INTO {table} ({columns}, key_hash, content_hash, batch_id, load_sequence, loaded_at)
+    SELECT {columns}, key_hash, content_hash, %(batch_id)s, %(sequence)s + line, now()
+    FROM classified
+    WHERE change <> 'unchanged'
+    ORDER BY key_hash
+    ON CONFLICT (key_hash) DO UPDATE SET
+        {updates}, content_hash = EXCLUDED.content_hash, batch_id = EXCLUDED.batch_id,
+        load_sequence = EXCLUDED.load_sequence, loaded_at = EXCLUDED.loaded_at, transformed_at = NULL
+    WHERE {table}.batch_id <> EXCLUDED.batch_id OR {table}.load_sequence <= EXCLUDED.load_sequence
+    RETURNING 1
+)
+SELECT count(*) FILTER (WHERE change = 'insert'),
+       count(*) FILTER (WHERE change = 'update'),
+       count(*) FILTER (WHERE change = 'unchanged'),
+       (SELECT count(*) FROM staged)
+FROM classified
+"""
+
+
+def change_merge(entity, table, typed, key, columns):
+    """
+    The CHANGE_MERGE of `entity` into `table`: `typed` selects `columns` (and
+    `line`) from the temp table, and `key` is the natural key expression.
+    """
+    return CHANGE_MERGE.format(
+        typed=typed, key=key, entity=entity, table=table, columns=', '.join(columns),
+        updates=', '.join(f'{column} = EXCLUDED.{column}' for column in columns),
+    )
+
+
+MERGE_FACILITIES = change_merge(
+    'facilities', 'staging_facilities',
+    """
+    SELECT line, btrim(name) AS name, btrim(state) AS state, btrim(lga) AS lga,
+           etl_numeric(lat, 10, 8)::NUMERIC(10, 8) AS lat,
+           etl_numeric(lon, 11, 8)::NUMERIC(11, 8) AS lon,
+           NULLIF(btrim(type), '') AS type
+    FROM load_staging_facilities
+    """,
+    "upper(name) || chr(31) || upper(state) || chr(31) || upper(lga)",
+    ('name', 'state', 'lga', 'lat', 'lon', 'type'),
+)
+
+MERGE_PATIENTS = change_merge(
+    'patients', 'staging_patients',
+    """
+    SELECT line, btrim(facility_name) AS facility_name, btrim(first_name) AS first_name,
+           btrim(last_name) AS last_name, NULLIF(btrim(sex), '') AS sex, etl_date(dob) AS dob,
+           NULLIF(btrim(phone), '') AS phone
+    FROM load_staging_patients
+    """,
+    "upper(facility_name) || chr(31) || upper(first_name) || chr(31) || upper(last_name)"
+    " || chr(31) || to_char(dob, 'YYYY-MM-DD')",
+    ('facility_name', 'first_name', 'last_name', 'sex', 'dob', 'phone'),
+)
+
+# Records and visits are keyed on the patient and their timestamp; rows
+# without a timestamp can only be told apart by their content
+MERGE_MEDICAL_RECORDS = change_merge(
+    'medical_records', 'staging_medical_records',
+    """
+    SELECT line, btrim(facility_name) AS facility_name, btrim(patient_first_name) AS patient_first_name,
+           btrim(patient_last_name) AS patient_last_name, NULLIF(btrim(record_type), '') AS record_type,
+           jsonb_strip_nulls(jsonb_build_object(
+               'diagnosis', NULLIF(btrim(diagnosis), ''),
+               'treatment', NULLIF(btrim(treatment), ''),
+               'medications', NULLIF(btrim(medications), ''),
+               'notes', NULLIF(btrim(notes), '')
+           )) AS data,
+           etl_timestamp(created_at) AS created_at
+    FROM load_staging_medical_records
+    """,
+    "ROW(upper(facility_name), upper(patient_first_name), upper(patient_last_name), record_type, created_at,"
+    " CASE WHEN created_at IS NULL THEN data END)::TEXT",
+    ('facility_name', 'patient_first_name', 'patient_last_name', 'record_type', 'data', 'created_at'),
+)
+
+MERGE_TRIAGE_VISITS = change_merge(
+    'triage_visits', 'staging_triage_visits',
+    """
+    SELECT line, btrim(facility_name) AS facility_name, btrim(patient_first_name) AS patient_first_name,
+           btrim(patient_last_name) AS patient_last_name,
+           etl_integer(triage_level) AS triage_level,
+           NULLIF(btrim(chief_complaint), '') AS chief_complaint,
+           NULLIF(btrim(vital_signs), '') AS vital_signs,
+           etl_text_array(conditions) AS likely_conditions,
+           etl_text_array(recommendations) AS recommendations,
+           NULLIF(btrim(language), '') AS language,
+           NULLIF(btrim(provider), '') AS provider,
+           etl_timestamp(created_at) AS created_at
+    FROM load_staging_triage_visits
+    """,
+    "ROW(upper(facility_name), upper(patient_first_name), upper(patient_last_name), created_at,"
+    " CASE WHEN created_at IS NULL THEN ROW(triage_level, chief_complaint, vital_signs, likely_conditions,"
+    " recommendations, language, provider)::TEXT END)::TEXT",
+    ('facility_name', 'patient_first_name', 'patient_last_name', 'triage_level', 'chief_complaint',
+     'vital_signs', 'likely_conditions', 'recommendations', 'language', 'provider', 'created_at'),
+)
+
+ENTITIES = {
+    'facilities': Entity(
+        'staging_facilities',
+        ('name', 'state', 'lga', 'lat', 'lon', 'type'),
+        ('name', 'state', 'lga'),
+        MERGE_FACILITIES,
+    ),
+    'patients': Entity(
+        'staging_patients',
+        ('facility_name', 'first_name', 'last_name', 'sex', 'dob', 'phone'),
+        ('facility_name', 'first_name', 'last_name', 'dob'),
+        MERGE_PATIENTS,
+    ),
+    'medical_records': Entity(
+        'staging_medical_records',
+        ('facility_name', 'patient_first_name', 'patient_last_name', 'record_type', 'diagnosis',
+         'treatment', 'medications', 'notes', 'created_at'),
+        ('facility_name', 'patient_first_name', 'patient_last_name'),
+        MERGE_MEDICAL_RECORDS,
+    ),
+    'triage_visits': Entity(
+        'staging_triage_visits',
+        ('facility_name', 'patient_first_name', 'patient_last_name', 'triage_level', 'chief_complaint',
+         'vital_signs', 'conditions', 'recommendations', 'language', 'provider', 'created_at'),
+        ('facility_name', 'patient_first_name', 'patient_last_name'),
+        MERGE_TRIAGE_VISITS,
+    ),
+}
+
+
+def _split(rows, count):
+    """Split row groups with `rows` rows each into `count` contiguous ranges of about equal rows"""
+    total, ranges, current, seen = sum(rows), [], [], 0
+    for index, num_rows in enumerate(rows):
+        current.append(index)
+        seen += num_rows
+        if len(ranges) < count - 1 and seen >= total * (len(ranges) + 1) / count:
+            ranges.append(current)
+            current = []
+    if current:
+        ranges.append(current)
+    return ranges
+
+
+def plan_loads(files, split_mb=LOAD_SPLIT_MB):
+    """
+    The load parts for `files` (as returned by the extractor): one per file,
+    or one per range of row groups for a Parquet intermediate whose source
+    was over `split_mb`. Each part is a dict of `PostgresLoader.load`
+    keyword arguments (name, path, row_groups, sequence).
+    """
+    parts = []
+    known = sorted((f for f in files if f.get('entity') in ENTITIES), key=lambda f: f['s3_key'])
+    for position, file_info in enumerate(known):
+        part = {'name': file_info['entity'], 'path': file_info['local_path'], 'row_groups': None,
+                'sequence': position << SEQUENCE_FILE_BITS}
+        count = math.ceil(file_info['size'] / (split_mb * 1024 * 1024))
+        if count < 2 or not part['path'].endswith('.parquet'):
+            parts.append(part)
+            continue
+        metadata = pq.read_metadata(part['path'])
+        rows = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+        for row_groups in _split(rows, min(count, len(rows))):
+            parts.append({**part, 'row_groups': row_groups,
+                          'sequence': part['sequence'] + sum(rows[:row_groups[0]])})
+    return parts
+
+
+class PostgresLoader:
+    """Streams CSV files into the staging tables, one audited load per file or part of one"""
+
+    def __init__(self, batch_id=None, chunk_rows=LOAD_CHUNK_ROWS):
+        self.batch_id = batch_id or uuid.uuid4().hex
+        self.chunk_rows = chunk_rows
+        self.last_stats = {}
+
+    def load_facilities(self, path):
+        return self.load('facilities', path)
+
+    def load_patients(self, path):
+        return self.load('patients', path)
+
+    def load_medical_records(self, path):
+        return self.load('medical_records', path)
+
+    def load_triage_visits(self, path):
+        return self.load('triage_visits', path)
+
+    def read_chunks(self, name, entity, path, row_groups=None):
+        """Record batches of the file (Parquet intermediate or CSV) with `entity.columns`"""
+        for batch in read_batches(path, name, entity.columns, self.chunk_rows, row_groups):
+            missing = [column for column in entity.required if column not in batch.schema.names]
+            if missing:
+                raise ValueError(f"{os.path.basename(path)} has no {', '.join(missing)} column")
+            yield batch
+
+    def load(self, name, path, row_groups=None, sequence=0):
+        """
+        Stage one file, or only `row_groups` of a Parquet intermediate, for
+        `name` (e.g. 'patients'); returns the rows staged (new or changed).
+        `sequence` is the run position of its first row, see `plan_loads`.
+        """
+        entity = ENTITIES[name]
+        source = path if row_groups is None else f'{path} (row groups {row_groups[0]}-{row_groups[-1]})'
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        processed = merged = rejected = 0
+        changes = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+        with closing(connect()) as connection:
+            ensure_schema(connection)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"CREATE TEMP TABLE IF NOT EXISTS {entity.temp_table} "
+                        f"(line BIGSERIAL, {', '.join(f'{column} TEXT' for column in entity.columns)}) "
+                        f"ON COMMIT DELETE ROWS"
+                    )
+                    invalid = ' OR '.join(
+                        f"{REQUIRED_CASTS[column]}({column}) IS NULL" if column in REQUIRED_CASTS
+                        else f"coalesce(btrim({column}), '') = ''"
+                        for column in entity.required
+                    )
+                    for batch in self.read_chunks(name, entity, path, row_groups):
+                        cursor.copy_expert(
+                            f"COPY {entity.temp_table} ({', '.join(entity.columns)}) FROM STDIN WITH (FORMAT csv)",
+                            to_csv_buffer(batch, entity.columns),
+                        )
+                        cursor.execute(f"DELETE FROM {entity.temp_table} WHERE {invalid}")
+                        rejected += cursor.rowcount
+                        cursor.execute(entity.merge, {'batch_id': self.batch_id, 'sequence': sequence})
+                        inserted, updated, unchanged, staged = cursor.fetchone()
+                        changes['inserted'] += inserted
+                        changes['updated'] += updated
+                        changes['unchanged'] += unchanged
+                        merged += staged
+                        connection.commit()
+                        processed += batch.num_rows
+            except Exception as e:
+                connection.rollback()
+                logger.error(f"Error loading {source} into {entity.table}: {str(e)}")
+                audit(connection, self.batch_id, entity.table, source, 'failed', started_at,
+                      processed, changes['inserted'], rejected, str(e),
+                      updated=changes['updated'], unchanged=changes['unchanged'])
+                raise
+
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"Loaded {processed:,} rows from {os.path.basename(source)} into {entity.table} in {elapsed:.1f}s "
+                f"({processed / max(elapsed, 1e-9):,.0f} rows/s): {changes['inserted']:,} new, "
+                f"{changes['updated']:,} changed, {changes['unchanged']:,} unchanged, {rejected:,} rejected"
+            )
+            audit(connection, self.batch_id, entity.table, source, 'success', started_at, processed,
+                  changes['inserted'], rejected, updated=changes['updated'], unchanged=changes['unchanged'])
+        self.last_stats = {
+            'entity': name, 'source': source, 'processed': processed, 'merged': merged, 'rejected': rejected,
+            **changes, 'started_at': started_at.isoformat(), 'seconds': round(elapsed, 3),
+        }
+        return merged
+
+    def commit_results(self, results):
+        """
+        Total the `last_stats` of every part loaded in this run per entity,
+        and record each total in etl_audit_log; returns the totals.
+        """
+        totals, started = {}, {}
+        for stats in results:
+            name = stats['entity']
+            total = totals.setdefault(name, dict.fromkeys(('parts',) + STAT_KEYS, 0))
+            total['parts'] += 1
+            for key in STAT_KEYS:
+                total[key] += stats[key]
+            started[name] = min(started.get(name, stats['started_at']), stats['started_at'])
+        with closing(connect()) as connection:
+            for name, total in totals.items():
+                audit(connection, self.batch_id, ENTITIES[name].table, None, 'success',
+                      datetime.fromisoformat(started[name]), total['processed'], total['inserted'],
+                      total['rejected'], updated=total['updated'], unchanged=total['unchanged'])
+        return totals
+
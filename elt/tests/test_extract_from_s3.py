@@ -0,0 +1,131 @@
+"""
+S3Extractor against moto's in-memory S3: first run, rerun, changed objects
+and manifest expiry. Skipped when moto is not installed:
+
+    pip install pytest moto
+    python -m pytest elt/tests
+"""
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+moto = pytest.importorskip('moto')
+
+import boto3  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+
+import extract_from_s3  # noqa: E402
+from extract_from_s3 import S3Extractor  # noqa: E402
+
+BUCKET = 'medilink-test'
+REGION = 'eu-west-1'
+INPUT = 'medical_records/input/'
+MANIFEST = 'medical_records/_manifest.json'
+
+FACILITIES = "name,state,lga,lat,lon,type\nGen Hosp,Lagos,Ikeja,6.5,3.3,General\n"
+PATIENTS = "facility_name,first_name,last_name,sex,dob,phone\nGen Hosp,Ada,Obi,F,1990-01-02,0803\n"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(name, 'testing')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name=REGION)
+        client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+        client.put_object(Bucket=BUCKET, Key=f'{INPUT}facilities.csv', Body=FACILITIES.encode())
+        client.put_object(Bucket=BUCKET, Key=f'{INPUT}2024/patients.csv', Body=PATIENTS.encode())
+        yield client
+
+
+@pytest.fixture
+def extractor(s3, tmp_path):
+    return S3Extractor(bucket=BUCKET, input_prefix=INPUT, archive_prefix='medical_records/archive/',
+                       local_dir=str(tmp_path), manifest_key=MANIFEST, max_workers=2, client=s3)
+
+
+def _fail_archive(s3_key):
+    raise RuntimeError('archive unavailable')
+
+
+def _manifest(s3):
+    return json.loads(s3.get_object(Bucket=BUCKET, Key=MANIFEST)['Body'].read())
+
+
+def test_first_run_converts_every_object(extractor, tmp_path):
+    files = extractor.extract_all()
+
+    assert [f['s3_key'] for f in files] == [f'{INPUT}2024/patients.csv', f'{INPUT}facilities.csv']
+    assert [f['entity'] for f in files] == ['patients', 'facilities']
+    for file_info in files:
+        assert file_info['local_path'].endswith('.parquet')
+        assert not os.path.exists(file_info['local_path'][:-len('.parquet')] + '.csv')
+    assert pq.read_table(files[1]['local_path']).column('name').to_pylist() == ['Gen Hosp']
+    assert extractor.last_stats['files'] == 2
+    assert extractor.last_stats['skipped'] == 0
+    assert extractor.last_stats['bytes'] == len(FACILITIES) + len(PATIENTS)
+    assert (tmp_path / '2024' / 'patients.parquet').exists()
+
+
+def test_archived_objects_are_recorded_and_moved(extractor, s3):
+    files = extractor.extract_all()
+
+    assert extractor.archive_files(files) == 2
+    assert set(_manifest(s3)) == {f['s3_key'] for f in files}
+    remaining = s3.list_objects_v2(Bucket=BUCKET, Prefix=INPUT).get('Contents', [])
+    assert remaining == []
+    assert extractor.extract_all() == []
+
+
+def test_rerun_skips_objects_in_the_manifest(extractor, monkeypatch):
+    # Archiving fails, so the objects stay in the input prefix; the manifest still covers them
+    monkeypatch.setattr(extractor, 'archive_file', _fail_archive)
+    assert extractor.archive_files(extractor.extract_all()) == 0
+
+    assert extractor.extract_all() == []
+    assert extractor.last_stats['skipped'] == 2
+    assert extractor.last_stats['bytes'] == 0
+
+
+def test_retry_reuses_the_converted_intermediate(extractor):
+    first = extractor.extract_all()
+    retry = extractor.extract_all()
+
+    assert [f['local_path'] for f in retry] == [f['local_path'] for f in first]
+    assert extractor.last_stats['bytes'] == 0
+
+
+def test_changed_object_is_fetched_again(extractor, s3, monkeypatch):
+    monkeypatch.setattr(extractor, 'archive_file', _fail_archive)
+    first = extractor.extract_all()
+    extractor.archive_files(first)
+
+    changed = FACILITIES + "PHC,Oyo,Ibadan,7.0,3.0,PHC\n"
+    s3.put_object(Bucket=BUCKET, Key=f'{INPUT}facilities.csv', Body=changed.encode())
+    files = extractor.extract_all()
+
+    assert [f['s3_key'] for f in files] == [f'{INPUT}facilities.csv']
+    assert files[0]['etag'] != next(f['etag'] for f in first if f['s3_key'] == files[0]['s3_key'])
+    assert extractor.last_stats['bytes'] == len(changed)
+    assert pq.read_table(files[0]['local_path']).column('name').to_pylist() == ['Gen Hosp', 'PHC']
+
+
+def test_expired_manifest_entries_are_dropped(extractor, s3, monkeypatch):
+    monkeypatch.setattr(extract_from_s3, 'S3_MANIFEST_RETENTION_DAYS', 30)
+    monkeypatch.setattr(extractor, 'archive_file', _fail_archive)
+    files = extractor.extract_all()
+    extractor.archive_files(files)
+
+    manifest = _manifest(s3)
+    expired = f'{INPUT}facilities.csv'
+    manifest[expired]['processed_at'] = (datetime.utcnow() - timedelta(days=31)).isoformat()
+    extractor.save_manifest(manifest)
+
+    assert set(_manifest(s3)) == {f'{INPUT}2024/patients.csv'}
+    assert [f['s3_key'] for f in extractor.extract_all()] == [expired]
+    assert extractor.last_stats['skipped'] == 1
@@ -0,0 +1,367 @@
+"""
+Data-quality validation of the Parquet intermediates before they are loaded
+
+The rules are compiled from the API's Pydantic schemas (backend/schemas.py),
+so the pipeline and the API enforce the same constraints: required fields,
+string lengths, numeric bounds and patterns become Arrow compute
+expressions evaluated a whole batch at a time. Foreign keys, which the
+source files carry as facility and patient names, are checked against the
+facilities and patients already in the database plus those arriving in the
+same run.
+
+Values the Parquet conversion could not parse (columnar.py keeps their text
+in `<column>_unparsed`) fail validation too, rather than loading as null.
+
+Rows failing any rule are written to `etl_quarantine` with their reasons,
+and each intermediate is rewritten with only the rows that passed.
+"""
+import json
+import logging
+import os
+import sys
+import time
+import typing
+from collections import namedtuple
+from contextlib import closing
+from datetime import date, datetime
+from functools import reduce
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from psycopg2.extras import execute_values
+
+from columnar import SCHEMAS, TIMESTAMP, is_parsed, unparsed_column
+from db import audit, connect, ensure_schema
+
+BACKEND_DIR = os.getenv(
+    'BACKEND_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+)
+sys.path.insert(0, BACKEND_DIR)
+
+from schemas import FacilityCreate, PatientCreate, MedicalRecordCreate, TriageVisitCreate  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+VALIDATE_BATCH_ROWS = int(os.getenv('VALIDATE_BATCH_ROWS', '500000'))
+KEY_SEPARATOR = '\x1f'
+
+FACILITY_REFERENCE = 'facility'
+PATIENT_REFERENCE = 'patient'
+
+# Schema per entity, and where each schema field comes from in the source
+# files: a column name, a reference checked by name, or None when the field
+# is built at load time
+ENTITY_SCHEMAS = {
+    'facilities': (FacilityCreate, {}),
+    'patients': (PatientCreate, {'facility_id': FACILITY_REFERENCE}),
+    'medical_records': (
+        MedicalRecordCreate,
+        {'facility_id': FACILITY_REFERENCE, 'patient_id': PATIENT_REFERENCE, 'data': None},
+    ),
+    'triage_visits': (
+        TriageVisitCreate,
+        {'facility_id': FACILITY_REFERENCE, 'patient_id': PATIENT_REFERENCE, 'likely_conditions': 'conditions'},
+    ),
+}
+# Run order: a file may only reference entities validated before it
+ENTITY_ORDER = ('facilities', 'patients', 'medical_records', 'triage_visits')
+
+KNOWN_FACILITIES = """
+SELECT upper(btrim(name)) FROM facilities
+UNION
+SELECT upper(btrim(name)) FROM staging_facilities
+"""
+
+# Records name a patient but not their date of birth: a name shared by patients
+# born on different days is ambiguous
+KNOWN_PATIENTS = """
+SELECT upper(btrim(f.name)) || chr(31) || upper(btrim(p.first_name)) || chr(31) || upper(btrim(p.last_name)), p.dob
+FROM patients p
+JOIN facilities f ON f.id = p.facility_id
+WHERE upper(btrim(f.name)) = ANY(%(facilities)s)
+UNION
+SELECT upper(btrim(facility_name)) || chr(31) || upper(btrim(first_name)) || chr(31) || upper(btrim(last_name)), dob
+FROM staging_patients
+WHERE upper(btrim(facility_name)) = ANY(%(facilities)s)
+"""
+
+
+class Rule(namedtuple('Rule', ['reason', 'column', 'invalid'])):
+    """`invalid(array)` returns a boolean array, true where the row breaks the rule"""
+
+
+def _strings(array):
+    return pc.cast(array, pa.string()) if pa.types.is_dictionary(array.type) else array
+
+
+def _base_type(annotation):
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    if typing.get_origin(annotation) is typing.Union and len(args) == 1:
+        annotation = args[0]
+    return typing.get_origin(annotation) or annotation
+
+
+def _constraint_rules(column, base_type, metadata):
+    rules = []
+    for constraint in metadata:
+        for attr, compare, text in (
+            ('gt', pc.less_equal, 'must be greater than'),
+            ('ge', pc.less, 'must be at least'),
+            ('lt', pc.greater_equal, 'must be less than'),
+            ('le', pc.greater, 'must be at most'),
+        ):
+            bound = getattr(constraint, attr, None)
+            if bound is not None and base_type in (int, float):
+                rules.append(Rule(f"{column} {text} {bound}", column,
+                                  lambda a, compare=compare, bound=bound: compare(a, bound)))
+        min_length = getattr(constraint, 'min_length', None)
+        if min_length is not None and base_type is str:
+            rules.append(Rule(f"{column} is shorter than {min_length}", column,
+                              lambda a, n=min_length: pc.less(pc.utf8_length(_strings(a)), n)))
+        max_length = getattr(constraint, 'max_length', None)
+        if max_length is not None and base_type is str:
+            rules.append(Rule(f"{column} is longer than {max_length}", column,
+                              lambda a, n=max_length: pc.greater(pc.utf8_length(_strings(a)), n)))
+        pattern = getattr(constraint, 'pattern', None)
+        if pattern is not None:
+            rules.append(Rule(f"{column} does not match {pattern}", column,
+                              lambda a, p=pattern: pc.invert(pc.match_substring_regex(_strings(a), p))))
+    return rules
+
+
+def compile_rules(model, sources):
+    """Column rules for the fields of a Pydantic `model` (references excluded)"""
+    rules = []
+    for name, field in model.model_fields.items():
+        column = sources.get(name, name)
+        if column in (None, FACILITY_REFERENCE, PATIENT_REFERENCE):
+            continue
+        base_type = _base_type(field.annotation)
+        if field.is_required():
+            rules.append(Rule(f"{column} is required", column, pc.is_null))
+        if base_type in (str, int, float):
+            rules.extend(_constraint_rules(column, base_type, field.metadata))
+    return rules
+
+
+def _type_name(type_):
+    if type_ == TIMESTAMP:
+        return 'an ISO-8601 timestamp'
+    if pa.types.is_date(type_):
+        return 'a YYYY-MM-DD date'
+    return 'an integer' if pa.types.is_integer(type_) else 'a number'
+
+
+def parse_rules(entity):
+    """Rules for the values of `entity` that did not parse as their column type"""
+    return [
+        Rule(f"{column} is not {_type_name(type_)}", unparsed_column(column), pc.is_valid)
+        for column, type_ in SCHEMAS[entity].items() if is_parsed(type_)
+    ]
+
+
+RULES = {
+    entity: compile_rules(model, sources) + parse_rules(entity)
+    for entity, (model, sources) in ENTITY_SCHEMAS.items()
+}
+
+
+def _keys(batch, columns):
+    parts = [pc.utf8_upper(pc.utf8_trim_whitespace(_strings(_column(batch, column)))) for column in columns]
+    return parts[0] if len(parts) == 1 else pc.binary_join_element_wise(*parts, KEY_SEPARATOR)
+
+
+def _column(batch, name):
+    index = batch.schema.get_field_index(name)
+    return batch.column(index) if index >= 0 else pa.nulls(batch.num_rows, pa.string())
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+class Validator:
+    """Validates a run's intermediates, quarantining the rows that fail"""
+
+    def __init__(self, batch_id, batch_rows=VALIDATE_BATCH_ROWS):
+        self.batch_id = batch_id
+        self.batch_rows = batch_rows
+        self.facilities = None
+        self.patients = None
+        self.ambiguous_patients = None
+
+    def reference_checks(self, entity):
+        """
+        (reason, columns, invalid) for the references `entity` makes, where
+        `invalid(keys)` marks the normalized keys of `columns` that break it
+        """
+        sources = ENTITY_SCHEMAS[entity][1].values()
+        checks = []
+        if FACILITY_REFERENCE in sources:
+            checks.append(("unknown facility", ['facility_name'],
+                           lambda keys: pc.invert(pc.is_in(keys, value_set=self.facilities))))
+        if PATIENT_REFERENCE in sources:
+            columns = ['facility_name', 'patient_first_name', 'patient_last_name']
+            checks.append(("unknown patient at facility", columns,
+                           lambda keys: pc.invert(pc.is_in(keys, value_set=self.patients))))
+            checks.append(("ambiguous patient at facility", columns,
+                           lambda keys: pc.is_in(keys, value_set=self.ambiguous_patients)))
+        return checks
+
+    def check(self, entity, batch):
+        """
+        A boolean array marking the invalid rows of `batch`, and the
+        (reason, mask) pair of every rule it was checked against.
+        """
+        failures = []
+        for rule in RULES[entity]:
+            failures.append((rule.reason, pc.fill_null(rule.invalid(_column(batch, rule.column)), False)))
+        for reason, columns, invalid in self.reference_checks(entity):
+            failures.append((reason, pc.fill_null(invalid(_keys(batch, columns)), True)))
+
+        return reduce(pc.or_, [mask for _, mask in failures]), failures
+
+    def validate_file(self, connection, file_info):
+        """Rewrite one intermediate with its valid rows; returns (rows, quarantined)"""
+        entity, path = file_info['entity'], file_info['local_path']
+        parquet = pq.ParquetFile(path, memory_map=True)
+        partial = f'{path}.partial'
+        rows = quarantined = 0
+
+        with pq.ParquetWriter(partial, parquet.schema_arrow, compression='zstd') as writer:
+            for batch in parquet.iter_batches(batch_size=self.batch_rows):
+                invalid, failures = self.check(entity, batch)
+                bad = pc.sum(invalid).as_py() or 0
+                if bad:
+                    self.quarantine(connection, entity, path, rows, batch, invalid, failures)
+                    batch = batch.filter(pc.invert(invalid))
+                writer.write_batch(batch)
+                rows += batch.num_rows + bad
+                quarantined += bad
+        os.replace(partial, path)
+        return rows, quarantined
+
+    def quarantine(self, connection, entity, path, offset, batch, invalid, failures):
+        indices = pc.indices_nonzero(invalid)
+        records = batch.take(indices).to_pylist()
+        reasons = [mask.take(indices).to_pylist() for _, mask in failures]
+        values = [
+            (
+                self.batch_id, entity, path, offset + index + 1,
+                [failures[j][0] for j in range(len(failures)) if reasons[j][i]],
+                json.dumps({key: _json_value(value) for key, value in record.items()}),
+            )
+            for i, (index, record) in enumerate(zip(indices.to_pylist(), records))
+        ]
+        with connection.cursor() as cursor:
+            execute_values(
+                cursor,
+                "INSERT INTO etl_quarantine (batch_id, entity, source_file, row_number, reasons, record) VALUES %s",
+                values,
+                page_size=1000,
+            )
+        connection.commit()
+
+    @staticmethod
+    def _file_keys(files, columns):
+        """Distinct normalized keys of `columns` across the intermediates in `files`"""
+        keys = []
+        for file_info in files:
+            parquet = pq.ParquetFile(file_info['local_path'], memory_map=True)
+            present = [column for column in columns if column in parquet.schema_arrow.names]
+            for batch in parquet.iter_batches(batch_size=VALIDATE_BATCH_ROWS, columns=present):
+                keys.append(pc.unique(_keys(batch, columns)))
+        return keys
+
+    @staticmethod
+    def _union(arrays):
+        return pc.unique(pa.concat_arrays([pc.cast(array, pa.string()) for array in arrays]))
+
+    def _known_facilities(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(KNOWN_FACILITIES)
+            return pa.array([row[0] for row in cursor.fetchall()], pa.string())
+
+    def _known_patients(self, connection, files):
+        """(key, dob) of the stored patients at every facility the intermediates in `files` name"""
+        names = set()
+        for keys in self._file_keys(files, ['facility_name']):
+            names.update(name for name in keys.to_pylist() if name)
+        with connection.cursor() as cursor:
+            cursor.execute(KNOWN_PATIENTS, {'facilities': sorted(names)})
+            rows = cursor.fetchall()
+        return pa.table({
+            'key': pa.array([row[0] for row in rows], pa.string()),
+            'dob': pa.array([row[1] for row in rows], pa.date32()),
+        })
+
+    @staticmethod
+    def _file_patients(files):
+        """(key, dob) of the patients in the intermediates in `files`"""
+        columns = ['facility_name', 'first_name', 'last_name']
+        tables = []
+        for file_info in files:
+            parquet = pq.ParquetFile(file_info['local_path'], memory_map=True)
+            present = [column for column in columns + ['dob'] if column in parquet.schema_arrow.names]
+            for batch in parquet.iter_batches(batch_size=VALIDATE_BATCH_ROWS, columns=present):
+                tables.append(pa.table({
+                    'key': pc.cast(_keys(batch, columns), pa.string()),
+                    'dob': pc.cast(_column(batch, 'dob'), pa.date32()),
+                }))
+        return tables
+
+    def _index_patients(self, patients):
+        """Known patient keys, and those shared by patients with different dates of birth"""
+        births = pa.concat_tables(patients).group_by('key').aggregate([('dob', 'count_distinct')])
+        self.patients = births['key'].combine_chunks()
+        ambiguous = pc.greater(births['dob_count_distinct'], 1)
+        self.ambiguous_patients = births.filter(ambiguous)['key'].combine_chunks()
+
+    def _validate_entity(self, connection, entity, files):
+        counts = {'rows': 0, 'valid': 0, 'quarantined': 0}
+        for file_info in files:
+            started_at = datetime.utcnow()
+            started = time.perf_counter()
+            try:
+                rows, quarantined = self.validate_file(connection, file_info)
+            except Exception as e:
+                logger.error(f"Error validating {file_info['filename']}: {str(e)}")
+                connection.rollback()
+                audit(connection, self.batch_id, f'validate_{entity}', file_info['local_path'], 'failed',
+                      started_at, error=str(e))
+                raise
+            counts['rows'] += rows
+            counts['valid'] += rows - quarantined
+            counts['quarantined'] += quarantined
+            logger.info(
+                f"Validated {rows:,} rows of {file_info['filename']} in {time.perf_counter() - started:.2f}s; "
+                f"{quarantined:,} quarantined"
+            )
+            audit(connection, self.batch_id, f'validate_{entity}', file_info['local_path'], 'success',
+                  started_at, rows, rows - quarantined, quarantined)
+        return counts
+
+    def validate_all(self, files):
+        """
+        Validate the intermediates in `files` (as returned by the extractor)
+        in reference order, so records may refer to facilities and patients
+        arriving in the same run. Returns {entity: {'rows', 'valid', 'quarantined'}}.
+        """
+        by_entity = {entity: [f for f in files if f.get('entity') == entity] for entity in ENTITY_ORDER}
+        results = {}
+        with closing(connect()) as connection:
+            ensure_schema(connection)
+            self.facilities = self._known_facilities(connection)
+            results['facilities'] = self._validate_entity(connection, 'facilities', by_entity['facilities'])
+            self.facilities = self._union([self.facilities] + self._file_keys(by_entity['facilities'], ['name']))
+
+            results['patients'] = self._validate_entity(connection, 'patients', by_entity['patients'])
+            referencing = by_entity['medical_records'] + by_entity['triage_visits']
+            self._index_patients(
+                [self._known_patients(connection, referencing)] + self._file_patients(by_entity['patients'])
+            )
+
+            for entity in ('medical_records', 'triage_visits'):
+                results[entity] = self._validate_entity(connection, entity, by_entity[entity])
+        return results